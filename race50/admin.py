@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Session, Lap
+from .models import User, Session, Lap, PackedLaps, UploadJob
 
 # Register your models here.
 admin.site.register(User, UserAdmin)
 admin.site.register(Session)
-admin.site.register(Lap)
\ No newline at end of file
+admin.site.register(Lap)
+admin.site.register(UploadJob)
+admin.site.register(PackedLaps)
\ No newline at end of file
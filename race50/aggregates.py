@@ -0,0 +1,77 @@
+from itertools import groupby
+
+from django.db import transaction
+
+from . import analytics, leaderboards, trends
+from .models import Session, TrackAggregate
+from .storage import column_arrays, load_columns
+
+# Sessions kept for the rolling averages
+ROLLING_WINDOW = 5
+
+
+def apply_session(aggregate, session):
+    """Folds one session into an aggregate (in memory)."""
+    aggregate.add_session(session)
+    aggregate.recent_best_laps = (aggregate.recent_best_laps + [session.best_lap_ms])[-ROLLING_WINDOW:]
+    aggregate.recent_avg_laps = (aggregate.recent_avg_laps + [session.avg_lap_ms])[-ROLLING_WINDOW:]
+
+
+def record_sessions(sessions):
+    """
+    Updates the aggregates and trend buckets of newly created sessions, and
+    the track leaderboards from them. Must run inside the transaction that
+    creates them; the rows are locked while updating.
+    """
+    sessions = sorted(sessions, key=lambda s: (s.user_id, s.track))
+    for ((user_id, track), group) in groupby(sessions, key=lambda s: (s.user_id, s.track)):
+        aggregate, _ = TrackAggregate.objects.select_for_update().get_or_create(user_id=user_id, track=track)
+        for session in group:
+            apply_session(aggregate, session)
+        aggregate.save()
+        leaderboards.record(aggregate)
+    trends.record_sessions(sessions)
+
+
+def fill_best_sectors(session):
+    """Computes best sector times for sessions uploaded before they were stored."""
+    summary = analytics.summarize(*column_arrays(load_columns(session)))
+    session.best_s1_ms = summary["best_s1_ms"]
+    session.best_s2_ms = summary["best_s2_ms"]
+    session.best_s3_ms = summary["best_s3_ms"]
+    session.save(update_fields=["best_s1_ms", "best_s2_ms", "best_s3_ms", "updated_at"])
+
+
+def rebuild(users=None, chunk_size=500):
+    """
+    Recomputes aggregates from scratch, one (user, track) at a time, then
+    rebuilds the leaderboards from them.
+    """
+    sessions = Session.objects.order_by("user_id", "track", "created_at", "id")
+    aggregates = TrackAggregate.objects.all()
+    if users is not None:
+        sessions = sessions.filter(user__in=users)
+        aggregates = aggregates.filter(user__in=users)
+
+    rebuilt = 0
+    with transaction.atomic():
+        aggregates.delete()
+        iterator = sessions.iterator(chunk_size=chunk_size)
+        for ((user_id, track), group) in groupby(iterator, key=lambda s: (s.user_id, s.track)):
+            aggregate = TrackAggregate(user_id=user_id, track=track)
+            for session in group:
+                if session.best_s1_ms is None:
+                    fill_best_sectors(session)
+                apply_session(aggregate, session)
+            aggregate.save()
+            rebuilt += 1
+    leaderboards.compact()
+    return rebuilt
+
+
+def track_aggregate(user, track):
+    return TrackAggregate.objects.filter(user=user, track=track).first()
+
+
+async def atrack_aggregate(user, track):
+    return await TrackAggregate.objects.filter(user=user, track=track).afirst()
@@ -0,0 +1,398 @@
+import math
+import re
+from array import array
+
+import numpy as np
+
+# Vectorized session analytics over integer lap columns. This module must not
+# import Django so it can be loaded by process-pool workers.
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+# Laps outside [Q1 - k*IQR, Q3 + k*IQR] are ignored by the filtered consistency
+IQR_FENCE = 1.5
+
+# Laps in the rolling standard deviation of lap_metrics()
+ROLLING_STD_WINDOW = 5
+
+# Bits of the per-lap outlier flags; a lap with no bit set is a clean lap
+OUTLIER_LAP = 1     # the lap time is far slower than the session's
+OUTLIER_SECTOR = 2  # one of its sector times is
+OUTLIER_NOTE = 4    # its note reports an incident
+OUTLIER_REASONS = ((OUTLIER_LAP, "slow lap"), (OUTLIER_SECTOR, "slow sector"), (OUTLIER_NOTE, "incident"))
+
+# Notes that mark a lap as not representative, as in "traffic/mistake"
+INCIDENT_KEYWORDS = ("traffic", "mistake", "error", "spin", "crash", "off track", "yellow", "red flag", "pit")
+# Robust z-score, 0.6745 * (x - median) / MAD, above which a slow time is an outlier
+MAD_Z = 3.5
+# Shorter sessions are only flagged through their notes
+OUTLIER_MIN_LAPS = 5
+
+
+def as_array(column):
+    """
+    Returns a column as an int64 array. array('I') and uint32 buffers are
+    viewed without copying before the widening conversion.
+    """
+    if isinstance(column, np.ndarray):
+        return column.astype(np.int64, copy=False)
+    if isinstance(column, array) and column.typecode == "I":
+        return np.frombuffer(column, dtype=np.uint32).astype(np.int64)
+    return np.asarray(column, dtype=np.int64)
+
+
+def consistency_percent(total):
+    """
+    (1 - stddev/mean) * 100 with the population stddev. The variance is
+    computed from exact integer sums, so it does not drift on long sessions.
+    """
+    return _consistency(len(total), int(total.sum()), int(np.dot(total, total)))
+
+
+def _consistency(n, s, sq):
+    if n == 0:
+        return None
+    mean = s / n
+    variance = (n * sq - s * s) / (n * n)
+    return (1 - (variance ** 0.5 / mean)) * 100
+
+
+def filtered_consistency_percent(total, k=IQR_FENCE):
+    """Consistency over the laps inside the IQR fences."""
+    if len(total) == 0:
+        return None
+    q1, q3 = np.percentile(total, (25, 75))
+    iqr = q3 - q1
+    inside = total[(total >= q1 - k * iqr) & (total <= q3 + k * iqr)]
+    return consistency_percent(inside)
+
+
+def incident_mask(notes, count, keywords=INCIDENT_KEYWORDS):
+    """Boolean mask of the laps whose note, in a sparse {row index: note} dict, mentions a keyword."""
+    mask = np.zeros(count, dtype=bool)
+    pattern = re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+    mask[[i for (i, note) in notes.items() if pattern.search(note)]] = True
+    return mask
+
+
+def slow_outliers(values, k=IQR_FENCE, z=MAD_Z):
+    """
+    Mask of the values far slower than the rest: above the upper IQR fence
+    and, unless most values are identical (MAD 0), above the MAD z-score.
+    Fast values are never flagged.
+    """
+    if len(values) < OUTLIER_MIN_LAPS:
+        return np.zeros(len(values), dtype=bool)
+    q1, median, q3 = np.percentile(values, (25, 50, 75))
+    mad = np.median(np.abs(values - median))
+    return _slow_mask(values, (q1, median, q3, mad), k, z)
+
+
+def _slow_mask(values, fence, k=IQR_FENCE, z=MAD_Z):
+    (q1, median, q3, mad) = fence
+    outside = values > q3 + k * (q3 - q1)
+    if mad:
+        outside &= 0.6745 * (values - median) / mad > z
+    return outside
+
+
+def outlier_flags(s1, s2, s3, total, incidents=None):
+    """Per-lap OUTLIER_* bitmask (uint8) from the lap and sector times and an incident_mask()."""
+    return _flags(slow_outliers(total), slow_outliers(s1) | slow_outliers(s2) | slow_outliers(s3), incidents)
+
+
+def _flags(slow_lap, slow_sector, incidents):
+    flags = slow_lap.astype(np.uint8) * OUTLIER_LAP
+    flags |= slow_sector.astype(np.uint8) * OUTLIER_SECTOR
+    if incidents is not None:
+        flags |= incidents.astype(np.uint8) * OUTLIER_NOTE
+    return flags
+
+
+def percentiles(total, qs=DEFAULT_PERCENTILES):
+    if len(total) == 0:
+        return {}
+    return {q: float(v) for (q, v) in zip(qs, np.percentile(total, qs))}
+
+
+def rolling_best(total):
+    """Best lap so far at every lap."""
+    return np.minimum.accumulate(total)
+
+
+def sector_deltas(s1, s2, s3):
+    """Per-lap loss in each sector against that sector's best, in ms."""
+    return s1 - s1.min(), s2 - s2.min(), s3 - s3.min()
+
+
+def ranks(values):
+    """1-based rank of every value within its column; ties share the best rank."""
+    return np.searchsorted(np.sort(values), values, side="left") + 1
+
+
+def rolling_std(total, window=ROLLING_STD_WINDOW):
+    """
+    Population stddev of each lap and the window - 1 laps before it, NaN
+    until the window is full. Uses exact integer running sums.
+    """
+    result = np.full(len(total), np.nan)
+    if len(total) < window:
+        return result
+    s = np.concatenate(([0], np.cumsum(total)))
+    sq = np.concatenate(([0], np.cumsum(total * total)))
+    window_s = s[window:] - s[:-window]
+    window_sq = sq[window:] - sq[:-window]
+    variance = (window * window_sq - window_s * window_s) / (window * window)
+    result[window - 1:] = np.sqrt(np.maximum(variance, 0))
+    return result
+
+
+def lap_metrics(lap, s1, s2, s3, total, window=ROLLING_STD_WINDOW, incidents=None):
+    """
+    Derived per-lap columns: delta to the best lap and to the theoretical
+    best lap (ms), the rank of each sector time within the session, the
+    rolling stddev of lap times and the outlier flags.
+    """
+    s1, s2, s3, total = (as_array(c) for c in (s1, s2, s3, total))
+    if len(total) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {"delta_best": empty, "delta_tbl": empty, "s1_rank": empty, "s2_rank": empty,
+                "s3_rank": empty, "rolling_std": np.zeros(0), "outlier": np.zeros(0, dtype=np.uint8)}
+    tbl = int(s1.min()) + int(s2.min()) + int(s3.min())
+    return {
+        "delta_best": total - total.min(),
+        "delta_tbl": total - tbl,
+        "s1_rank": ranks(s1),
+        "s2_rank": ranks(s2),
+        "s3_rank": ranks(s3),
+        "rolling_std": rolling_std(total, window),
+        "outlier": outlier_flags(s1, s2, s3, total, incidents),
+    }
+
+
+# Byte layout of packed lap_metrics(): little-endian columns, one after another
+METRIC_DTYPES = (("delta_best", "<i4"), ("delta_tbl", "<i4"), ("s1_rank", "<i4"), ("s2_rank", "<i4"),
+                 ("s3_rank", "<i4"), ("rolling_std", "<f8"), ("outlier", "u1"))
+_UNPACKED_DTYPES = {"<i4": np.int64, "<f8": np.float64, "u1": np.uint8}
+
+
+def pack_metrics(metrics):
+    return b"".join(metrics[name].astype(dtype).tobytes() for (name, dtype) in METRIC_DTYPES)
+
+
+def unpack_metrics(blob, count):
+    """The metrics of pack_metrics(), or None for blobs written before the outlier flags."""
+    blob = bytes(blob)
+    if len(blob) < sum(np.dtype(dtype).itemsize for (_, dtype) in METRIC_DTYPES) * count:
+        return None
+    metrics = {}
+    offset = 0
+    for (name, dtype) in METRIC_DTYPES:
+        column = np.frombuffer(blob, dtype=dtype, count=count, offset=offset)
+        metrics[name] = column.astype(_UNPACKED_DTYPES[dtype])
+        offset += column.nbytes
+    return metrics
+
+
+def summarize(lap, s1, s2, s3, total, outliers=None):
+    """
+    Session summary from lap columns. Returns the same keys and values as
+    the original upload view, plus median, percentiles, the IQR-filtered
+    consistency and the count, average and consistency of the clean laps:
+    those without `outliers` flags (by default the lap_metrics() flags,
+    without notes).
+    """
+    lap, s1, s2, s3, total = (as_array(c) for c in (lap, s1, s2, s3, total))
+    if outliers is None:
+        outliers = outlier_flags(s1, s2, s3, total)
+    clean = total[outliers == 0]
+    best_index = int(np.argmin(total))
+    best_s1, best_s2, best_s3 = int(s1.min()), int(s2.min()), int(s3.min())
+    return {
+        "laps_count": int(len(total)),
+        "best_lap_ms": int(total[best_index]),
+        "best_lap_number": int(lap[best_index]),
+        "worst_lap_ms": int(total.max()),
+        "avg_lap_ms": int(total.sum()) / len(total),
+        "tbl_ms": best_s1 + best_s2 + best_s3,
+        "consistency_percent": consistency_percent(total),
+        "best_s1_ms": best_s1,
+        "best_s2_ms": best_s2,
+        "best_s3_ms": best_s3,
+        "median_lap_ms": float(np.median(total)),
+        "percentiles": percentiles(total),
+        "filtered_consistency_percent": filtered_consistency_percent(total),
+        "clean_laps_count": int(len(clean)),
+        "clean_avg_lap_ms": int(clean.sum()) / len(clean) if len(clean) else None,
+        "clean_consistency_percent": consistency_percent(clean),
+    }
+
+
+def _lerp(a, b, t):
+    # np.percentile's linear interpolation, rounding included
+    diff = b - a
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+
+class Histogram:
+    """
+    Counts of the distinct values of an integer column, built chunk by
+    chunk. Lap and sector times are whole milliseconds in a bounded range,
+    so its size stops growing with the number of laps. Order statistics
+    match np.percentile and np.median over the whole column.
+    """
+
+    def __init__(self):
+        self.values = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.count = 0
+        self._cumulative = None
+
+    def add(self, column):
+        values, counts = np.unique(as_array(column), return_counts=True)
+        if len(self.values):
+            values, index = np.unique(np.concatenate((self.values, values)), return_inverse=True)
+            merged = np.zeros(len(values), dtype=np.int64)
+            np.add.at(merged, index, np.concatenate((self.counts, counts)))
+            counts = merged
+        self.values, self.counts = values, counts.astype(np.int64)
+        self.count += len(column)
+        self._cumulative = None
+
+    def cumulative(self):
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.counts)
+        return self._cumulative
+
+    def nth(self, k):
+        """The k-th smallest value, 0-based."""
+        return int(self.values[np.searchsorted(self.cumulative(), k, side="right")])
+
+    def percentile(self, q):
+        virtual = (self.count - 1) * (q / 100)
+        if virtual >= self.count - 1:
+            return float(self.nth(self.count - 1))
+        previous = math.floor(virtual)
+        return _lerp(self.nth(previous), self.nth(previous + 1), virtual - previous)
+
+    def median_deviation(self, center):
+        """np.median(np.abs(column - center))."""
+        deviations = np.abs(self.values - center)
+        order = np.argsort(deviations, kind="stable")
+        deviations, cumulative = deviations[order], np.cumsum(self.counts[order])
+
+        def nth(k):
+            return float(deviations[np.searchsorted(cumulative, k, side="right")])
+
+        half = self.count // 2
+        return nth(half) if self.count % 2 else (nth(half - 1) + nth(half)) / 2
+
+    def sums(self, low=-math.inf, high=math.inf):
+        """(count, sum, sum of squares) of the values in [low, high], as exact ints."""
+        inside = (self.values >= low) & (self.values <= high)
+        values, counts = self.values[inside], self.counts[inside]
+        return int(counts.sum()), int(np.dot(values, counts)), int(np.dot(values * values, counts))
+
+    def ranks(self, values):
+        """ranks() of `values` within the whole column; every value must have been added."""
+        below = self.cumulative() - self.counts
+        return below[np.searchsorted(self.values, values)] + 1
+
+    def fence(self):
+        """The (q1, median, q3, MAD) of slow_outliers(), or None below OUTLIER_MIN_LAPS."""
+        if self.count < OUTLIER_MIN_LAPS:
+            return None
+        q1, median, q3 = (self.percentile(q) for q in (25, 50, 75))
+        return q1, median, q3, self.median_deviation(median)
+
+
+class SessionFold:
+    """
+    summarize() and lap_metrics() folded over a session's laps in chunks,
+    so their memory does not grow with the session. Pass every chunk to
+    add(), then every chunk again, in the same order, to metrics();
+    summary() is complete after the second pass.
+    """
+
+    def __init__(self, window=ROLLING_STD_WINDOW):
+        self.window = window
+        self.sum = self.squares = 0
+        self.best_lap_ms = self.best_lap_number = self.worst_lap_ms = None
+        self.histograms = {name: Histogram() for name in ("s1", "s2", "s3", "total")}
+        self.clean = (0, 0, 0)
+        self._tail = np.zeros(0, dtype=np.int64)
+        self._fences = None
+
+    @property
+    def count(self):
+        return self.histograms["total"].count
+
+    def add(self, lap, s1, s2, s3, total):
+        lap, total = as_array(lap), as_array(total)
+        if not len(total):
+            return
+        best = int(np.argmin(total))
+        if self.best_lap_ms is None or total[best] < self.best_lap_ms:
+            self.best_lap_ms, self.best_lap_number = int(total[best]), int(lap[best])
+        self.worst_lap_ms = max(self.worst_lap_ms or 0, int(total.max()))
+        self.sum += int(total.sum())
+        self.squares += int(np.dot(total, total))
+        for (name, column) in zip(("s1", "s2", "s3", "total"), (s1, s2, s3, total)):
+            self.histograms[name].add(column)
+
+    @property
+    def tbl_ms(self):
+        return sum(self.histograms[name].nth(0) for name in ("s1", "s2", "s3"))
+
+    def metrics(self, s1, s2, s3, total, incidents=None):
+        """lap_metrics() of the next chunk."""
+        s1, s2, s3, total = (as_array(c) for c in (s1, s2, s3, total))
+        if self._fences is None:
+            self._fences = {name: histogram.fence() for (name, histogram) in self.histograms.items()}
+
+        def slow(name, values):
+            fence = self._fences[name]
+            return np.zeros(len(values), dtype=bool) if fence is None else _slow_mask(values, fence)
+
+        # The laps before the chunk complete its first rolling windows
+        recent = np.concatenate((self._tail, total))
+        self._tail = recent[len(recent) - (self.window - 1):] if self.window > 1 else self._tail
+        flags = _flags(slow("total", total), slow("s1", s1) | slow("s2", s2) | slow("s3", s3), incidents)
+        clean = total[flags == 0]
+        (n, s, sq) = self.clean
+        self.clean = (n + len(clean), s + int(clean.sum()), sq + int(np.dot(clean, clean)))
+        return {
+            "delta_best": total - self.best_lap_ms,
+            "delta_tbl": total - self.tbl_ms,
+            "s1_rank": self.histograms["s1"].ranks(s1),
+            "s2_rank": self.histograms["s2"].ranks(s2),
+            "s3_rank": self.histograms["s3"].ranks(s3),
+            "rolling_std": rolling_std(recent, self.window)[len(recent) - len(total):],
+            "outlier": flags,
+        }
+
+    def summary(self):
+        """summarize() of the session, with the clean laps of the metrics() pass."""
+        total = self.histograms["total"]
+        q1, q3 = total.percentile(25), total.percentile(75)
+        (clean_n, clean_s, clean_sq) = self.clean
+        best_s1, best_s2, best_s3 = (self.histograms[name].nth(0) for name in ("s1", "s2", "s3"))
+        return {
+            "laps_count": self.count,
+            "best_lap_ms": self.best_lap_ms,
+            "best_lap_number": self.best_lap_number,
+            "worst_lap_ms": self.worst_lap_ms,
+            "avg_lap_ms": self.sum / self.count,
+            "tbl_ms": best_s1 + best_s2 + best_s3,
+            "consistency_percent": _consistency(self.count, self.sum, self.squares),
+            "best_s1_ms": best_s1,
+            "best_s2_ms": best_s2,
+            "best_s3_ms": best_s3,
+            "median_lap_ms": total.percentile(50),
+            "percentiles": {q: total.percentile(q) for q in DEFAULT_PERCENTILES},
+            "filtered_consistency_percent": _consistency(
+                *total.sums(q1 - IQR_FENCE * (q3 - q1), q3 + IQR_FENCE * (q3 - q1))),
+            "clean_laps_count": clean_n,
+            "clean_avg_lap_ms": clean_s / clean_n if clean_n else None,
+            "clean_consistency_percent": _consistency(clean_n, clean_s, clean_sq),
+        }
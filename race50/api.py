@@ -0,0 +1,232 @@
+import json
+import zlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
+
+from .cache import aget_user_value, aset_user_value
+from .export import streaming_response
+from .models import Session, Lap, PackedLaps
+from .pagination import akeyset_page
+from .storage import COLUMNS, LAP_CHUNK_SIZE, METRICS, LapColumns, load_columns
+
+# Read-only JSON API. A session's id, updated_at and lap count make a
+# strong validator for ETag and Last-Modified; updated_at moves whenever
+# compute_lap_metrics or pack_laps rewrite a session, and unchanged
+# resources answer 304 without being serialized.
+
+API_PAGE_SIZE = 100
+
+# The session page requests columns with ?v=<updated_at>, so a rewritten
+# session gets a new URL and clients may reuse a payload this long
+COLUMNS_MAX_AGE = 3600
+
+SUMMARY_FIELDS = (
+    "id", "external_id", "track", "date", "laps_count", "best_lap_ms", "best_lap_number",
+    "worst_lap_ms", "avg_lap_ms", "tbl_ms", "consistency_percent",
+    "best_s1_ms", "best_s2_ms", "best_s3_ms", "created_at",
+)
+
+
+def _unauthorized():
+    return JsonResponse({"error": "Authentication required."}, status=401)
+
+
+def api_login_required(view):
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # Resolved here so the view never loads the user lazily
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return _unauthorized()
+            return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _unauthorized()
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    django.views.decorators.http.condition for async views whose ETag and
+    Last-Modified callbacks are coroutines, so they can use the async ORM.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag = await etag_func(request, *args, **kwargs) if etag_func else None
+            etag = quote_etag(etag) if etag is not None else None
+            last_modified = await last_modified_func(request, *args, **kwargs) if last_modified_func else None
+            last_modified = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def _meta_query(request, session_id):
+    return Session.objects.filter(user=request.user, id=session_id).values("id", "updated_at", "laps_count")
+
+
+# The meta row is shared by the ETag and Last-Modified callbacks and the view
+def _session_meta(request, session_id):
+    if not hasattr(request, "_race50_session_meta"):
+        request._race50_session_meta = _meta_query(request, session_id).first()
+    return request._race50_session_meta
+
+
+async def _asession_meta(request, session_id):
+    if not hasattr(request, "_race50_session_meta"):
+        request._race50_session_meta = await _meta_query(request, session_id).afirst()
+    return request._race50_session_meta
+
+
+def _meta_etag(meta):
+    if meta is None:
+        return None
+    return f'"s{meta["id"]}-{meta["updated_at"].timestamp()}-{meta["laps_count"]}"'
+
+
+def _session_etag(request, session_id):
+    return _meta_etag(_session_meta(request, session_id))
+
+
+def _session_last_modified(request, session_id):
+    meta = _session_meta(request, session_id)
+    return meta["updated_at"] if meta else None
+
+
+async def _asession_etag(request, session_id):
+    return _meta_etag(await _asession_meta(request, session_id))
+
+
+async def _asession_last_modified(request, session_id):
+    meta = await _asession_meta(request, session_id)
+    return meta["updated_at"] if meta else None
+
+
+async def _list_etag(request):
+    stats = await Session.objects.filter(user=request.user).aaggregate(
+        count=Count("id"), last=Max("id"), updated=Max("updated_at"))
+    updated = stats["updated"].timestamp() if stats["updated"] else 0
+    query = zlib.crc32(request.GET.urlencode().encode())
+    return f'"l{stats["count"]}-{stats["last"]}-{updated}-{query:x}"'
+
+
+def _serialize(session):
+    data = dict(session)
+    data["date"] = data["date"].isoformat()
+    data["created_at"] = data["created_at"].isoformat()
+    return data
+
+
+@require_GET
+@api_login_required
+@async_condition(etag_func=_list_etag)
+async def sessions(request):
+    rows = Session.objects.filter(user=request.user)
+    if request.GET.get("track"):
+        rows = rows.filter(track=request.GET["track"])
+    rows, next_cursor = await akeyset_page(rows.values(*SUMMARY_FIELDS), request.GET.get("cursor"), API_PAGE_SIZE)
+    return JsonResponse({
+        "results": [_serialize(row) for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+
+@require_GET
+@api_login_required
+@async_condition(etag_func=_asession_etag, last_modified_func=_asession_last_modified)
+async def session(request, session_id):
+    row = await Session.objects.filter(user=request.user, id=session_id).values(*SUMMARY_FIELDS).afirst()
+    if row is None:
+        raise Http404("Session not found.")
+    return JsonResponse(_serialize(row))
+
+
+def _lap_lines(session_id):
+    packed = PackedLaps.objects.filter(session_id=session_id).only("count", "data", "notes").first()
+    if packed is not None:
+        rows = LapColumns.unpack(packed.data, packed.count, packed.notes).rows()
+    else:
+        rows = (Lap.objects.filter(session_id=session_id).order_by("id")
+                .values_list("lap", "s1_ms", "s2_ms", "s3_ms", "total_ms", "notes")
+                .iterator(chunk_size=LAP_CHUNK_SIZE))
+
+    lines = []
+    for (lap, s1, s2, s3, total, notes) in rows:
+        lines.append(json.dumps({
+            "lap": lap, "s1_ms": s1, "s2_ms": s2, "s3_ms": s3, "total_ms": total, "notes": notes,
+        }, separators=(",", ":")) + "\n")
+        if len(lines) == LAP_CHUNK_SIZE:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+@require_GET
+@api_login_required
+@condition(etag_func=_session_etag, last_modified_func=_session_last_modified)
+def session_laps(request, session_id):
+    if _session_meta(request, session_id) is None:
+        raise Http404("Session not found.")
+    return streaming_response(request, _lap_lines(session_id), "application/x-ndjson")
+
+
+def columns_payload(columns):
+    """
+    A session's laps as one JSON object of integer arrays, one per column
+    and metric, plus the sparse notes. The rolling stddev is rounded to
+    whole ms, null until its window fills.
+    """
+    metrics = columns.compute_metrics()
+    payload = {name: getattr(columns, name).tolist() for name in COLUMNS}
+    for name in METRICS:
+        values = metrics[name].tolist()
+        if name == "rolling_std":
+            values = [None if v != v else round(v) for v in values]
+        payload[name] = values
+    payload["notes"] = {str(k): v for (k, v) in columns.notes.items()}
+    return json.dumps(payload, separators=(",", ":"))
+
+
+@require_GET
+@api_login_required
+@gzip_page
+@async_condition(etag_func=_asession_etag, last_modified_func=_asession_last_modified)
+async def session_columns(request, session_id):
+    """Compact column payload rendered by the session page's client-side mode."""
+    meta = await _asession_meta(request, session_id)
+    if meta is None:
+        raise Http404("Session not found.")
+
+    name = f"columns:{session_id}:{meta['updated_at'].timestamp()}"
+    content = await aget_user_value(request.user.id, name)
+    if content is None:
+        columns = await sync_to_async(load_columns)(Session(id=session_id))
+        content = columns_payload(columns)
+        await aset_user_value(request.user.id, name, content)
+
+    response = HttpResponse(content, content_type="application/json")
+    patch_cache_control(response, private=True, max_age=COLUMNS_MAX_AGE)
+    return response
@@ -0,0 +1,180 @@
+import datetime
+import io
+import platform
+import random
+import statistics
+import time
+
+import django
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from . import analytics, views
+from .aggregates import record_sessions
+from .cache import invalidate_user
+from .ingest import CANONICAL_HEADER, ErrorLog, open_csv, parse_date, summary_fields, validate_rows
+from .models import Session, User
+from .storage import LapColumns, column_arrays, write_laps
+
+# Median sector times (ms) of the sample sessions in "csv examples/"
+TRACK_PROFILES = {
+    "Karting Jerez (Indoor)": (9950, 8530, 9980),
+    "Kartódromo de Campillos": (22480, 26100, 23880),
+    "Karting El Pla": (19870, 19370, 19470),
+}
+DEFAULT_TRACK = "Karting Jerez (Indoor)"
+DEFAULT_NOISE_MS = 150
+INCIDENT_RATE = 0.08
+NOTES = ("clean air", "push lap", "minor error")
+
+# "render" is the server-rendered session page, "list" the sessions list
+STAGES = ("parse", "validate", "stats", "insert", "render", "list")
+DEFAULT_SIZES = (10, 1000, 10000, 100000, 500000)
+
+
+def synthetic_csv(laps, track=DEFAULT_TRACK, noise_ms=DEFAULT_NOISE_MS, seed=50,
+                  session_id="BENCH-S01", date="2025-09-09"):
+    """
+    A valid Race50 CSV of one session shaped like the sample files: sectors
+    vary around the track's typical times by `noise_ms` (standard deviation)
+    and a few laps lose time to traffic or mistakes.
+    """
+    rng = random.Random(seed)
+    base = TRACK_PROFILES.get(track, TRACK_PROFILES[DEFAULT_TRACK])
+    lines = [CANONICAL_HEADER]
+    for lap in range(1, laps + 1):
+        s1, s2, s3 = (max(1000, int(rng.gauss(b, noise_ms))) for b in base)
+        if rng.random() < INCIDENT_RATE:
+            s2 += rng.randint(1500, 6000)
+            note = "traffic/mistake"
+        else:
+            note = rng.choice(NOTES)
+        lines.append(f"{session_id},{track},{date},{lap},{s1 + s2 + s3},{s1},{s2},{s3},{note}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _time(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def _request(path, user):
+    request = RequestFactory().get(path)
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+    return request
+
+
+def bench_size(laps, repeat=3, track=DEFAULT_TRACK, noise_ms=DEFAULT_NOISE_MS, seed=50):
+    """
+    Times every upload and display stage for one session of `laps` laps.
+    Database work runs in a transaction that is rolled back, so nothing is
+    left behind. Returns a list of result dicts, one per stage.
+    """
+    data = synthetic_csv(laps, track, noise_ms, seed)
+
+    timings = {}
+    timings["parse"], rows = _time(lambda: list(open_csv(io.BytesIO(data))), repeat)
+
+    def validate():
+        columns = LapColumns()
+        for (sid, track_name, date, lap, s1, s2, s3, total, notes) in validate_rows(iter(rows), ErrorLog()):
+            columns.append(lap, s1, s2, s3, total, notes)
+        return columns
+
+    timings["validate"], columns = _time(validate, repeat)
+    def stats():
+        # As at ingest: the lap metrics, then the summary with their outlier flags
+        columns.metrics = None
+        metrics = columns.compute_metrics()
+        return analytics.summarize(*column_arrays(columns), outliers=metrics["outlier"])
+
+    timings["stats"], summary = _time(stats, repeat)
+
+    timings["insert"], timings["render"], timings["list"] = [], [], []
+    for _ in range(repeat):
+        with transaction.atomic():
+            user = User.objects.create_user(f"bench-{time.time_ns()}")
+            start = time.perf_counter()
+            session = Session.objects.create(
+                user=user, external_id="BENCH-S01", track=track,
+                date=parse_date("2025-09-09"), notes="", **summary_fields(summary),
+            )
+            write_laps([(session, columns)])
+            record_sessions([session])
+            timings["insert"].append(time.perf_counter() - start)
+
+            invalidate_user(user.id)
+            start = time.perf_counter()
+            async_to_sync(views.session)(_request(f"/session/{session.id}?render=server", user), session.id)
+            timings["render"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            async_to_sync(views.sessions)(_request("/sessions", user))
+            timings["list"].append(time.perf_counter() - start)
+
+            invalidate_user(user.id)
+            transaction.set_rollback(True)
+
+    return [
+        {
+            "laps": laps,
+            "stage": stage,
+            "best_s": min(timings[stage]),
+            "median_s": statistics.median(timings[stage]),
+            "laps_per_s": laps / min(timings[stage]) if min(timings[stage]) else None,
+        }
+        for stage in STAGES
+    ]
+
+
+def environment():
+    """What the numbers depend on, recorded next to them."""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "database": connection.vendor,
+        "lap_storage": getattr(settings, "RACE50_LAP_STORAGE", "rows"),
+    }
+
+
+def run(sizes=DEFAULT_SIZES, repeat=3, track=DEFAULT_TRACK, noise_ms=DEFAULT_NOISE_MS, seed=50, report=None):
+    """Benchmarks every size; `report`, if given, is called with each size's results."""
+    results = []
+    for laps in sizes:
+        size_results = bench_size(laps, repeat, track, noise_ms, seed)
+        if report:
+            report(size_results)
+        results.extend(size_results)
+    return {
+        "environment": environment(),
+        "config": {"sizes": list(sizes), "repeat": repeat, "track": track, "noise_ms": noise_ms, "seed": seed},
+        "results": results,
+    }
+
+
+def compare(results, baseline):
+    """
+    Yields (laps, stage, baseline_s, current_s, ratio) for the stages both
+    result documents measured; a ratio above 1 means slower than the baseline.
+    """
+    before = {(r["laps"], r["stage"]): r["best_s"] for r in baseline["results"]}
+    for result in results["results"]:
+        key = (result["laps"], result["stage"])
+        if key in before and before[key]:
+            yield result["laps"], result["stage"], before[key], result["best_s"], result["best_s"] / before[key]
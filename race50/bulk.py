@@ -0,0 +1,254 @@
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from .ingest import ErrorLog, IngestError, open_csv, parse_date, summary_fields, validate_rows
+from .models import Session
+from .aggregates import record_sessions
+from .cache import invalidate_user
+from .db import write_transaction
+from .instrumentation import stage
+from .spool import summarize_spool
+from .storage import LAP_CHUNK_SIZE, LapSpool, write_laps
+
+# Groups below this size are summarized in-process; forking is not worth it
+MIN_PARALLEL_LAPS = 5000
+
+
+def max_bulk_bytes():
+    return getattr(settings, "RACE50_BULK_MAX_MB", 200) * 1024 * 1024
+
+
+def iter_csv_sources(uploaded_files):
+    """
+    Yields (name, binary file object) for every CSV among the uploaded files,
+    expanding ZIP archives. Raises IngestError when the archive content is
+    larger than RACE50_BULK_MAX_MB.
+    """
+    budget = max_bulk_bytes()
+    for uploaded in uploaded_files:
+        name = uploaded.name
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(uploaded.file)
+            except zipfile.BadZipFile:
+                raise IngestError(f"{name}: not a valid ZIP archive.")
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(".csv")]
+            budget -= sum(info.file_size for info in members)
+            if budget < 0:
+                raise IngestError("Uploaded files are too large once uncompressed.")
+            for info in members:
+                with archive.open(info) as member:
+                    yield f"{name}/{info.filename}", io.BytesIO(member.read())
+        elif name.lower().endswith(".csv"):
+            budget -= uploaded.size
+            if budget < 0:
+                raise IngestError("Uploaded files are too large.")
+            yield name, uploaded.file
+        else:
+            raise IngestError(f"{name}: file must be '.csv' or '.zip'.")
+
+
+class SeenLaps:
+    """Lap numbers already read for a session: a bitmap for the usual 1..N numbering, a set beyond it."""
+    BITMAP_LIMIT = 1 << 24
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.other = set()
+
+    def add(self, lap):
+        """Adds a lap number; returns False if it was already there."""
+        if lap >= self.BITMAP_LIMIT:
+            if lap in self.other:
+                return False
+            self.other.add(lap)
+            return True
+        (index, bit) = divmod(lap, 8)
+        if index >= len(self.bits):
+            self.bits.extend(bytes(max(index + 1, 2 * len(self.bits)) - len(self.bits)))
+        if self.bits[index] & (1 << bit):
+            return False
+        self.bits[index] |= 1 << bit
+        return True
+
+
+def content_hash(fileobj):
+    """SHA-256 hex digest of a binary file, rewound afterwards."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def group_sources(sources, directory):
+    """
+    Validates every source and splits its rows by SessionID into LapSpools
+    under `directory`. Returns (groups, file_errors) where groups maps
+    SessionID to a dict with the track, date, source name, content hash
+    and the group's LapSpool. Laps waiting for their group's chunk to fill
+    are flushed every LAP_CHUNK_SIZE rows, so memory does not grow with
+    the upload.
+
+    A group gets the hash of its source when that source holds only this
+    session, the same hash a single upload of the file stores; sessions
+    spread over several sources, or sharing one, get none.
+    """
+    groups = {}
+    file_errors = {}
+    pending = {}
+    waiting = 0
+    hashes = []
+    sessions_per_source = []
+
+    for (index, (name, fileobj)) in enumerate(sources):
+        errors = ErrorLog()
+        hashes.append(content_hash(fileobj))
+        sessions_per_source.append(set())
+        try:
+            reader = open_csv(fileobj)
+            for (sid, track, date, lap, s1, s2, s3, total, notes) in validate_rows(reader, errors, single_session=False):
+                group = groups.get(sid)
+                if group is None:
+                    group = groups[sid] = {
+                        "external_id": sid,
+                        "track": track,
+                        "date": date,
+                        "source": name,
+                        "sources": set(),
+                        "laps": LapSpool(os.path.join(directory, str(len(groups)))),
+                        "seen": SeenLaps(),
+                    }
+                if not group["seen"].add(lap):
+                    errors.add(f"{sid}: duplicate Lap {lap}")
+                    continue
+                group["laps"].append(lap, s1, s2, s3, total, notes)
+                group["sources"].add(index)
+                sessions_per_source[index].add(sid)
+                pending[sid] = group["laps"]
+                waiting += 1
+                if waiting >= LAP_CHUNK_SIZE:
+                    for laps in pending.values():
+                        laps.flush()
+                    pending.clear()
+                    waiting = 0
+        except IngestError as e:
+            errors.add(e.message)
+        if errors.count:
+            file_errors[name] = errors.as_list()
+
+    for group in groups.values():
+        group["laps"].flush()
+        del group["seen"]
+        (index, *others) = group.pop("sources")
+        group["content_hash"] = hashes[index] if not others and len(sessions_per_source[index]) == 1 else ""
+    return groups, file_errors
+
+
+def summarize_groups(groups, pool=None):
+    """
+    Computes the summary and lap metrics of every group, in `pool` (a
+    process pool executor) when it pays off. Workers run
+    spool.summarize_spool, which does not need Django.
+    """
+    spools = [group["laps"] for group in groups]
+    args = ([laps.fold for laps in spools], [laps.path for laps in spools], [laps.target for laps in spools])
+    if pool is not None and len(groups) > 1 and sum(map(len, spools)) >= MIN_PARALLEL_LAPS:
+        return list(pool.map(summarize_spool, *args))
+    return [summarize_spool(*group_args) for group_args in zip(*args)]
+
+
+def _skip_existing(groups, user):
+    """Removes the groups whose SessionID the user already has and returns their duplicate results."""
+    existing = {
+        session_obj.external_id: session_obj
+        for session_obj in Session.objects.filter(
+            user=user, external_id__in=[group["external_id"] for group in groups]).order_by("-id")
+    }
+    duplicates = [
+        {
+            "session": existing[group["external_id"]],
+            "source": group["source"],
+            "laps_count": existing[group["external_id"]].laps_count,
+            "duplicate": True,
+        }
+        for group in groups if group["external_id"] in existing
+    ]
+    groups[:] = [group for group in groups if group["external_id"] not in existing]
+    return duplicates
+
+
+def _store_groups(groups, user, progress):
+    sessions = Session.objects.bulk_create([
+        Session(
+            user=user,
+            external_id=group["external_id"],
+            track=group["track"],
+            date=parse_date(group["date"]),
+            notes="",
+            content_hash=group["content_hash"],
+            **summary_fields(group["summary"]),
+        )
+        for group in groups
+    ])
+    write_laps(((session_obj, chunk) for (session_obj, group) in zip(sessions, groups)
+                for chunk in group["laps"].chunks()), progress=progress)
+    record_sessions(sessions)
+    return sessions
+
+
+def ingest_bulk(uploaded_files, user, pool=None, progress=None):
+    """
+    Ingests several CSV/ZIP uploads, one Session per SessionID, in a single
+    transaction. SessionIDs the user already has, or that a concurrent
+    upload stores first, are not stored again. Returns (results, file_errors) where results holds one dict per created
+    or already stored session. Runs as an upload job (jobs.create_bulk_job),
+    which passes its process pool and progress callback.
+    """
+    with tempfile.TemporaryDirectory(prefix="race50-bulk-") as directory:
+        with stage("validate"):
+            groups, file_errors = group_sources(iter_csv_sources(uploaded_files), directory)
+        if not groups:
+            raise IngestError("No valid rows found in the uploaded files.",
+                              [f"{name}: {error}" for (name, errors) in file_errors.items() for error in errors])
+
+        groups = list(groups.values())
+        duplicates = _skip_existing(groups, user)
+        if not groups:
+            return duplicates, file_errors
+
+        with stage("stats"):
+            for (group, summary) in zip(groups, summarize_groups(groups, pool)):
+                group["summary"] = summary
+
+        while True:
+            try:
+                with stage("commit"), write_transaction():
+                    sessions = _store_groups(groups, user, progress)
+                break
+            except IntegrityError:
+                # A concurrent upload stored some of these sessions; skip them and retry
+                skipped = _skip_existing(groups, user)
+                if not skipped:
+                    raise
+                duplicates += skipped
+                if not groups:
+                    return duplicates, file_errors
+
+    invalidate_user(user.id)
+    results = [
+        {
+            "session": session_obj,
+            "source": group["source"],
+            "laps_count": session_obj.laps_count,
+        }
+        for (session_obj, group) in zip(sessions, groups)
+    ]
+    return results + duplicates, file_errors
@@ -0,0 +1,110 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Session
+
+# Every key of a user embeds that user's generation number, so bumping the
+# generation invalidates the sidebar, the latest session card and all cached
+# pages of the user at once, on any cache backend. Generations start from
+# the clock so an evicted counter never resurrects old entries.
+
+
+def get_cache():
+    return caches[getattr(settings, "RACE50_CACHE_ALIAS", "default")]
+
+
+def timeout():
+    return getattr(settings, "RACE50_CACHE_TIMEOUT", 300)
+
+
+def _generation_key(user_id):
+    return f"race50:user:{user_id}:generation"
+
+
+def _generation(user_id):
+    cache = get_cache()
+    generation = cache.get(_generation_key(user_id))
+    if generation is None:
+        cache.add(_generation_key(user_id), time.time_ns(), timeout=None)
+        generation = cache.get(_generation_key(user_id))
+    return generation
+
+
+async def _ageneration(user_id):
+    cache = get_cache()
+    generation = await cache.aget(_generation_key(user_id))
+    if generation is None:
+        await cache.aadd(_generation_key(user_id), time.time_ns(), timeout=None)
+        generation = await cache.aget(_generation_key(user_id))
+    return generation
+
+
+def user_key(user_id, name):
+    return f"race50:user:{user_id}:{_generation(user_id)}:{name}"
+
+
+async def auser_key(user_id, name):
+    return f"race50:user:{user_id}:{await _ageneration(user_id)}:{name}"
+
+
+def invalidate_user(user_id):
+    """Drops everything cached for a user, e.g. after an upload."""
+    cache = get_cache()
+    try:
+        cache.incr(_generation_key(user_id))
+    except ValueError:
+        cache.set(_generation_key(user_id), time.time_ns(), timeout=None)
+
+
+def _recent_queryset(user):
+    return (Session.objects.filter(user=user)
+            .order_by("-created_at", "-pk")
+            .only("id", "track", "date", "best_lap_ms", "tbl_ms", "consistency_percent", "created_at")[:5])
+
+
+def recent_sessions(user):
+    """The user's five latest sessions, newest first, as used by the sidebar and index."""
+    cache = get_cache()
+    key = user_key(user.id, "recent")
+    sessions = cache.get(key)
+    if sessions is None:
+        sessions = list(_recent_queryset(user))
+        cache.set(key, sessions, timeout())
+    return sessions
+
+
+async def arecent_sessions(user):
+    """recent_sessions for async views."""
+    cache = get_cache()
+    key = await auser_key(user.id, "recent")
+    sessions = await cache.aget(key)
+    if sessions is None:
+        sessions = [session async for session in _recent_queryset(user)]
+        await cache.aset(key, sessions, timeout())
+    return sessions
+
+
+def get_user_value(user_id, name):
+    return get_cache().get(user_key(user_id, name))
+
+
+def set_user_value(user_id, name, value):
+    get_cache().set(user_key(user_id, name), value, timeout())
+
+
+async def aget_user_value(user_id, name):
+    return await get_cache().aget(await auser_key(user_id, name))
+
+
+async def aset_user_value(user_id, name, value):
+    await get_cache().aset(await auser_key(user_id, name), value, timeout())
+
+
+async def aget_page(user_id, name):
+    return await aget_user_value(user_id, f"page:{name}")
+
+
+async def aset_page(user_id, name, content):
+    await aset_user_value(user_id, f"page:{name}", content)
@@ -0,0 +1,144 @@
+import numpy as np
+
+from .analytics import as_array
+from .cache import get_user_value, set_user_value
+from .models import Session
+from .storage import column_arrays, load_columns_many
+
+# Ways of pairing the laps of two sessions
+ALIGN_LAP = "lap"    # same lap number
+ALIGN_RANK = "rank"  # fastest with fastest, second with second, ...
+ALIGN_BEST = "best"  # like rank, but only the best N laps of each
+ALIGN_MODES = (ALIGN_LAP, ALIGN_RANK, ALIGN_BEST)
+
+DEFAULT_BEST_N = 5
+MAX_SESSIONS = 6
+
+
+class CompareError(Exception):
+    pass
+
+
+def _arrays(columns, clean=False):
+    lap, s1, s2, s3, total = (as_array(c) for c in column_arrays(columns))
+    arrays = {"lap": lap, "s1": s1, "s2": s2, "s3": s3, "total": total}
+    if clean:
+        # Stored outlier flags, so nothing is re-detected here
+        keep = columns.compute_metrics()["outlier"] == 0
+        arrays = {key: values[keep] for (key, values) in arrays.items()}
+    return arrays
+
+
+def align(reference, other, mode=ALIGN_LAP, n=DEFAULT_BEST_N):
+    """Returns index arrays (ref_idx, other_idx) of the paired laps."""
+    if mode == ALIGN_LAP:
+        _, ref_idx, other_idx = np.intersect1d(reference["lap"], other["lap"], return_indices=True)
+        return ref_idx, other_idx
+
+    # Stable sort keeps the earlier lap first on equal times
+    ref_idx = np.argsort(reference["total"], kind="stable")
+    other_idx = np.argsort(other["total"], kind="stable")
+    size = min(len(ref_idx), len(other_idx))
+    if mode == ALIGN_BEST:
+        size = min(size, n)
+    return ref_idx[:size], other_idx[:size]
+
+
+def compare_pair(reference, other, mode=ALIGN_LAP, n=DEFAULT_BEST_N):
+    """
+    Per-lap and per-sector deltas of `other` against `reference` (positive
+    means `other` was slower) and the cumulative gap over the aligned laps.
+    """
+    ref_idx, other_idx = align(reference, other, mode, n)
+    deltas = {key: other[key][other_idx] - reference[key][ref_idx] for key in ("total", "s1", "s2", "s3")}
+    gap = np.cumsum(deltas["total"])
+    count = len(ref_idx)
+
+    return {
+        "aligned_laps": count,
+        "mean_delta_ms": float(deltas["total"].mean()) if count else None,
+        "sector_mean_delta_ms": [float(deltas[k].mean()) if count else None for k in ("s1", "s2", "s3")],
+        "final_gap_ms": int(gap[-1]) if count else 0,
+        "laps": [
+            {
+                "ref_lap": ref_lap,
+                "lap": lap,
+                "delta_ms": d,
+                "delta_s1_ms": d1,
+                "delta_s2_ms": d2,
+                "delta_s3_ms": d3,
+                "gap_ms": g,
+            }
+            for (ref_lap, lap, d, d1, d2, d3, g) in zip(
+                reference["lap"][ref_idx].tolist(), other["lap"][other_idx].tolist(),
+                deltas["total"].tolist(), deltas["s1"].tolist(), deltas["s2"].tolist(), deltas["s3"].tolist(),
+                gap.tolist(),
+            )
+        ],
+    }
+
+
+def _session_info(session):
+    return {
+        "id": session.id,
+        "external_id": session.external_id,
+        "track": session.track,
+        "date": session.date.isoformat(),
+        "laps_count": session.laps_count,
+        "best_lap_ms": session.best_lap_ms,
+        "tbl_ms": session.tbl_ms,
+        "avg_lap_ms": session.avg_lap_ms,
+        "clean_laps_count": session.clean_laps_count,
+        "clean_avg_lap_ms": session.clean_avg_lap_ms,
+    }
+
+
+def compare_sessions(user, session_ids, mode=ALIGN_LAP, n=DEFAULT_BEST_N, clean=False):
+    """
+    Compares the first session against each of the others. All sessions
+    must belong to `user` and be at the same track. With `clean`, laps with
+    outlier flags are left out before aligning. Results are cached per user
+    and session set.
+    """
+    if mode not in ALIGN_MODES:
+        raise CompareError(f"Unknown alignment '{mode}'.")
+    session_ids = list(dict.fromkeys(session_ids))
+    if not 2 <= len(session_ids) <= MAX_SESSIONS:
+        raise CompareError(f"Select between 2 and {MAX_SESSIONS} sessions.")
+
+    name = f"compare:{','.join(map(str, session_ids))}:{mode}:{n if mode == ALIGN_BEST else ''}:{int(clean)}"
+    result = get_user_value(user.id, name)
+    if result is not None:
+        return result
+
+    sessions = {s.id: s for s in Session.objects.filter(user=user, id__in=session_ids).select_related("packed_laps")}
+    if len(sessions) != len(session_ids):
+        raise CompareError("Session not found.")
+    if len({s.track for s in sessions.values()}) > 1:
+        raise CompareError("Sessions must be at the same track.")
+
+    columns = load_columns_many(sessions.values())
+    reference = sessions[session_ids[0]]
+    reference_arrays = _arrays(columns[reference.id], clean)
+
+    comparisons = []
+    for session_id in session_ids[1:]:
+        other = sessions[session_id]
+        comparison = compare_pair(reference_arrays, _arrays(columns[other.id], clean), mode, n)
+        comparison.update({
+            "session": _session_info(other),
+            "best_vs_best_ms": other.best_lap_ms - reference.best_lap_ms,
+            "tbl_vs_tbl_ms": other.tbl_ms - reference.tbl_ms,
+            "avg_vs_avg_ms": other.avg_lap_ms - reference.avg_lap_ms,
+        })
+        comparisons.append(comparison)
+
+    result = {
+        "align": mode,
+        "n": n if mode == ALIGN_BEST else None,
+        "clean": clean,
+        "reference": _session_info(reference),
+        "comparisons": comparisons,
+    }
+    set_user_value(user.id, name, result)
+    return result
@@ -0,0 +1,42 @@
+import threading
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import connection, transaction
+
+# SQLite allows one writer at a time. Upload threads of a process take
+# this lock around their write transaction, so they queue here in order
+# instead of spinning on busy_timeout; other processes still rely on it.
+_write_lock = threading.RLock()
+
+
+def serialize_writes():
+    return connection.vendor == "sqlite" and getattr(settings, "RACE50_SQLITE_SERIALIZE_WRITES", True)
+
+
+@contextmanager
+def _begin_immediate():
+    # Only the outermost atomic() begins a transaction, with this mode
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = "IMMEDIATE"
+    try:
+        yield
+    finally:
+        connection.transaction_mode = mode
+
+
+@contextmanager
+def write_transaction():
+    """
+    transaction.atomic() for writes. On SQLite it begins IMMEDIATE, taking
+    the write lock up front instead of failing to upgrade a read, and the
+    write transactions of one process run one at a time. The lock is per
+    process: writers in other processes wait on busy_timeout.
+    """
+    if connection.vendor != "sqlite":
+        with transaction.atomic():
+            yield
+        return
+    with _write_lock if serialize_writes() else nullcontext(), _begin_immediate(), transaction.atomic():
+        yield
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import zipfile
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .ingest import CANONICAL_COLUMNS
+from .models import Session
+from .storage import load_columns_many
+
+# Exports are generators of bytes so they can back a StreamingHttpResponse
+# or be written to a file. Sessions are loaded in batches, so memory is
+# bounded by the batch rather than the account size.
+
+SESSION_BATCH = 100
+
+CSV = "csv"
+ZIP = "zip"
+NPZ = "npz"
+FORMATS = (CSV, ZIP, NPZ)
+
+
+def iter_session_columns(sessions, batch=SESSION_BATCH):
+    """Yields (session, LapColumns) for a Session queryset, newest first."""
+    ids = list(sessions.order_by("-created_at", "-id").values_list("id", flat=True))
+    for start in range(0, len(ids), batch):
+        chunk_ids = ids[start:start + batch]
+        order = {session_id: i for (i, session_id) in enumerate(chunk_ids)}
+        chunk = sorted(Session.objects.filter(id__in=chunk_ids).select_related("packed_laps"),
+                       key=lambda s: order[s.id])
+        columns = load_columns_many(chunk)
+        for session in chunk:
+            yield session, columns[session.id]
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only, non-seekable file that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _csv_rows(session, columns):
+    date = session.date.isoformat()
+    for row in columns.rows():
+        yield (session.external_id or session.id, session.track, date, row.lap, row.total_ms,
+               row.s1_ms, row.s2_ms, row.s3_ms, row.notes)
+
+
+def iter_csv(items):
+    """One CSV in the canonical upload layout for all sessions."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CANONICAL_COLUMNS).encode()
+    for (session, columns) in items:
+        yield "".join(writer.writerow(row) for row in _csv_rows(session, columns)).encode()
+
+
+def _member_name(session):
+    return f"{session.id}-{session.external_id or 'session'}".replace("/", "_")
+
+
+def iter_zip(items):
+    """A ZIP with one canonical CSV per session, built on the fly."""
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for (session, columns) in items:
+            with archive.open(f"{_member_name(session)}.csv", "w") as member:
+                for chunk in iter_csv([(session, columns)]):
+                    member.write(chunk)
+            yield sink.take()
+    yield sink.take()
+
+
+def iter_npz(items):
+    """
+    A NumPy .npz archive (readable with numpy.load) with, per session,
+    uint32 arrays "<name>/lap", "/s1", "/s2", "/s3", "/total" and a JSON
+    "<name>/meta" member holding the session fields and sparse notes.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for (session, columns) in items:
+            name = _member_name(session)
+            for column in ("lap", "s1", "s2", "s3", "total"):
+                with archive.open(f"{name}/{column}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.frombuffer(getattr(columns, column), dtype=np.uint32))
+            meta = {
+                "external_id": session.external_id,
+                "track": session.track,
+                "date": session.date.isoformat(),
+                "notes": {str(k): v for (k, v) in columns.notes.items()},
+            }
+            archive.writestr(f"{name}/meta.json", json.dumps(meta))
+            yield sink.take()
+    yield sink.take()
+
+
+def export(sessions, fmt):
+    items = iter_session_columns(sessions)
+    if fmt == ZIP:
+        return iter_zip(items)
+    if fmt == NPZ:
+        return iter_npz(items)
+    return iter_csv(items)
+
+
+async def _achunks(chunks):
+    chunks = iter(chunks)
+    step = sync_to_async(next)
+    try:
+        while (chunk := await step(chunks, None)) is not None:
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            await sync_to_async(chunks.close)()
+
+
+def streaming_response(request, chunks, content_type):
+    """
+    Streams a sync generator. Under ASGI Django would collect a sync
+    iterator into a list before sending it, so there each chunk is produced
+    in the sync thread, one at a time.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = _achunks(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
+
+
+CONTENT_TYPES = {
+    CSV: "text/csv",
+    ZIP: "application/zip",
+    NPZ: "application/octet-stream",
+}
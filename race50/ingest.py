@@ -0,0 +1,254 @@
+import csv
+import datetime
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+
+from .aggregates import record_sessions
+from .cache import invalidate_user
+from .db import write_transaction
+from .instrumentation import stage
+from .models import Session
+from .storage import LapSpool, write_laps
+
+
+# CSV column names
+SESSION_ID = "SessionID"
+TRACK = "Track"
+DATE = "Date"
+LAP = "Lap"
+LAPTIME = "LapTime_ms"
+S1TIME = "S1_ms"
+S2TIME = "S2_ms"
+S3TIME = "S3_ms"
+NOTES = "Notes"
+
+REQUIRED_COLUMNS = (SESSION_ID, TRACK, DATE, LAP, LAPTIME, S1TIME, S2TIME, S3TIME)
+CANONICAL_COLUMNS = REQUIRED_COLUMNS + (NOTES,)
+CANONICAL_HEADER = ",".join(CANONICAL_COLUMNS)
+
+# Range check (10s–5min) and sector consistency (±2 ms)
+MIN_LAP_MS = 10000
+MAX_LAP_MS = 300000
+SECTOR_TOLERANCE_MS = 2
+
+# Only the first errors are kept as messages, the rest are just counted
+MAX_ERROR_MESSAGES = getattr(settings, "RACE50_MAX_ERROR_MESSAGES", 100)
+
+
+class IngestError(Exception):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+
+class DuplicateUpload(Exception):
+    """Raised instead of storing a session the user already uploaded."""
+    def __init__(self, session):
+        super().__init__(f"Session {session.external_id} was already uploaded.")
+        self.session = session
+
+
+def parse_date(s):
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
+        try:
+            return datetime.datetime.strptime(s.strip(), fmt).date()
+        except Exception:
+            pass
+    return datetime.date.today()
+
+
+class ErrorLog:
+    """Keeps the first `limit` error messages and counts the rest."""
+
+    def __init__(self, limit=MAX_ERROR_MESSAGES):
+        self.limit = limit
+        self.messages = []
+        self.count = 0
+
+    def add(self, message):
+        self.count += 1
+        if len(self.messages) < self.limit:
+            self.messages.append(message)
+
+    def as_list(self):
+        if self.count > len(self.messages):
+            return self.messages + [f"... and {self.count - len(self.messages)} more errors"]
+        return list(self.messages)
+
+
+def open_csv(fileobj, fast=True):
+    """
+    Wraps an uploaded binary file in a text stream and returns an iterator of
+    rows as lists in CANONICAL_COLUMNS order. Files starting with the
+    canonical header are read positionally with csv.reader; anything else
+    goes through csv.Sniffer and DictReader.
+    """
+    head = fileobj.read(4096)
+    if b"\x00" in head:
+        raise IngestError("File appears to be binary or corrupted.")
+    fileobj.seek(0)
+
+    text_stream = io.TextIOWrapper(fileobj, encoding="utf-8-sig", errors="replace", newline="")
+
+    if fast:
+        header = text_stream.readline()
+        if header.rstrip("\r\n") == CANONICAL_HEADER:
+            # DictReader skips blank lines, so the fast path does too
+            return (row for row in csv.reader(text_stream) if row)
+        text_stream.seek(0)
+
+    sample = text_stream.read(4096)
+    text_stream.seek(0)
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(sample, delimiters=[",", ";", "\t"])
+    except csv.Error:
+        dialect = csv.excel
+        dialect.delimiter = ","
+
+    reader = csv.DictReader(text_stream, dialect=dialect)
+    if not reader.fieldnames:
+        raise IngestError("Missing or invalid header.")
+    return ([row.get(col) or "" for col in CANONICAL_COLUMNS] for row in reader)
+
+
+def summary_fields(summary):
+    """Maps an analytics.summarize() result onto Session model fields."""
+    return {
+        "laps_count": summary["laps_count"],
+        "best_lap_ms": summary["best_lap_ms"],
+        "best_lap_number": summary["best_lap_number"],
+        "worst_lap_ms": summary["worst_lap_ms"],
+        "avg_lap_ms": int(round(summary["avg_lap_ms"])),
+        "tbl_ms": summary["tbl_ms"],
+        "consistency_percent": summary["consistency_percent"],
+        "best_s1_ms": summary["best_s1_ms"],
+        "best_s2_ms": summary["best_s2_ms"],
+        "best_s3_ms": summary["best_s3_ms"],
+        "clean_laps_count": summary["clean_laps_count"],
+        "clean_avg_lap_ms": None if summary["clean_avg_lap_ms"] is None else int(round(summary["clean_avg_lap_ms"])),
+        "clean_consistency_percent": summary["clean_consistency_percent"],
+    }
+
+
+def validate_rows(reader, errors, single_session=True):
+    """
+    Yields (session_id, track, date, lap, s1, s2, s3, total, notes) for
+    every valid row. Invalid rows are reported to `errors`. With
+    `single_session` rows whose SessionID differs from the first valid row
+    are rejected.
+    """
+    file_session_id = None
+
+    for (idx, row) in enumerate(reader, start=2):
+        sid = row[0].strip() if len(row) >= 8 else ""
+        track = row[1].strip() if sid else ""
+        date = row[2].strip() if track else ""
+        if not date:
+            errors.add(f"Row {idx}: missing required fields")
+            continue
+
+        # All five conversions in one try; work out which error it was only on failure
+        try:
+            lap, total, s1, s2, s3 = int(row[3]), int(row[4]), int(row[5]), int(row[6]), int(row[7])
+        except ValueError:
+            if not (row[3].strip() and row[4].strip() and row[5].strip() and row[6].strip() and row[7].strip()):
+                errors.add(f"Row {idx}: missing required fields")
+            else:
+                errors.add(f"Row {idx}: values must be positive")
+            continue
+
+        if lap <= 0 or total <= 0 or s1 <= 0 or s2 <= 0 or s3 <= 0:
+            errors.add(f"Row {idx}: values must be positive")
+            continue
+
+        if not (MIN_LAP_MS <= total <= MAX_LAP_MS):
+            errors.add(f"Row {idx}: LapTime_ms out of expected range ({total} ms)")
+            continue
+
+        delta = abs((s1 + s2 + s3) - total)
+        if delta > SECTOR_TOLERANCE_MS:
+            errors.add(f"Row {idx}: S1_ms+S2_ms+S3_ms != LapTime_ms (Δ={delta} ms)")
+            continue
+
+        if file_session_id is None:
+            file_session_id = sid
+        elif single_session and sid != file_session_id:
+            errors.add(f"Row {idx}: inconsistent SessionID '{sid}' (expected '{file_session_id}')")
+            continue
+
+        yield (sid, track, date, lap, s1, s2, s3, total, row[8].strip() if len(row) > 8 else "")
+
+
+def ingest_csv(fileobj, user, progress=None, content_hash=""):
+    """
+    Validates, summarizes and stores an uploaded CSV. Rows are streamed
+    through a LapSpool, which folds the summary and lap metrics chunk by
+    chunk, and written to the configured storage backend, so memory does
+    not grow with the file. Returns (session, error_messages); raises
+    IngestError when nothing valid was found, in which case nothing is
+    written. `progress`, if given, is called with the laps written so far.
+
+    Raises DuplicateUpload, before parsing past the first valid row, when the
+    user already has a session with the same `content_hash` or SessionID.
+    """
+    if content_hash:
+        existing = Session.objects.filter(user=user, content_hash=content_hash).first()
+        if existing is not None:
+            raise DuplicateUpload(existing)
+
+    with stage("sniff"):
+        reader = open_csv(fileobj)
+    errors = ErrorLog()
+    first = None
+
+    with tempfile.TemporaryDirectory(prefix="race50-") as directory:
+        laps = LapSpool(os.path.join(directory, "laps"))
+
+        # Rows are parsed and validated as they stream in, so both are one stage
+        with stage("validate"):
+            for (sid, track, date, lap, s1, s2, s3, total, notes) in validate_rows(reader, errors):
+                if first is None:
+                    existing = Session.objects.filter(user=user, external_id=sid).order_by("id").first()
+                    if existing is not None:
+                        raise DuplicateUpload(existing)
+                    first = (sid, track, date)
+                laps.append(lap, s1, s2, s3, total, notes)
+
+        if first is None:
+            raise IngestError("No valid rows found in the CSV.", errors.as_list())
+
+        with stage("stats"):
+            summary = laps.summarize()
+        (sid, track, date) = first
+
+        try:
+            with stage("commit"), write_transaction():
+                session_obj = Session.objects.create(
+                    user=user,
+                    external_id=sid,
+                    track=track,
+                    date=parse_date(date),
+                    notes="",
+                    content_hash=content_hash,
+                    **summary_fields(summary),
+                )
+                write_laps(((session_obj, chunk) for chunk in laps.chunks()), progress=progress)
+                record_sessions([session_obj])
+        except IntegrityError:
+            # The same file or SessionID was stored by a concurrent upload
+            duplicate = Q(external_id=sid) | Q(content_hash=content_hash) if content_hash else Q(external_id=sid)
+            existing = Session.objects.filter(duplicate, user=user).order_by("id").first()
+            if existing is None:
+                raise
+            raise DuplicateUpload(existing)
+
+    invalidate_user(user.id)
+    return session_obj, errors.as_list()
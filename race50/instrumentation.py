@@ -0,0 +1,172 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.shortcuts import render as django_render
+
+logger = logging.getLogger(__name__)
+
+# Timings of the sampled request or job running in this context, if any.
+# Unsampled code only pays for one ContextVar lookup per stage.
+_current = ContextVar("race50_timings", default=None)
+
+
+def sample_rate():
+    return getattr(settings, "RACE50_INSTRUMENTATION_SAMPLE_RATE", 0.0)
+
+
+def sampled():
+    rate = sample_rate()
+    return rate > 0 and random.random() < rate
+
+
+class Timings:
+    """Query count, DB time and named stage durations (ms) of one unit of work."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.stages = {}
+
+    def add(self, name, ms):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_ms += (time.perf_counter() - start) * 1000
+
+    def as_dict(self):
+        return {
+            "queries": self.queries,
+            "db_ms": round(self.db_ms, 3),
+            "stages": {name: round(ms, 3) for (name, ms) in self.stages.items()},
+        }
+
+    def server_timing(self, total_ms):
+        entries = [f'db;dur={self.db_ms:.2f};desc="{self.queries} queries"']
+        entries += [f"{name};dur={ms:.2f}" for (name, ms) in self.stages.items()]
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def stage(name):
+    """Times a named stage of the current request or job when it is sampled."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000)
+
+
+@contextmanager
+def record():
+    """
+    Collects Timings for the enclosed block: SQL on every database
+    connection plus all stages entered through stage(). Yields the Timings.
+    """
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        with ExitStack() as stack:
+            _wrap_connections(stack, timings)
+            yield timings
+    finally:
+        _current.reset(token)
+
+
+def _wrap_connections(stack, timings):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timings.execute_wrapper))
+
+
+@asynccontextmanager
+async def arecord():
+    """
+    record() for async code. The async ORM runs queries on the request's
+    sync thread, whose connections are not the event loop's, so they are
+    wrapped from that thread.
+    """
+    timings = Timings()
+    token = _current.set(timings)
+    stack = ExitStack()
+    try:
+        await sync_to_async(_wrap_connections)(stack, timings)
+        try:
+            yield timings
+        finally:
+            await sync_to_async(stack.close)()
+    finally:
+        _current.reset(token)
+
+
+def render(*args, **kwargs):
+    """django.shortcuts.render, timed as the "render" stage."""
+    with stage("render"):
+        return django_render(*args, **kwargs)
+
+
+def log(kind, data):
+    logger.info(json.dumps({"type": kind, **data}, separators=(",", ":")))
+
+
+class InstrumentationMiddleware:
+    """
+    Records a sample of requests (RACE50_INSTRUMENTATION_SAMPLE_RATE) and
+    reports them as a JSON log line and a Server-Timing header. Runs in
+    either mode, so under ASGI it does not push async views into a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with record() as timings:
+            response = self.get_response(request)
+        return self.report(request, response, timings, (time.perf_counter() - start) * 1000)
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        async with arecord() as timings:
+            response = await self.get_response(request)
+        return self.report(request, response, timings, (time.perf_counter() - start) * 1000)
+
+    def report(self, request, response, timings, total_ms):
+        if getattr(settings, "RACE50_SERVER_TIMING", True):
+            response["Server-Timing"] = timings.server_timing(total_ms)
+        log("request", {
+            "method": request.method,
+            "path": request.path,
+            "view": getattr(request.resolver_match, "view_name", None),
+            "status": response.status_code,
+            "total_ms": round(total_ms, 3),
+            **timings.as_dict(),
+        })
+        return response
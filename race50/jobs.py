@@ -0,0 +1,373 @@
+import datetime
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .bulk import ingest_bulk
+from .ingest import ingest_csv, DuplicateUpload, IngestError
+from . import instrumentation
+from .cache import get_cache
+from .models import Session, UploadJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_process_pool = None
+# Set while a drain is submitted but has not started, so enqueue() keeps at
+# most one drain waiting for a worker however often it is called
+_drain_pending = False
+_drain_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "RACE50_UPLOAD_WORKERS", 2),
+            thread_name_prefix="race50-upload",
+        )
+    return _executor
+
+
+def _get_process_pool():
+    """
+    The process pool bulk jobs summarize their sessions in, shared by every
+    job of this process; None when RACE50_BULK_WORKERS is 1. Workers are
+    spawned, not forked, since the job threads run alongside.
+    """
+    global _process_pool
+    workers = getattr(settings, "RACE50_BULK_WORKERS", 4)
+    if _process_pool is None and workers > 1:
+        _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def staging_dir():
+    path = Path(getattr(settings, "RACE50_UPLOAD_STAGING_DIR", Path(settings.BASE_DIR) / "uploads" / "staging"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def stage_upload(uploaded_file):
+    """
+    Copies an UploadedFile to the staging area, hashing it on the way.
+    Returns (path, SHA-256 hex digest).
+    """
+    path = staging_dir() / f"{uuid.uuid4().hex}.csv"
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            out.write(chunk)
+    return path, digest.hexdigest()
+
+
+def stage_bulk(uploaded_files):
+    """
+    Copies the files of a bulk upload to a new directory of the staging
+    area, each under its own numbered directory to keep its name. Returns
+    the directory.
+    """
+    path = staging_dir() / uuid.uuid4().hex
+    for (i, uploaded) in enumerate(uploaded_files):
+        member = path / str(i)
+        member.mkdir(parents=True)
+        with open(member / os.path.basename(uploaded.name), "wb") as out:
+            for chunk in uploaded.chunks():
+                out.write(chunk)
+    return path
+
+
+def _staged_files(path):
+    for member in sorted(Path(path).iterdir(), key=lambda p: int(p.name)):
+        (name,) = os.listdir(member)
+        yield File(open(member / name, "rb"), name=name)
+
+
+def _progress_key(job_id):
+    return f"race50:upload-job:{job_id}:laps"
+
+
+def job_progress(job):
+    """
+    Laps written so far. While a job is running its counter lives in the
+    cache, because the lap inserts are not visible until the job commits.
+    """
+    if job.status == UploadJob.RUNNING:
+        return get_cache().get(_progress_key(job.id), job.laps_processed)
+    return job.laps_processed
+
+
+def _discard(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def create_job(user, uploaded_file):
+    """
+    Stages an upload and queues it. Re-sending a file that is still queued
+    or being processed returns the pending job, and a file already stored
+    gets a finished job pointing at its session; neither is parsed again.
+    A running job past RACE50_UPLOAD_JOB_TIMEOUT is not reused.
+    """
+    path, content_hash = stage_upload(uploaded_file)
+
+    live = Q(status=UploadJob.QUEUED) | Q(status=UploadJob.RUNNING, started_at__gte=stale_before())
+    pending = UploadJob.objects.filter(live, user=user, content_hash=content_hash).order_by("id").first()
+    if pending is not None:
+        _discard(path)
+        if pending.status == UploadJob.QUEUED:
+            enqueue()
+        return pending
+
+    job = UploadJob(
+        user=user,
+        original_name=uploaded_file.name,
+        staged_path=str(path),
+        size=uploaded_file.size,
+        content_hash=content_hash,
+    )
+    existing = Session.objects.filter(user=user, content_hash=content_hash).first()
+    if existing is not None:
+        _discard(path)
+        job.status = UploadJob.DONE
+        job.session = existing
+        job.laps_processed = existing.laps_count
+        job.message = "This file was already uploaded."
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+    job.save()
+    enqueue()
+    return job
+
+
+def create_bulk_job(user, uploaded_files):
+    """Stages the files of a bulk upload and queues them as one job."""
+    path = stage_bulk(uploaded_files)
+    job = UploadJob.objects.create(
+        user=user,
+        kind=UploadJob.BULK,
+        original_name=", ".join(uploaded.name for uploaded in uploaded_files)[:255],
+        staged_path=str(path),
+        size=sum(uploaded.size for uploaded in uploaded_files),
+    )
+    enqueue()
+    return job
+
+
+def enqueue():
+    """
+    Wakes up a worker to drain the queue. With RACE50_UPLOAD_ASYNC off the
+    queue is processed inline, which is what the tests use.
+    """
+    if getattr(settings, "RACE50_UPLOAD_ASYNC", True):
+        transaction.on_commit(_submit_drain)
+    else:
+        process_pending()
+
+
+def _submit_drain():
+    global _drain_pending
+    with _drain_lock:
+        if _drain_pending:
+            return
+        _drain_pending = True
+    _get_executor().submit(_drain_in_thread)
+
+
+def stale_before():
+    """Jobs started before this are assumed to have lost their worker."""
+    return timezone.now() - datetime.timedelta(seconds=getattr(settings, "RACE50_UPLOAD_JOB_TIMEOUT", 3600))
+
+
+def recover_jobs():
+    """
+    Reclaims running jobs whose worker died (a restart or a crash mid-job):
+    they go back to the queue while their staged file is still there and
+    they have attempts left, otherwise they fail. Returns the number of
+    jobs requeued.
+    """
+    requeued = 0
+    max_attempts = getattr(settings, "RACE50_UPLOAD_MAX_ATTEMPTS", 3)
+    stale = UploadJob.objects.filter(status=UploadJob.RUNNING, started_at__lt=stale_before())
+    for job in stale:
+        running = UploadJob.objects.filter(pk=job.pk, status=UploadJob.RUNNING, started_at=job.started_at)
+        if job.attempts < max_attempts and os.path.exists(job.staged_path):
+            requeued += running.update(status=UploadJob.QUEUED, started_at=None)
+        elif running.update(status=UploadJob.FAILED, finished_at=timezone.now(),
+                            message="Processing stopped before the file was finished. Please upload it again."):
+            get_cache().delete(_progress_key(job.id))
+            _discard(job.staged_path)
+    return requeued
+
+
+def wake(job):
+    """
+    Starts a drain when a polled job is waiting on no worker: jobs still
+    queued when the web process stopped, or running ones that went stale.
+    Returns True if it did.
+    """
+    if job.status == UploadJob.QUEUED or (job.status == UploadJob.RUNNING and job.started_at < stale_before()):
+        enqueue()
+        return True
+    return False
+
+
+def claim_next_job():
+    """
+    Atomically moves the oldest queued job to running. The conditional
+    update makes this safe with several workers polling the same table.
+    """
+    while True:
+        job = UploadJob.objects.filter(status=UploadJob.QUEUED).order_by("created_at", "id").first()
+        if job is None:
+            return None
+        claimed = UploadJob.objects.filter(pk=job.pk, status=UploadJob.QUEUED).update(
+            status=UploadJob.RUNNING, started_at=timezone.now(), attempts=F("attempts") + 1
+        )
+        if claimed:
+            job.refresh_from_db(fields=["status", "started_at", "attempts"])
+            return job
+
+
+def process_pending():
+    recover_jobs()
+    processed = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return processed
+        process_job(job)
+        processed += 1
+
+
+def _drain_in_thread():
+    global _drain_pending
+    # Cleared before looking at the queue: a job queued from now on either
+    # is claimed by this drain or submits the next one
+    with _drain_lock:
+        _drain_pending = False
+    try:
+        process_pending()
+    except Exception:
+        logger.exception("Upload worker crashed")
+    finally:
+        close_old_connections()
+
+
+def process_job(job):
+    if not instrumentation.sampled():
+        return _process_job(job)
+
+    with instrumentation.record() as timings:
+        _process_job(job)
+    instrumentation.log("upload_job", {
+        "job": job.id,
+        "status": job.status,
+        "size": job.size,
+        "laps": job.laps_processed,
+        **timings.as_dict(),
+    })
+    return job
+
+
+def _process_job(job):
+    key = _progress_key(job.id)
+    cache = get_cache()
+
+    def progress(laps):
+        cache.set(key, laps, timeout=3600)
+
+    if job.kind == UploadJob.BULK:
+        _run_bulk(job, progress)
+    else:
+        _run_csv(job, progress)
+
+    # Only the run that still owns the job finishes it: a job reclaimed as
+    # stale meanwhile belongs to its retry, staged file included
+    job.finished_at = timezone.now()
+    finished = UploadJob.objects.filter(pk=job.pk, status=UploadJob.RUNNING, started_at=job.started_at).update(
+        status=job.status, message=job.message, errors=job.errors, session=job.session,
+        laps_processed=job.laps_processed, results=job.results, file_errors=job.file_errors,
+        finished_at=job.finished_at,
+    )
+    if not finished:
+        logger.warning("Upload job %s was reclaimed while it ran; dropping this run's outcome", job.id)
+        job.refresh_from_db()
+        return job
+    cache.delete(key)
+    _discard(job.staged_path)
+    return job
+
+
+def _run_csv(job, progress):
+    try:
+        with open(job.staged_path, "rb") as f:
+            session_obj, errors = ingest_csv(f, job.user, progress=progress, content_hash=job.content_hash)
+    except DuplicateUpload as e:
+        job.status = UploadJob.DONE
+        job.session = e.session
+        job.laps_processed = e.session.laps_count
+        job.message = str(e)
+    except IngestError as e:
+        job.status = UploadJob.FAILED
+        job.message = e.message
+        job.errors = e.errors
+    except Exception:
+        logger.exception("Upload job %s failed", job.id)
+        job.status = UploadJob.FAILED
+        job.message = "Unexpected error while processing the file."
+    else:
+        job.status = UploadJob.DONE
+        job.session = session_obj
+        job.laps_processed = session_obj.laps_count
+        job.errors = errors
+
+
+def _run_bulk(job, progress):
+    files = list(_staged_files(job.staged_path))
+    try:
+        results, file_errors = ingest_bulk(files, job.user, pool=_get_process_pool(), progress=progress)
+    except IngestError as e:
+        job.status = UploadJob.FAILED
+        job.message = e.message
+        job.errors = e.errors
+    except Exception:
+        logger.exception("Upload job %s failed", job.id)
+        job.status = UploadJob.FAILED
+        job.message = "Unexpected error while processing the files."
+    else:
+        job.status = UploadJob.DONE
+        job.results = [
+            {
+                "session_id": result["session"].id,
+                "source": result["source"],
+                "laps_count": result["laps_count"],
+                "duplicate": result.get("duplicate", False),
+            }
+            for result in results
+        ]
+        job.file_errors = file_errors
+        job.laps_processed = sum(result["laps_count"] for result in results if not result.get("duplicate"))
+    finally:
+        for f in files:
+            f.close()
@@ -0,0 +1,140 @@
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import get_cache, timeout
+from .models import LeaderboardEntry, TrackAggregate
+
+# Positions kept per (track, metric). Reads are one index range scan with
+# LIMIT K, cached, so their cost does not grow with the sessions of a track.
+LEADERBOARD_SIZE = getattr(settings, "RACE50_LEADERBOARD_SIZE", 10)
+
+# TrackAggregate field holding each metric
+METRIC_FIELDS = {
+    LeaderboardEntry.BEST_LAP: "best_lap_ms",
+    LeaderboardEntry.TBL: "tbl_ms",
+    LeaderboardEntry.S1: "best_s1_ms",
+    LeaderboardEntry.S2: "best_s2_ms",
+    LeaderboardEntry.S3: "best_s3_ms",
+}
+METRICS = tuple(METRIC_FIELDS)
+RANK_ORDER = ("value_ms", "achieved_at", "id")
+
+
+def _key(track, metric):
+    digest = hashlib.sha1(track.encode("utf-8")).hexdigest()
+    return f"race50:leaderboard:{digest}:{metric}"
+
+
+TRACKS_KEY = "race50:leaderboard:tracks"
+
+
+def invalidate(track):
+    get_cache().delete_many([_key(track, metric) for metric in METRICS] + [TRACKS_KEY])
+
+
+def _qualifies(track, metric, value, size):
+    kth = (LeaderboardEntry.objects.filter(track=track, metric=metric)
+           .order_by(*RANK_ORDER).values_list("value_ms", flat=True)[size - 1:size])
+    return not kth or value < kth[0]
+
+
+def record(aggregate, size=None):
+    """
+    Updates the leaderboards of an aggregate's track with the user's
+    current bests. Call in the upload transaction, after the aggregate was
+    updated; per-user bests only improve, so an entry that does not make
+    the top K now can never be needed later.
+    """
+    size = size or LEADERBOARD_SIZE
+    now = timezone.now()
+    entries = {
+        entry.metric: entry
+        for entry in LeaderboardEntry.objects.select_for_update().filter(track=aggregate.track, user=aggregate.user_id)
+    }
+    changed = False
+    for (metric, field) in METRIC_FIELDS.items():
+        value = getattr(aggregate, field)
+        if value is None:
+            continue
+        session_id = aggregate.best_lap_session_id if metric == LeaderboardEntry.BEST_LAP else None
+        entry = entries.get(metric)
+        if entry is not None:
+            if value < entry.value_ms:
+                entry.value_ms, entry.session_id, entry.achieved_at = value, session_id, now
+                entry.save(update_fields=["value_ms", "session", "achieved_at"])
+                changed = True
+        elif _qualifies(aggregate.track, metric, value, size):
+            LeaderboardEntry.objects.create(track=aggregate.track, metric=metric, user_id=aggregate.user_id,
+                                            value_ms=value, session_id=session_id, achieved_at=now)
+            changed = True
+
+    if changed:
+        track = aggregate.track
+        invalidate(track)
+        # Readers may have cached the old top K before the commit
+        transaction.on_commit(lambda: invalidate(track))
+
+
+def top(track, metric):
+    """The top K of a track as a list of dicts: rank, username, value_ms, session_id, achieved_at."""
+    cache = get_cache()
+    key = _key(track, metric)
+    rows = cache.get(key)
+    if rows is None:
+        entries = (LeaderboardEntry.objects.filter(track=track, metric=metric).order_by(*RANK_ORDER)
+                   .values("user__username", "value_ms", "session_id", "achieved_at")[:LEADERBOARD_SIZE])
+        rows = [
+            {
+                "rank": rank,
+                "username": entry["user__username"],
+                "value_ms": entry["value_ms"],
+                "session_id": entry["session_id"],
+                "achieved_at": entry["achieved_at"],
+            }
+            for (rank, entry) in enumerate(entries, start=1)
+        ]
+        cache.set(key, rows, timeout())
+    return rows
+
+
+def tracks():
+    """Tracks with a leaderboard, alphabetically."""
+    cache = get_cache()
+    names = cache.get(TRACKS_KEY)
+    if names is None:
+        names = list(LeaderboardEntry.objects.order_by("track").values_list("track", flat=True).distinct())
+        cache.set(TRACKS_KEY, names, timeout())
+    return names
+
+
+def compact(size=None):
+    """
+    Rebuilds every leaderboard from TrackAggregate, keeping the top K per
+    track and metric, and clears the cached boards. Returns the entries kept.
+    """
+    size = size or LEADERBOARD_SIZE
+    now = timezone.now()
+    old_tracks = set(LeaderboardEntry.objects.values_list("track", flat=True).distinct())
+    entries = []
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        all_tracks = list(TrackAggregate.objects.order_by("track").values_list("track", flat=True).distinct())
+        for track in all_tracks:
+            for (metric, field) in METRIC_FIELDS.items():
+                best = (TrackAggregate.objects.filter(track=track, **{f"{field}__isnull": False})
+                        .order_by(field, "updated_at", "id")[:size])
+                entries += [
+                    LeaderboardEntry(
+                        track=track, metric=metric, user_id=aggregate.user_id, value_ms=getattr(aggregate, field),
+                        session_id=aggregate.best_lap_session_id if metric == LeaderboardEntry.BEST_LAP else None,
+                        achieved_at=aggregate.updated_at or now,
+                    )
+                    for aggregate in best
+                ]
+        LeaderboardEntry.objects.bulk_create(entries)
+    for track in old_tracks | set(all_tracks):
+        invalidate(track)
+    return len(entries)
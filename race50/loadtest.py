@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.test import Client
+
+from .models import User
+
+# Concurrency per worker under slow clients, against running deployments:
+# one gunicorn (WSGI) worker and one uvicorn (ASGI) worker on the same box.
+# Each client sends its request head in two parts a round trip apart and
+# reads the response at a mobile link's rate, the way a phone on a slow
+# network holds a connection open.
+
+DEFAULT_CONCURRENCY = (1, 10, 50, 100, 200)
+DEFAULT_DURATION_S = 10.0
+# Pause inside the request head, about one mobile round trip
+DEFAULT_SEND_DELAY_MS = 150
+# Per-client download rate; session pages are large enough to outgrow the
+# socket buffers at this rate
+DEFAULT_READ_KBPS = 64
+# Latency target used for the sustained concurrency of a target
+DEFAULT_SLO_MS = 1000
+READ_CHUNK = 4096
+TIMEOUT_S = 30.0
+
+
+def login_cookie(username):
+    """A session cookie for `username`, created in the session store the servers share."""
+    client = Client()
+    client.force_login(User.objects.get(username=username))
+    return f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+
+async def fetch(url, cookie="", send_delay=0.0, read_rate=None):
+    """
+    One GET over a fresh connection, as a slow client: the request head is
+    sent in two parts `send_delay` seconds apart and the response is read
+    at `read_rate` bytes/s. Returns (status, size in bytes, seconds).
+    """
+    parts = urlsplit(url)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=parts.scheme == "https" or None), TIMEOUT_S)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n".encode())
+        await writer.drain()
+        if send_delay:
+            await asyncio.sleep(send_delay)
+        cookie_header = f"Cookie: {cookie}\r\n" if cookie else ""
+        writer.write(f"{cookie_header}User-Agent: race50-loadtest\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), TIMEOUT_S)
+        status = int(status_line.split()[1])
+        size = len(status_line)
+        while True:
+            chunk = await asyncio.wait_for(reader.read(READ_CHUNK), TIMEOUT_S)
+            if not chunk:
+                break
+            size += len(chunk)
+            if read_rate:
+                await asyncio.sleep(len(chunk) / read_rate)
+        return status, size, time.perf_counter() - start
+    finally:
+        writer.close()
+
+
+async def _client(urls, offset, deadline, results, **options):
+    i = offset
+    while time.perf_counter() < deadline:
+        try:
+            status, _, seconds = await fetch(urls[i % len(urls)], **options)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status, seconds = None, None
+        results.append((status, seconds))
+        i += 1
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, round(q / 100 * (len(values) - 1)))] * 1000
+
+
+def summarize(results, elapsed, concurrency):
+    """Throughput and latency of one level from (status, seconds) pairs; failures have status None or >= 400."""
+    ok = sorted(seconds for (status, seconds) in results if status is not None and status < 400)
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "rps": len(ok) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(ok, 50),
+        "p95_ms": _percentile(ok, 95),
+    }
+
+
+async def run_level(urls, concurrency, duration, cookie="", send_delay=0.0, read_rate=None):
+    """`concurrency` clients cycling through `urls` for `duration` seconds."""
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(urls, i, start + duration, results, cookie=cookie, send_delay=send_delay, read_rate=read_rate)
+        for i in range(concurrency)
+    ))
+    return summarize(results, time.perf_counter() - start, concurrency)
+
+
+def sustained_concurrency(levels, slo_ms=DEFAULT_SLO_MS):
+    """Highest concurrency served without errors and with p95 latency within the SLO."""
+    return max(
+        (level["concurrency"] for level in levels
+         if not level["errors"] and level["p95_ms"] is not None and level["p95_ms"] <= slo_ms),
+        default=0,
+    )
+
+
+def run(targets, paths, concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION_S, cookie="",
+        send_delay_ms=DEFAULT_SEND_DELAY_MS, read_kbps=DEFAULT_READ_KBPS, slo_ms=DEFAULT_SLO_MS, report=None):
+    """
+    Load tests every target ({name: base URL}) at each concurrency level.
+    `report`, if given, is called with each level's result.
+    """
+    result = {}
+    for (name, base) in targets.items():
+        urls = [base.rstrip("/") + path for path in paths]
+        levels = []
+        for clients in concurrency:
+            level = asyncio.run(run_level(urls, clients, duration, cookie, send_delay_ms / 1000,
+                                          read_kbps * 1024 if read_kbps else None))
+            level["target"] = name
+            if report:
+                report(level)
+            levels.append(level)
+        result[name] = {"url": base, "levels": levels, "sustained_concurrency": sustained_concurrency(levels, slo_ms)}
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "paths": list(paths), "concurrency": list(concurrency), "duration_s": duration,
+            "send_delay_ms": send_delay_ms, "read_kbps": read_kbps, "slo_ms": slo_ms,
+        },
+        "targets": result,
+    }
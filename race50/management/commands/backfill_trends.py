@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from race50.trends import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily, weekly and monthly trend buckets from all stored sessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only rebuild the trends of this username.")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Sessions read per query.")
+
+    def handle(self, *args, **options):
+        users = None
+        if options["user"]:
+            users = get_user_model().objects.filter(username=options["user"])
+        written = rebuild(users=users, chunk_size=options["chunk_size"])
+        self.stdout.write(f"Wrote {written} trend bucket(s).")
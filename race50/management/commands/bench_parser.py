@@ -0,0 +1,29 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from race50.benchmark import synthetic_csv
+from race50.ingest import ErrorLog, open_csv, validate_rows
+
+
+class Command(BaseCommand):
+    help = "Compare parse+validate throughput of the canonical-header fast path against the sniffing path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--laps", type=int, default=200000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        data = synthetic_csv(options["laps"])
+        results = {}
+        for (name, fast) in (("sniff+DictReader", False), ("fast path", True)):
+            best = None
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                rows = sum(1 for _ in validate_rows(open_csv(io.BytesIO(data), fast=fast), ErrorLog()))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = rows / best
+            self.stdout.write(f"{name:>18}: {rows / best:>12,.0f} rows/s ({rows} rows, best of {options['repeat']})")
+        self.stdout.write(f"{'speedup':>18}: {results['fast path'] / results['sniff+DictReader']:.2f}x")
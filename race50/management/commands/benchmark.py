@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from race50.benchmark import (
+    DEFAULT_NOISE_MS, DEFAULT_SIZES, DEFAULT_TRACK, TRACK_PROFILES, compare, run, synthetic_csv,
+)
+
+
+def _sizes(value):
+    try:
+        return [int(size) for size in value.split(",") if size.strip()]
+    except ValueError:
+        raise CommandError(f"Invalid --sizes '{value}'; expected comma-separated lap counts.")
+
+
+class Command(BaseCommand):
+    help = ("Time parse, validate, stats, insert and render of synthetic sessions at several sizes "
+            "and write the results as JSON. Run once per database configuration to compare backends.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                            help="Comma-separated lap counts (default: %(default)s).")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--track", choices=sorted(TRACK_PROFILES), default=DEFAULT_TRACK)
+        parser.add_argument("--noise", type=int, default=DEFAULT_NOISE_MS, help="Sector noise in ms (std dev).")
+        parser.add_argument("--seed", type=int, default=50)
+        parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+        parser.add_argument("--baseline", help="A previous JSON output to compare against.")
+        parser.add_argument("--write-csv", metavar="DIR",
+                            help="Only write the synthetic CSV of every size to DIR, without benchmarking.")
+
+    def handle(self, *args, **options):
+        sizes = _sizes(options["sizes"])
+
+        if options["write_csv"]:
+            directory = Path(options["write_csv"])
+            directory.mkdir(parents=True, exist_ok=True)
+            for laps in sizes:
+                path = directory / f"bench-{laps}.csv"
+                path.write_bytes(synthetic_csv(laps, options["track"], options["noise"], options["seed"]))
+                self.stdout.write(f"Wrote {path}")
+            return
+
+        def report(results):
+            for result in results:
+                self.stderr.write(f"{result['laps']:>8} laps {result['stage']:>9}: {result['best_s'] * 1000:10.2f} ms")
+
+        data = run(sizes, options["repeat"], options["track"], options["noise"], options["seed"], report=report)
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text())
+            for (laps, stage, before, after, ratio) in compare(data, baseline):
+                self.stderr.write(f"{laps:>8} laps {stage:>9}: {before * 1000:10.2f} -> {after * 1000:10.2f} ms ({ratio:.2f}x)")
+
+        output = json.dumps(data, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from race50.leaderboards import compact
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-track top-K leaderboards from the track aggregates and drop surplus entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, help="Positions to keep per track and metric.")
+
+    def handle(self, *args, **options):
+        kept = compact(size=options["size"])
+        self.stdout.write(f"Kept {kept} leaderboard entries.")
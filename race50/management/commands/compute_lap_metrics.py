@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from race50 import aggregates, trends
+from race50.analytics import summarize
+from race50.cache import invalidate_user
+from race50.ingest import summary_fields
+from race50.models import Session
+from race50.storage import column_arrays, load_columns, save_metrics
+
+CLEAN_FIELDS = ["clean_laps_count", "clean_avg_lap_ms", "clean_consistency_percent"]
+
+
+class Command(BaseCommand):
+    help = ("Store the derived per-lap metrics, outlier flags and clean-lap summaries of sessions uploaded "
+            "before they were computed at ingest, then rebuild the track aggregates and trend buckets (as "
+            "rebuild_track_aggregates and backfill_trends do) so their clean averages include them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only process sessions of this username.")
+        parser.add_argument("--force", action="store_true",
+                            help="Recompute the metrics of every session, not only missing ones.")
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.order_by("id")
+        users = None
+        if options["user"]:
+            users = get_user_model().objects.filter(username=options["user"])
+            sessions = sessions.filter(user__in=users)
+
+        updated = 0
+        changed_users = set()
+        for session in sessions.only("id", "user_id", *CLEAN_FIELDS).iterator(chunk_size=500):
+            columns = load_columns(session)
+            if columns.metrics is not None and session.clean_laps_count is not None and not options["force"]:
+                continue
+            with transaction.atomic():
+                save_metrics(session, columns)
+                summary = summarize(*column_arrays(columns), outliers=columns.compute_metrics()["outlier"])
+                fields = summary_fields(summary)
+                for name in CLEAN_FIELDS:
+                    setattr(session, name, fields[name])
+                session.save(update_fields=CLEAN_FIELDS + ["updated_at"])
+            updated += 1
+            changed_users.add(session.user_id)
+        for user_id in changed_users:
+            invalidate_user(user_id)
+        self.stdout.write(f"Stored metrics of {updated} session(s).")
+        if updated:
+            rebuilt = aggregates.rebuild(users=users)
+            written = trends.rebuild(users=users)
+            self.stdout.write(f"Rebuilt {rebuilt} track aggregate(s) and {written} trend bucket(s).")
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from race50.export import FORMATS, export
+from race50.models import Session
+
+
+class Command(BaseCommand):
+    help = "Export sessions as one CSV, a ZIP of per-session CSVs or a NumPy .npz archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write.")
+        parser.add_argument("--format", choices=FORMATS, default=FORMATS[0])
+        parser.add_argument("--user", help="Only export the sessions of this username.")
+        parser.add_argument("--track", help="Only export sessions at this track.")
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.all()
+        if options["user"]:
+            user = get_user_model().objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"Unknown user '{options['user']}'.")
+            sessions = sessions.filter(user=user)
+        if options["track"]:
+            sessions = sessions.filter(track=options["track"])
+
+        written = 0
+        with open(options["output"], "wb") as output:
+            for chunk in export(sessions, options["format"]):
+                output.write(chunk)
+                written += len(chunk)
+        self.stdout.write(f"Wrote {written} bytes to {options['output']}.")
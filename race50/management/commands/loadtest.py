@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from race50.loadtest import (
+    DEFAULT_CONCURRENCY, DEFAULT_DURATION_S, DEFAULT_READ_KBPS, DEFAULT_SEND_DELAY_MS, DEFAULT_SLO_MS,
+    login_cookie, run,
+)
+from race50.models import User
+
+
+def _levels(value):
+    try:
+        return [int(level) for level in value.split(",") if level.strip()]
+    except ValueError:
+        raise CommandError(f"Invalid --concurrency '{value}'; expected comma-separated client counts.")
+
+
+class Command(BaseCommand):
+    help = ("Load test running WSGI and ASGI deployments (one worker each) with slow clients and report "
+            "the concurrency each worker sustains. Start the servers first, e.g. "
+            "`gunicorn telemetry.wsgi -w 1 -b 127.0.0.1:8001` and "
+            "`uvicorn telemetry.asgi:application --workers 1 --port 8002`.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wsgi", default="http://127.0.0.1:8001", help="Base URL of the WSGI deployment.")
+        parser.add_argument("--asgi", default="http://127.0.0.1:8002", help="Base URL of the ASGI deployment.")
+        parser.add_argument("--path", action="append", dest="paths",
+                            help="Path to request; repeat to cycle through several (default: /).")
+        parser.add_argument("--username", help="Log the clients in as this user.")
+        parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                            help="Comma-separated concurrent client counts (default: %(default)s).")
+        parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_S, help="Seconds per level.")
+        parser.add_argument("--send-delay-ms", type=int, default=DEFAULT_SEND_DELAY_MS,
+                            help="Pause inside each request head (default: %(default)s).")
+        parser.add_argument("--read-kbps", type=int, default=DEFAULT_READ_KBPS,
+                            help="Per-client download rate in KB/s, 0 for unthrottled (default: %(default)s).")
+        parser.add_argument("--slo-ms", type=int, default=DEFAULT_SLO_MS,
+                            help="p95 latency a level must meet to count as sustained (default: %(default)s).")
+        parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        cookie = ""
+        if options["username"]:
+            try:
+                cookie = login_cookie(options["username"])
+            except User.DoesNotExist:
+                raise CommandError(f"No user '{options['username']}'.")
+
+        def report(level):
+            p95 = f"{level['p95_ms']:9.1f}" if level["p95_ms"] is not None else "        -"
+            self.stderr.write(f"{level['target']:>5} {level['concurrency']:>5} clients: {level['rps']:8.1f} req/s "
+                              f"p95 {p95} ms, {level['errors']} errors")
+
+        data = run({"wsgi": options["wsgi"], "asgi": options["asgi"]}, options["paths"] or ["/"],
+                   _levels(options["concurrency"]), options["duration"], cookie, options["send_delay_ms"],
+                   options["read_kbps"], options["slo_ms"], report=report)
+
+        wsgi, asgi = (data["targets"][name]["sustained_concurrency"] for name in ("wsgi", "asgi"))
+        ratio = f" ({asgi / wsgi:.1f}x)" if wsgi else ""
+        self.stderr.write(f"Sustained concurrency per worker: wsgi {wsgi}, asgi {asgi}{ratio}")
+
+        output = json.dumps(data, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n")
+        else:
+            self.stdout.write(output)
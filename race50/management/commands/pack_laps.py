@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from race50.cache import invalidate_user
+from race50.models import Session, Lap, PackedLaps
+from race50.storage import ROWS, load_columns, save_packed, write_laps
+
+
+class Command(BaseCommand):
+    help = "Convert sessions stored as Lap rows to packed columnar storage (or back with --unpack)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-rows", action="store_true",
+                            help="Keep the Lap rows after packing them.")
+        parser.add_argument("--unpack", action="store_true",
+                            help="Convert packed sessions back to Lap rows.")
+        parser.add_argument("--user", help="Only convert sessions of this username.")
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.order_by("id")
+        if options["user"]:
+            sessions = sessions.filter(user__username=options["user"])
+
+        if options["unpack"]:
+            sessions = sessions.filter(packed_laps__isnull=False)
+        else:
+            sessions = sessions.filter(packed_laps__isnull=True, laps__isnull=False).distinct()
+
+        converted = 0
+        changed_users = set()
+        for session in sessions.only("id", "user_id").iterator(chunk_size=500):
+            with transaction.atomic():
+                if options["unpack"]:
+                    self.unpack(session)
+                else:
+                    self.pack(session, keep_rows=options["keep_rows"])
+                session.save(update_fields=["updated_at"])
+            converted += 1
+            changed_users.add(session.user_id)
+        for user_id in changed_users:
+            invalidate_user(user_id)
+
+        action = "Unpacked" if options["unpack"] else "Packed"
+        self.stdout.write(f"{action} {converted} session(s).")
+
+    def pack(self, session, keep_rows):
+        columns = load_columns(session)
+        save_packed(session, columns)
+        if not keep_rows:
+            Lap.objects.filter(session=session).delete()
+
+    def unpack(self, session):
+        columns = load_columns(session)
+        Lap.objects.filter(session=session).delete()
+        write_laps([(session, columns)], backend=ROWS)
+        PackedLaps.objects.filter(session=session).delete()
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from race50.jobs import process_pending
+
+
+class Command(BaseCommand):
+    help = "Process queued CSV uploads. Use --poll to keep running as a standalone worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll", type=float, default=0,
+                            help="Seconds to wait between queue checks; 0 drains the queue once and exits.")
+
+    def handle(self, *args, **options):
+        poll = options["poll"]
+        while True:
+            processed = process_pending()
+            if processed:
+                self.stdout.write(f"Processed {processed} upload(s).")
+            if not poll:
+                return
+            time.sleep(poll)
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from race50.aggregates import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute per-(user, track) aggregates from all stored sessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only rebuild the aggregates of this username.")
+
+    def handle(self, *args, **options):
+        users = None
+        if options["user"]:
+            users = get_user_model().objects.filter(username=options["user"])
+        rebuilt = rebuild(users=users)
+        self.stdout.write(f"Rebuilt {rebuilt} track aggregate(s).")
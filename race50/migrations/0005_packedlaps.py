@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0004_uploadjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedLaps',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed_laps', serialize=False, to='race50.session')),
+                ('count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('notes', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+    ]
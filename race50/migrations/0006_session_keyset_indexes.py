@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0005_packedlaps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='race50_sess_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', 'track', '-created_at', '-id'], name='race50_sess_user_track_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0006_session_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='best_s1_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='best_s2_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='best_s3_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TrackAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('track', models.CharField(max_length=100)),
+                ('session_count', models.PositiveIntegerField(default=0)),
+                ('laps_count', models.PositiveIntegerField(default=0)),
+                ('total_lap_ms', models.PositiveBigIntegerField(default=0)),
+                ('best_lap_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s1_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s2_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s3_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('tbl_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('recent_best_laps', models.JSONField(blank=True, default=list)),
+                ('recent_avg_laps', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('best_lap_session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='race50.session')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_aggregates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'track'), name='race50_trackagg_user_track_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0007_trackaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', 'external_id'], name='race50_sess_user_extid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadjob',
+            index=models.Index(fields=['user', 'content_hash'], name='race50_uplo_user_id_29c1ca_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='session',
+            constraint=models.UniqueConstraint(condition=models.Q(('content_hash', ''), _negated=True), fields=('user', 'content_hash'), name='race50_sess_user_hash_uniq'),
+        ),
+    ]
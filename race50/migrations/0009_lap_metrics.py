@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0008_upload_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lap',
+            name='delta_best_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lap',
+            name='delta_tbl_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lap',
+            name='rolling_std_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lap',
+            name='s1_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lap',
+            name='s2_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lap',
+            name='s3_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='packedlaps',
+            name='metrics',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0009_lap_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('track', models.CharField(max_length=100)),
+                ('metric', models.CharField(choices=[('best_lap', 'Best lap'), ('tbl', 'Theoretical best lap'), ('s1', 'Best sector 1'), ('s2', 'Best sector 2'), ('s3', 'Best sector 3')], max_length=10)),
+                ('value_ms', models.PositiveIntegerField()),
+                ('achieved_at', models.DateTimeField()),
+                ('session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='race50.session')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['track', 'metric', 'value_ms', 'achieved_at'], name='race50_lb_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('track', 'metric', 'user'), name='race50_lb_track_metric_user_uniq')],
+            },
+        ),
+    ]
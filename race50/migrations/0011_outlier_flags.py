@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0010_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lap',
+            name='outlier_flags',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='clean_avg_lap_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='clean_consistency_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='clean_laps_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackaggregate',
+            name='clean_laps_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trackaggregate',
+            name='clean_total_lap_ms',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
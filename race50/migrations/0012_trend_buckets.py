@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0011_outlier_flags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('track', models.CharField(max_length=100)),
+                ('period', models.CharField(choices=[('day', 'Daily'), ('week', 'Weekly'), ('month', 'Monthly')], max_length=5)),
+                ('start', models.DateField()),
+                ('session_count', models.PositiveIntegerField(default=0)),
+                ('laps_count', models.PositiveIntegerField(default=0)),
+                ('total_lap_ms', models.PositiveBigIntegerField(default=0)),
+                ('clean_laps_count', models.PositiveIntegerField(default=0)),
+                ('clean_total_lap_ms', models.PositiveBigIntegerField(default=0)),
+                ('consistency_sum', models.FloatField(default=0)),
+                ('clean_consistency_count', models.PositiveIntegerField(default=0)),
+                ('clean_consistency_sum', models.FloatField(default=0)),
+                ('best_lap_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s1_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s2_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_s3_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('tbl_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('best_lap_session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='race50.session')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trend_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'track', 'period', 'start'), name='race50_trend_bucket_uniq')],
+            },
+        ),
+    ]
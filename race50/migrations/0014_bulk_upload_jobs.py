@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0013_uploadjob_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='file_errors',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='kind',
+            field=models.CharField(choices=[('csv', 'Single CSV'), ('bulk', 'Bulk upload')], default='csv', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='results',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
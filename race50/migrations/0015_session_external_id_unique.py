@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+def rename_duplicates(apps, schema_editor):
+    # Sessions uploaded again before SessionIDs were unique keep their laps
+    # under a numbered SessionID; the first upload keeps the original
+    Session = apps.get_model('race50', 'Session')
+    taken = set(Session.objects.exclude(external_id='').values_list('user_id', 'external_id'))
+    seen = set()
+    for session in Session.objects.exclude(external_id='').exclude(external_id=None).order_by('id'):
+        key = (session.user_id, session.external_id)
+        if key not in seen:
+            seen.add(key)
+            continue
+        n = 2
+        while (session.user_id, f'{session.external_id} ({n})') in taken:
+            n += 1
+        session.external_id = f'{session.external_id} ({n})'
+        taken.add((session.user_id, session.external_id))
+        session.save(update_fields=['external_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0014_bulk_upload_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='session',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id', ''), _negated=True), fields=('user', 'external_id'), name='race50_sess_user_extid_uniq'),
+        ),
+    ]
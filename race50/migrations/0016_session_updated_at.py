@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+def start_at_upload(apps, schema_editor):
+    Session = apps.get_model('race50', 'Session')
+    Session.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race50', '0015_session_external_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(start_at_upload, migrations.RunPython.noop),
+    ]
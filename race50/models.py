@@ -22,12 +22,43 @@ class Session(models.Model):
     avg_lap_ms = models.PositiveIntegerField()
     tbl_ms = models.PositiveIntegerField()
     consistency_percent = models.FloatField()
+    best_s1_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s2_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s3_ms = models.PositiveIntegerField(null=True, blank=True)
+    # Over the laps without outlier flags (Lap.outlier_flags); NULL for
+    # sessions stored before the flags until `manage.py compute_lap_metrics`
+    clean_laps_count = models.PositiveIntegerField(null=True, blank=True)
+    clean_avg_lap_ms = models.PositiveIntegerField(null=True, blank=True)
+    clean_consistency_percent = models.FloatField(null=True, blank=True)
 
     notes = models.TextField(blank=True)
+    # SHA-256 of the uploaded file, so re-uploads find the stored session
+    content_hash = models.CharField(max_length=64, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Saved again whenever laps, lap metrics or summaries are rewritten
+    # after upload; the API validators and column URLs are built from it
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        indexes = [models.Index(fields=["user", "date"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_hash"],
+                condition=~models.Q(content_hash=""),
+                name="race50_sess_user_hash_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "external_id"],
+                condition=~models.Q(external_id=""),
+                name="race50_sess_user_extid_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "date"]),
+            models.Index(fields=["user", "external_id"], name="race50_sess_user_extid_idx"),
+            # Keyset pagination of the sessions list, with and without a track filter
+            models.Index(fields=["user", "-created_at", "-id"], name="race50_sess_user_created_idx"),
+            models.Index(fields=["user", "track", "-created_at", "-id"], name="race50_sess_user_track_idx"),
+        ]
 
     def __str__(self):
         return f"{self.track} @ {self.date} ({self.user})"
@@ -42,9 +73,276 @@ class Lap(models.Model):
     total_ms = models.PositiveIntegerField()
     notes = models.TextField(blank=True)
 
+    # Derived at ingest (race50.analytics.lap_metrics); NULL for laps stored
+    # before they existed until `manage.py compute_lap_metrics` runs
+    delta_best_ms = models.IntegerField(null=True, blank=True)
+    delta_tbl_ms = models.IntegerField(null=True, blank=True)
+    s1_rank = models.PositiveIntegerField(null=True, blank=True)
+    s2_rank = models.PositiveIntegerField(null=True, blank=True)
+    s3_rank = models.PositiveIntegerField(null=True, blank=True)
+    rolling_std_ms = models.FloatField(null=True, blank=True)
+    # race50.analytics.OUTLIER_* bits; 0 for a clean lap
+    outlier_flags = models.PositiveSmallIntegerField(null=True, blank=True)
+
     class Meta:
         unique_together = [("session", "lap")]
         indexes = [models.Index(fields=["session", "lap"])]
 
     def __str__(self):
-        return f"Lap {self.lap} — {self.total_ms} ms"
\ No newline at end of file
+        return f"Lap {self.lap} — {self.total_ms} ms"
+
+class UploadJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    CSV = "csv"
+    BULK = "bulk"
+    KIND_CHOICES = [
+        (CSV, "Single CSV"),
+        (BULK, "Bulk upload"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="upload_jobs")
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES, default=CSV)
+    original_name = models.CharField(max_length=255)
+    staged_path = models.CharField(max_length=500)
+    size = models.PositiveBigIntegerField()
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    laps_processed = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    errors = models.JSONField(default=list, blank=True)
+    session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Bulk jobs: one {session_id, source, laps_count, duplicate} per session,
+    # and the skipped rows per file
+    results = models.JSONField(default=list, blank=True)
+    file_errors = models.JSONField(default=dict, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["user", "content_hash"]),
+        ]
+
+    def __str__(self):
+        return f"{self.original_name} [{self.status}] ({self.user})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class PackedLaps(models.Model):
+    """
+    Columnar lap storage: the lap, s1, s2, s3 and total columns of a session
+    packed as little-endian uint32 arrays in one blob. Only non-empty notes
+    are kept, keyed by row index. `metrics` holds the derived per-lap
+    columns: five int32 arrays, a float64 rolling stddev and uint8 outlier
+    flags.
+    """
+    session = models.OneToOneField(Session, on_delete=models.CASCADE, primary_key=True, related_name="packed_laps")
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    notes = models.JSONField(default=dict, blank=True)
+    metrics = models.BinaryField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.count} packed laps — {self.session}"
+
+
+def _min(current, value):
+    if value is None:
+        return current
+    return value if current is None else min(current, value)
+
+
+class SessionTotals:
+    """
+    Lap totals and bests of the sessions folded into a TrackAggregate or a
+    TrendBucket.
+    """
+
+    @property
+    def avg_lap_ms(self):
+        if not self.laps_count:
+            return None
+        return round(self.total_lap_ms / self.laps_count)
+
+    @property
+    def clean_avg_lap_ms(self):
+        if not self.clean_laps_count:
+            return None
+        return round(self.clean_total_lap_ms / self.clean_laps_count)
+
+    def add_session(self, session):
+        """Folds one session's counts, best lap, best sectors and TBL in (in memory)."""
+        self.session_count += 1
+        self.laps_count += session.laps_count
+        self.total_lap_ms += session.avg_lap_ms * session.laps_count
+        if session.clean_laps_count:
+            self.clean_laps_count += session.clean_laps_count
+            self.clean_total_lap_ms += session.clean_avg_lap_ms * session.clean_laps_count
+
+        if self.best_lap_ms is None or session.best_lap_ms < self.best_lap_ms:
+            self.best_lap_ms = session.best_lap_ms
+            self.best_lap_session_id = session.id
+        self.best_s1_ms = _min(self.best_s1_ms, session.best_s1_ms)
+        self.best_s2_ms = _min(self.best_s2_ms, session.best_s2_ms)
+        self.best_s3_ms = _min(self.best_s3_ms, session.best_s3_ms)
+        if None not in (self.best_s1_ms, self.best_s2_ms, self.best_s3_ms):
+            self.tbl_ms = self.best_s1_ms + self.best_s2_ms + self.best_s3_ms
+
+
+class TrackAggregate(SessionTotals, models.Model):
+    """
+    All-time statistics of a user at a track, updated incrementally by every
+    upload. `recent_best_laps` and `recent_avg_laps` hold the values of the
+    latest sessions, oldest first, for rolling averages.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="track_aggregates")
+    track = models.CharField(max_length=100)
+
+    session_count = models.PositiveIntegerField(default=0)
+    laps_count = models.PositiveIntegerField(default=0)
+    total_lap_ms = models.PositiveBigIntegerField(default=0)
+    clean_laps_count = models.PositiveIntegerField(default=0)
+    clean_total_lap_ms = models.PositiveBigIntegerField(default=0)
+
+    best_lap_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_lap_session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    best_s1_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s2_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s3_ms = models.PositiveIntegerField(null=True, blank=True)
+    tbl_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    recent_best_laps = models.JSONField(default=list, blank=True)
+    recent_avg_laps = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "track"], name="race50_trackagg_user_track_uniq")]
+
+    def __str__(self):
+        return f"{self.track} ({self.user}): {self.session_count} sessions"
+
+    @property
+    def rolling_best_lap_ms(self):
+        if not self.recent_best_laps:
+            return None
+        return round(sum(self.recent_best_laps) / len(self.recent_best_laps))
+
+    @property
+    def rolling_avg_lap_ms(self):
+        if not self.recent_avg_laps:
+            return None
+        return round(sum(self.recent_avg_laps) / len(self.recent_avg_laps))
+
+
+class LeaderboardEntry(models.Model):
+    """
+    A user's best value of one metric at a track. Only entries that made the
+    track's top K when recorded are stored; `manage.py compact_leaderboards`
+    rebuilds them from TrackAggregate and drops the ones pushed out since.
+    """
+    BEST_LAP = "best_lap"
+    TBL = "tbl"
+    S1 = "s1"
+    S2 = "s2"
+    S3 = "s3"
+    METRIC_CHOICES = [
+        (BEST_LAP, "Best lap"),
+        (TBL, "Theoretical best lap"),
+        (S1, "Best sector 1"),
+        (S2, "Best sector 2"),
+        (S3, "Best sector 3"),
+    ]
+
+    track = models.CharField(max_length=100)
+    metric = models.CharField(max_length=10, choices=METRIC_CHOICES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="leaderboard_entries")
+    value_ms = models.PositiveIntegerField()
+    session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    achieved_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["track", "metric", "user"], name="race50_lb_track_metric_user_uniq"),
+        ]
+        indexes = [
+            # Top K of a (track, metric) is an index range scan with LIMIT K
+            models.Index(fields=["track", "metric", "value_ms", "achieved_at"], name="race50_lb_rank_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.track} {self.metric}: {self.value_ms} ms ({self.user})"
+
+
+class TrendBucket(SessionTotals, models.Model):
+    """
+    Statistics of a user's sessions at a track in one day, week (starting
+    Monday) or month, by session date. Updated incrementally by every upload
+    so trends read a bounded number of rows however long the history is.
+    Consistency is kept as a sum over sessions and averaged on read.
+    """
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    PERIOD_CHOICES = [
+        (DAY, "Daily"),
+        (WEEK, "Weekly"),
+        (MONTH, "Monthly"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="trend_buckets")
+    track = models.CharField(max_length=100)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    start = models.DateField()
+
+    session_count = models.PositiveIntegerField(default=0)
+    laps_count = models.PositiveIntegerField(default=0)
+    total_lap_ms = models.PositiveBigIntegerField(default=0)
+    clean_laps_count = models.PositiveIntegerField(default=0)
+    clean_total_lap_ms = models.PositiveBigIntegerField(default=0)
+    consistency_sum = models.FloatField(default=0)
+    clean_consistency_count = models.PositiveIntegerField(default=0)
+    clean_consistency_sum = models.FloatField(default=0)
+
+    best_lap_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_lap_session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    best_s1_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s2_ms = models.PositiveIntegerField(null=True, blank=True)
+    best_s3_ms = models.PositiveIntegerField(null=True, blank=True)
+    tbl_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Also the index of trend reads: one range scan per (user, track, period)
+            models.UniqueConstraint(fields=["user", "track", "period", "start"], name="race50_trend_bucket_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.track} ({self.user}) {self.period} {self.start}: {self.session_count} sessions"
+
+    @property
+    def consistency_percent(self):
+        if not self.session_count:
+            return None
+        return self.consistency_sum / self.session_count
+
+    @property
+    def clean_consistency_percent(self):
+        if not self.clean_consistency_count:
+            return None
+        return self.clean_consistency_sum / self.clean_consistency_count
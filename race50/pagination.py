@@ -0,0 +1,54 @@
+import base64
+import datetime
+
+from django.db.models import Q
+
+# Keyset (seek) pagination over (created_at, id), newest first. The cursor
+# is the position of the last row of the previous page, so each page costs
+# one index range scan however deep the user has paged.
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id), or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _seek(queryset, cursor):
+    position = decode_cursor(cursor)
+    if position is not None:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    return queryset.order_by("-created_at", "-id")
+
+
+def _split(rows, size):
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def keyset_page(queryset, cursor, size):
+    """
+    Returns (rows, next_cursor) for a queryset of dicts that include
+    "created_at" and "id". next_cursor is None on the last page.
+    """
+    return _split(list(_seek(queryset, cursor)[:size + 1]), size)
+
+
+async def akeyset_page(queryset, cursor, size):
+    """keyset_page for async views."""
+    return _split([row async for row in _seek(queryset, cursor)[:size + 1]], size)
@@ -0,0 +1,54 @@
+import json
+import struct
+
+import numpy as np
+
+from . import analytics
+
+# Validated laps wait in a spool file between parsing and writing, so an
+# upload holds one chunk in memory however many laps it has. Like
+# race50.analytics, this module must not import Django: process-pool
+# workers read and write spools.
+
+# Laps, notes bytes and metrics bytes of the chunk that follows
+_HEADER = struct.Struct("<III")
+_COLUMNS = 5
+
+
+def append(path, columns, notes, metrics=None):
+    """
+    Appends a chunk to a spool: its (lap, s1, s2, s3, total) uint32
+    columns, its sparse {row index: note} notes and, optionally, its
+    analytics.lap_metrics().
+    """
+    count = len(columns[0])
+    data = b"".join(np.asarray(column, dtype="<u4").tobytes() for column in columns)
+    encoded = json.dumps({str(k): v for (k, v) in notes.items()}).encode() if notes else b""
+    packed = analytics.pack_metrics(metrics) if metrics is not None else b""
+    with open(path, "ab") as f:
+        f.write(_HEADER.pack(count, len(encoded), len(packed)) + data + encoded + packed)
+
+
+def read(path):
+    """Yields the (columns, notes, metrics) chunks of a spool in order; metrics may be None."""
+    with open(path, "rb") as f:
+        while header := f.read(_HEADER.size):
+            (count, notes_size, metrics_size) = _HEADER.unpack(header)
+            data = f.read(count * 4 * _COLUMNS)
+            columns = tuple(np.frombuffer(data, dtype="<u4", count=count, offset=i * count * 4)
+                            for i in range(_COLUMNS))
+            notes = {int(k): v for (k, v) in json.loads(f.read(notes_size)).items()} if notes_size else {}
+            metrics = analytics.unpack_metrics(f.read(metrics_size), count) if metrics_size else None
+            yield columns, notes, metrics
+
+
+def summarize_spool(fold, source, target):
+    """
+    Second pass over a spooled session whose chunks were all added to
+    `fold`: appends every chunk of `source`, with its lap metrics, to
+    `target` and returns the session summary.
+    """
+    for (columns, notes, _) in read(source):
+        incidents = analytics.incident_mask(notes, len(columns[0]))
+        append(target, columns, notes, fold.metrics(*columns[1:], incidents=incidents))
+    return fold.summary()
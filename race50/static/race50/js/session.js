@@ -0,0 +1,128 @@
+// Client-side lap tables for long sessions. The page ships empty containers
+// and this script fetches each session's column payload (integer arrays,
+// see api.columns_payload) once, then builds the same markup as
+// templates/race50/lap_table.html plus a lap time chart.
+document.addEventListener('DOMContentLoaded', function () {
+  const ROWS_PER_FRAME = 2000;
+  const CHART_POINTS = 1000;
+  const payloads = {};
+
+  function load(url) {
+    if (!payloads[url]) {
+      payloads[url] = fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+        .then(response => {
+          if (!response.ok) throw new Error(response.status);
+          return response.json();
+        });
+    }
+    return payloads[url];
+  }
+
+  // Same output as the format_ms and format_delta template filters
+  function pad(value, size) {
+    return String(value).padStart(size, '0');
+  }
+
+  function formatMs(ms) {
+    return Math.floor(ms / 60000) + ':' + pad(Math.floor((ms % 60000) / 1000), 2) + '.' + pad(ms % 1000, 3);
+  }
+
+  function formatDelta(ms) {
+    const sign = ms < 0 ? '-' : '+';
+    ms = Math.abs(ms);
+    return sign + Math.floor(ms / 1000) + '.' + pad(ms % 1000, 3);
+  }
+
+  function escapeHtml(text) {
+    return text.replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+  }
+
+  // Same reasons as tables.OUTLIER_TITLES
+  const OUTLIER_REASONS = [[1, 'slow lap'], [2, 'slow sector'], [4, 'incident']];
+
+  function outlierTitle(flags) {
+    return OUTLIER_REASONS.filter(([bit]) => flags & bit).map(([, reason]) => reason).join(', ');
+  }
+
+  function rowHtml(data, i, bestLap) {
+    const std = data.rolling_std[i];
+    const note = data.notes[i];
+    const flags = data.outlier[i];
+    const title = [note, flags ? 'Not a clean lap: ' + outlierTitle(flags) : ''].filter(Boolean).join(' — ');
+    return '<tr' + (data.lap[i] === bestLap ? ' class="best-lap"' : (flags ? ' class="outlier-lap"' : '')) +
+      (title ? ' title="' + escapeHtml(title) + '"' : '') + '>' +
+      '<td>' + data.lap[i] + '</td>' +
+      '<td>' + formatMs(data.total[i]) + '</td>' +
+      '<td>' + formatMs(data.s1[i]) + ' <small class="sector-rank">#' + data.s1_rank[i] + '</small></td>' +
+      '<td>' + formatMs(data.s2[i]) + ' <small class="sector-rank">#' + data.s2_rank[i] + '</small></td>' +
+      '<td>' + formatMs(data.s3[i]) + ' <small class="sector-rank">#' + data.s3_rank[i] + '</small></td>' +
+      '<td>' + formatDelta(data.delta_best[i]) + '</td>' +
+      '<td>' + formatDelta(data.delta_tbl[i]) + '</td>' +
+      '<td>' + (std === null ? '' : (std / 1000).toFixed(3)) + '</td>' +
+      '</tr>';
+  }
+
+  function renderTable(container, data) {
+    const bestLap = Number(container.dataset.bestLap);
+    container.innerHTML =
+      '<table class="lap-table"><thead><tr>' +
+      '<th>Lap:</th><th>Total Time:</th><th>S1 Time:</th><th>S2 Time:</th><th>S3 Time:</th>' +
+      '<th title="Gap to the best lap">Δ Best:</th>' +
+      '<th title="Gap to the theoretical best lap">Δ TBL:</th>' +
+      '<th title="Standard deviation of this and the previous laps, in seconds">Rolling σ:</th>' +
+      '</tr></thead><tbody></tbody></table>';
+    const body = container.querySelector('tbody');
+    let start = 0;
+
+    // Append in slices so very long sessions do not block the page
+    function next() {
+      const end = Math.min(start + ROWS_PER_FRAME, data.lap.length);
+      let html = '';
+      for (let i = start; i < end; i++) html += rowHtml(data, i, bestLap);
+      body.insertAdjacentHTML('beforeend', html);
+      start = end;
+      if (start < data.lap.length) requestAnimationFrame(next);
+    }
+    next();
+  }
+
+  function renderChart(container, data) {
+    const total = data.total;
+    if (!total.length) return;
+    // Keep the fastest lap of each bucket so the chart stays light
+    const step = Math.max(1, Math.ceil(total.length / CHART_POINTS));
+    const points = [];
+    for (let i = 0; i < total.length; i += step) {
+      let best = i;
+      for (let j = i + 1; j < Math.min(i + step, total.length); j++) {
+        if (total[j] < total[best]) best = j;
+      }
+      points.push([best, total[best]]);
+    }
+    // Scale to the 95th percentile so one slow lap does not flatten the rest
+    const sorted = points.map(p => p[1]).sort((a, b) => a - b);
+    const low = sorted[0];
+    const high = Math.max(sorted[Math.floor((sorted.length - 1) * 0.95)], low + 1);
+    const width = 1000;
+    const height = 120;
+    const x = i => (total.length > 1 ? (i / (total.length - 1)) * width : width / 2);
+    const y = v => height - 5 - (Math.min(v, high) - low) / (high - low) * (height - 10);
+    const best = points.reduce((a, b) => (b[1] < a[1] ? b : a));
+
+    container.innerHTML =
+      '<svg viewBox="0 0 ' + width + ' ' + height + '" preserveAspectRatio="none">' +
+      '<polyline points="' + points.map(p => x(p[0]).toFixed(1) + ',' + y(p[1]).toFixed(1)).join(' ') + '"></polyline>' +
+      '<circle r="4" cx="' + x(best[0]).toFixed(1) + '" cy="' + y(best[1]).toFixed(1) + '"></circle>' +
+      '</svg>';
+  }
+
+  document.querySelectorAll('.client-lap-table').forEach(container => {
+    load(container.dataset.lapsUrl)
+      .then(data => renderTable(container, data))
+      .catch(() => { container.textContent = 'Could not load the laps.'; });
+  });
+
+  document.querySelectorAll('.lap-chart').forEach(container => {
+    load(container.dataset.lapsUrl).then(data => renderChart(container, data)).catch(() => {});
+  });
+});
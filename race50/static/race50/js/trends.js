@@ -0,0 +1,38 @@
+// Best and average lap per trend bucket, drawn from trends.json (the same
+// rollups as the table on the page).
+document.addEventListener('DOMContentLoaded', function () {
+  const WIDTH = 1000;
+  const HEIGHT = 160;
+
+  function renderChart(container, buckets) {
+    const series = {
+      'trend-best': buckets.map(b => b.best_lap_ms),
+      'trend-avg': buckets.map(b => b.avg_lap_ms),
+    };
+    const values = Object.values(series).flat().filter(v => v !== null);
+    if (!values.length) return;
+    const low = Math.min(...values);
+    const high = Math.max(Math.max(...values), low + 1);
+    const x = i => (buckets.length > 1 ? (i / (buckets.length - 1)) * WIDTH : WIDTH / 2);
+    const y = v => HEIGHT - 5 - (v - low) / (high - low) * (HEIGHT - 10);
+
+    let svg = '<svg viewBox="0 0 ' + WIDTH + ' ' + HEIGHT + '" preserveAspectRatio="none">';
+    for (const [name, points] of Object.entries(series)) {
+      const coords = points
+        .map((v, i) => (v === null ? null : x(i).toFixed(1) + ',' + y(v).toFixed(1)))
+        .filter(Boolean);
+      svg += '<polyline class="' + name + '" points="' + coords.join(' ') + '"></polyline>';
+    }
+    container.innerHTML = svg + '</svg>';
+  }
+
+  document.querySelectorAll('.trend-chart').forEach(container => {
+    fetch(container.dataset.trendsUrl, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+      .then(response => {
+        if (!response.ok) throw new Error(response.status);
+        return response.json();
+      })
+      .then(data => renderChart(container, data.buckets))
+      .catch(() => { container.textContent = 'Could not load the chart.'; });
+  });
+});
@@ -0,0 +1,26 @@
+// Poll the job status until the worker finishes, then reload the page
+// (which redirects to the session when the upload was clean).
+document.addEventListener('DOMContentLoaded', function () {
+  const poll = document.getElementById('job-poll');
+  const status = document.getElementById('job-status');
+  const laps = document.getElementById('job-laps');
+  if (!poll) return;
+  const url = poll.dataset.url;
+
+  function check() {
+    fetch(url + '?format=json', { headers: { 'Accept': 'application/json' } })
+      .then(response => response.json())
+      .then(job => {
+        laps.textContent = job.laps_processed;
+        status.textContent = job.status.charAt(0).toUpperCase() + job.status.slice(1);
+        if (job.status === 'done' || job.status === 'failed') {
+          window.location.href = url;
+        } else {
+          setTimeout(check, 1000);
+        }
+      })
+      .catch(() => setTimeout(check, 3000));
+  }
+
+  setTimeout(check, 500);
+});
@@ -0,0 +1,389 @@
+import csv
+import io
+import math
+import os
+import sys
+from array import array
+from collections import namedtuple
+from itertools import groupby
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from . import analytics, spool
+from .models import Lap, PackedLaps
+
+ROWS = "rows"
+PACKED = "packed"
+
+COLUMNS = ("lap", "s1", "s2", "s3", "total")
+
+# Derived per-lap columns (analytics.lap_metrics), written with the laps so
+# reads never recompute them, and the Lap fields holding them. All are
+# integers except the rolling stddev, which is NaN/NULL until its window
+# fills; "outlier" holds the analytics.OUTLIER_* bits.
+METRICS = ("delta_best", "delta_tbl", "s1_rank", "s2_rank", "s3_rank", "rolling_std", "outlier")
+METRIC_FIELDS = ("delta_best_ms", "delta_tbl_ms", "s1_rank", "s2_rank", "s3_rank", "rolling_std_ms", "outlier_flags")
+INT_METRICS = METRICS[:5]
+
+# Laps are written in chunks of this size by the row backend
+LAP_CHUNK_SIZE = getattr(settings, "RACE50_LAP_CHUNK_SIZE", 2000)
+
+# On PostgreSQL the row backend streams laps with COPY, in chunks of this size
+COPY_CHUNK_SIZE = getattr(settings, "RACE50_COPY_CHUNK_SIZE", 50000)
+
+LapRow = namedtuple("LapRow", ["lap", "s1_ms", "s2_ms", "s3_ms", "total_ms", "notes"])
+
+
+def storage_backend():
+    return getattr(settings, "RACE50_LAP_STORAGE", ROWS)
+
+
+def _uint32():
+    a = array("I")
+    assert a.itemsize == 4
+    return a
+
+
+class LapColumns:
+    """
+    A session's laps as parallel uint32 arrays, in upload order, plus a
+    sparse {row index: note} dict and, once computed or loaded, the derived
+    per-lap metrics as a {name: numpy array} dict.
+    """
+
+    def __init__(self, lap=None, s1=None, s2=None, s3=None, total=None, notes=None, metrics=None):
+        self.lap = lap if lap is not None else _uint32()
+        self.s1 = s1 if s1 is not None else _uint32()
+        self.s2 = s2 if s2 is not None else _uint32()
+        self.s3 = s3 if s3 is not None else _uint32()
+        self.total = total if total is not None else _uint32()
+        self.notes = notes if notes is not None else {}
+        self.metrics = metrics
+
+    def __len__(self):
+        return len(self.lap)
+
+    def append(self, lap, s1, s2, s3, total, notes=""):
+        if notes:
+            self.notes[len(self.lap)] = notes
+        self.lap.append(lap)
+        self.s1.append(s1)
+        self.s2.append(s2)
+        self.s3.append(s3)
+        self.total.append(total)
+
+    def rows(self):
+        notes = self.notes
+        for i in range(len(self.lap)):
+            yield LapRow(self.lap[i], self.s1[i], self.s2[i], self.s3[i], self.total[i], notes.get(i, ""))
+
+    def compute_metrics(self):
+        """The derived metrics, computed only if they were not stored."""
+        if self.metrics is None:
+            incidents = analytics.incident_mask(self.notes, len(self))
+            self.metrics = analytics.lap_metrics(*column_arrays(self), incidents=incidents)
+        return self.metrics
+
+    def metric_rows(self, size=None):
+        """
+        One tuple of METRICS values per lap, with None for undefined values.
+        The columns are converted to Python values `size` laps at a time.
+        """
+        metrics = self.compute_metrics()
+        size = size or LAP_CHUNK_SIZE
+        for start in range(0, len(self), size):
+            values = {name: metrics[name][start:start + size].tolist() for name in METRICS}
+            values["rolling_std"] = [None if math.isnan(v) else v for v in values["rolling_std"]]
+            yield from zip(*(values[name] for name in METRICS))
+
+    def pack_metrics(self):
+        return analytics.pack_metrics(self.compute_metrics())
+
+    @staticmethod
+    def unpack_metrics(blob, count):
+        """The metrics of pack_metrics(), or None for blobs written before the outlier flags."""
+        return analytics.unpack_metrics(blob, count)
+
+    def pack(self):
+        blob = bytearray()
+        for name in COLUMNS:
+            column = getattr(self, name)
+            if sys.byteorder == "big":
+                column = array("I", column)
+                column.byteswap()
+            blob += column.tobytes()
+        return bytes(blob)
+
+    @classmethod
+    def from_chunk(cls, columns, notes, metrics=None):
+        """LapColumns of a spool.read() chunk."""
+        arrays = []
+        for column in columns:
+            values = _uint32()
+            values.frombytes(column.astype(np.uint32).tobytes())
+            arrays.append(values)
+        return cls(*arrays, notes=notes, metrics=metrics)
+
+    @classmethod
+    def join(cls, chunks):
+        """One LapColumns of consecutive chunks, with metrics if every chunk has them."""
+        joined = cls()
+        metrics = []
+        for chunk in chunks:
+            joined.notes.update({len(joined) + i: note for (i, note) in chunk.notes.items()})
+            for name in COLUMNS:
+                getattr(joined, name).extend(getattr(chunk, name))
+            metrics.append(chunk.metrics)
+        if metrics and None not in metrics:
+            joined.metrics = {name: np.concatenate([m[name] for m in metrics]) for name in METRICS}
+        return joined
+
+    @classmethod
+    def unpack(cls, blob, count, notes=None, metrics=None):
+        blob = bytes(blob)
+        size = count * 4
+        columns = []
+        for i in range(len(COLUMNS)):
+            column = _uint32()
+            column.frombytes(blob[i * size:(i + 1) * size])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column)
+        notes = {int(k): v for (k, v) in (notes or {}).items()}
+        if metrics is not None:
+            metrics = cls.unpack_metrics(metrics, count)
+        return cls(*columns, notes=notes, metrics=metrics)
+
+
+def load_columns(session):
+    """Loads a session's laps from whichever backend holds them."""
+    packed = PackedLaps.objects.filter(session=session).only("count", "data", "notes", "metrics").first()
+    if packed is not None:
+        return LapColumns.unpack(packed.data, packed.count, packed.notes, packed.metrics)
+    return _load_rows([session.id])[session.id]
+
+
+def load_columns_many(sessions):
+    """
+    Loads the laps of several sessions with at most one Lap query, returning
+    {session id: LapColumns}. Fetch the sessions with
+    select_related("packed_laps") to avoid a PackedLaps query per session.
+    """
+    result = {}
+    missing = []
+    for session in sessions:
+        try:
+            packed = session.packed_laps
+        except PackedLaps.DoesNotExist:
+            missing.append(session.id)
+        else:
+            result[session.id] = LapColumns.unpack(packed.data, packed.count, packed.notes, packed.metrics)
+
+    if missing:
+        result.update(_load_rows(missing))
+    return result
+
+
+def _metrics_from_rows(values):
+    columns = dict(zip(METRICS, zip(*values)))
+    metrics = {name: np.array(columns[name], dtype=np.int64) for name in INT_METRICS}
+    metrics["rolling_std"] = np.array([math.nan if v is None else v for v in columns["rolling_std"]], dtype=np.float64)
+    metrics["outlier"] = np.array(columns["outlier"], dtype=np.uint8)
+    return metrics
+
+
+def _load_rows(session_ids):
+    result = {session_id: LapColumns() for session_id in session_ids}
+    metric_values = {session_id: [] for session_id in session_ids}
+    rows = (Lap.objects.filter(session_id__in=session_ids).order_by("session_id", "id")
+            .values_list("session_id", "lap", "s1_ms", "s2_ms", "s3_ms", "total_ms", "notes", *METRIC_FIELDS))
+    for (session_id, lap, s1, s2, s3, total, notes, *metrics) in rows.iterator(chunk_size=LAP_CHUNK_SIZE):
+        result[session_id].append(lap, s1, s2, s3, total, notes)
+        metric_values[session_id].append(metrics)
+
+    for (session_id, values) in metric_values.items():
+        # Sessions stored before the metrics, or the outlier flags, existed
+        # have NULLs until backfilled
+        if values and values[0][0] is not None and values[0][-1] is not None:
+            result[session_id].metrics = _metrics_from_rows(values)
+    return result
+
+
+def save_packed(session, columns):
+    return PackedLaps.objects.update_or_create(
+        session=session,
+        defaults={
+            "count": len(columns),
+            "data": columns.pack(),
+            "notes": {str(k): v for (k, v) in columns.notes.items()},
+            "metrics": columns.pack_metrics(),
+        },
+    )[0]
+
+
+def save_metrics(session, columns):
+    """Stores recomputed metrics for an existing session, e.g. when backfilling."""
+    columns.metrics = None
+    if PackedLaps.objects.filter(session=session).update(metrics=columns.pack_metrics()):
+        return
+    laps = list(Lap.objects.filter(session=session).order_by("id").only("id"))
+    for (lap, values) in zip(laps, columns.metric_rows()):
+        for (field, value) in zip(METRIC_FIELDS, values):
+            setattr(lap, field, value)
+    Lap.objects.bulk_update(laps, METRIC_FIELDS, batch_size=LAP_CHUNK_SIZE)
+
+
+def column_arrays(columns):
+    """The numeric columns as a plain tuple, e.g. for analytics.summarize()."""
+    return (columns.lap, columns.s1, columns.s2, columns.s3, columns.total)
+
+
+class LapSpool:
+    """
+    A session's validated laps on their way to storage. append() collects
+    LAP_CHUNK_SIZE laps at a time, folds them into an
+    analytics.SessionFold and spools them to `path`; summarize() adds the
+    lap metrics in a second pass over the spool and chunks() yields the
+    result as LapColumns for write_laps(). Memory stays at one chunk plus
+    the fold however long the session is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fold = analytics.SessionFold()
+        self.pending = LapColumns()
+
+    def __len__(self):
+        return self.fold.count + len(self.pending)
+
+    @property
+    def target(self):
+        return self.path + ".metrics"
+
+    def append(self, lap, s1, s2, s3, total, notes=""):
+        self.pending.append(lap, s1, s2, s3, total, notes)
+        if len(self.pending) >= LAP_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending):
+            self.fold.add(*column_arrays(self.pending))
+            spool.append(self.path, column_arrays(self.pending), self.pending.notes)
+            self.pending = LapColumns()
+
+    def summarize(self):
+        """The analytics.summarize() of the session; call once every lap was appended."""
+        self.flush()
+        return spool.summarize_spool(self.fold, self.path, self.target)
+
+    def chunks(self):
+        if os.path.exists(self.target):
+            for (columns, notes, metrics) in spool.read(self.target):
+                yield LapColumns.from_chunk(columns, notes, metrics)
+
+
+def use_copy():
+    return connection.vendor == "postgresql" and getattr(settings, "RACE50_PG_COPY", True)
+
+
+def copy_chunks(items, size=None):
+    """
+    Yields (buffer, rows) CSV chunks of Lap rows for COPY ... FROM STDIN,
+    in the column order of copy_sql(). Strings are quoted so empty notes
+    stay empty strings instead of NULL.
+    """
+    size = size or COPY_CHUNK_SIZE
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+    rows = 0
+    for (session, columns) in items:
+        for (row, metrics) in zip(columns.rows(), columns.metric_rows(size)):
+            writer.writerow((session.pk,) + tuple(row) + metrics)
+            rows += 1
+            if rows >= size:
+                buffer.seek(0)
+                yield buffer, rows
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+                rows = 0
+    if rows:
+        buffer.seek(0)
+        yield buffer, rows
+
+
+def copy_sql():
+    fields = ["session", "lap", "s1_ms", "s2_ms", "s3_ms", "total_ms", "notes", *METRIC_FIELDS]
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(Lap._meta.get_field(name).column) for name in fields)
+    # csv writes None as "" when quoting strings; FORCE_NULL reads it back as NULL
+    force_null = quote(Lap._meta.get_field("rolling_std_ms").column)
+    return f"COPY {quote(Lap._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, FORCE_NULL ({force_null}))"
+
+
+def _copy_laps(items, progress=None):
+    sql = copy_sql()
+    written = 0
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        for (buffer, rows) in copy_chunks(items):
+            if hasattr(raw, "copy_expert"):
+                raw.copy_expert(sql, buffer)
+            else:
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+            written += rows
+            if progress is not None:
+                progress(written)
+
+
+def write_laps(items, backend=None, progress=None):
+    """
+    Stores the laps of several sessions, given as (session, LapColumns)
+    pairs; consecutive pairs of one session are parts of its laps, e.g.
+    LapSpool.chunks(). The row backend uses COPY on PostgreSQL, otherwise
+    fixed-size bulk_create chunks that span session boundaries; `progress`
+    is called with the laps written so far.
+    """
+    if (backend or storage_backend()) == PACKED:
+        written = 0
+        for (session, group) in groupby(items, key=lambda item: item[0]):
+            chunks = [columns for (_, columns) in group]
+            columns = chunks[0] if len(chunks) == 1 else LapColumns.join(chunks)
+            save_packed(session, columns)
+            written += len(columns)
+            if progress is not None:
+                progress(written)
+        return
+
+    if use_copy():
+        _copy_laps(items, progress)
+        return
+
+    chunk = []
+    written = 0
+    for (session, columns) in items:
+        for (row, metrics) in zip(columns.rows(), columns.metric_rows()):
+            chunk.append(Lap(
+                session=session,
+                lap=row.lap,
+                s1_ms=row.s1_ms,
+                s2_ms=row.s2_ms,
+                s3_ms=row.s3_ms,
+                total_ms=row.total_ms,
+                notes=row.notes,
+                **dict(zip(METRIC_FIELDS, metrics)),
+            ))
+            if len(chunk) >= LAP_CHUNK_SIZE:
+                Lap.objects.bulk_create(chunk)
+                written += len(chunk)
+                chunk = []
+                if progress is not None:
+                    progress(written)
+    if chunk:
+        Lap.objects.bulk_create(chunk)
+        written += len(chunk)
+        if progress is not None:
+            progress(written)
@@ -0,0 +1,45 @@
+import math
+
+from .analytics import OUTLIER_REASONS
+from .storage import METRICS
+from .timefmt import format_delta_many, format_ms_many
+
+
+# Why a lap is not clean, for every combination of outlier flags
+OUTLIER_TITLES = {
+    flags: ", ".join(reason for (bit, reason) in OUTLIER_REASONS if flags & bit)
+    for flags in range(1 << len(OUTLIER_REASONS))
+}
+
+
+def lap_table(columns, best_lap_number):
+    """
+    Row-oriented lap table for templates: one dict per lap with the times
+    and stored per-lap metrics already formatted and the best lap flagged,
+    so templates loop once. Each column is formatted in one call.
+    """
+    metrics = columns.compute_metrics()
+    total, s1, s2, s3 = (format_ms_many(getattr(columns, name)) for name in ("total", "s1", "s2", "s3"))
+    delta_best, delta_tbl = (format_delta_many(metrics[name]) for name in ("delta_best", "delta_tbl"))
+    s1_rank, s2_rank, s3_rank = (metrics[name].tolist() for name in METRICS[2:5])
+    rolling_std = ["" if math.isnan(v) else f"{v / 1000:.3f}" for v in metrics["rolling_std"].tolist()]
+    outlier = [OUTLIER_TITLES[flags] for flags in metrics["outlier"].tolist()]
+
+    return [
+        {
+            "lap": lap,
+            "total": total[i],
+            "s1": s1[i],
+            "s2": s2[i],
+            "s3": s3[i],
+            "s1_rank": s1_rank[i],
+            "s2_rank": s2_rank[i],
+            "s3_rank": s3_rank[i],
+            "delta_best": delta_best[i],
+            "delta_tbl": delta_tbl[i],
+            "rolling_std": rolling_std[i],
+            "outlier": outlier[i],
+            "is_best": lap == best_lap_number,
+        }
+        for (i, lap) in enumerate(columns.lap.tolist())
+    ]
@@ -1,15 +1,20 @@
 from django import template
 
+from .. import tables, timefmt
+
 register = template.Library()
 
 @register.filter(name="format_ms")
 def format_ms(ms):
-    try:
-        ms = int(ms)
-    except (TypeError, ValueError):
-        return ""  # or return ms
-
-    minutes = ms // 60000
-    seconds = (ms % 60000) // 1000
-    millis  = ms % 1000
-    return f"{minutes}:{seconds:02d}.{millis:03d}"
\ No newline at end of file
+    return timefmt.format_ms(ms)
+
+
+@register.filter(name="format_delta")
+def format_delta(ms):
+    return timefmt.format_delta(ms)
+
+
+@register.inclusion_tag("race50/lap_table.html")
+def lap_table(columns, best_lap_number):
+    """A full lap table from LapColumns, formatted column by column."""
+    return {"rows": tables.lap_table(columns, best_lap_number)}
@@ -1,3 +1,1443 @@
-from django.test import TestCase
+import io
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+from array import array
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import User, Session, Lap, LeaderboardEntry, PackedLaps, TrackAggregate, TrendBucket, UploadJob
+from . import analytics, api, benchmark, bulk, ingest, jobs, leaderboards, loadtest, storage, tables, timefmt, trends, views
+from . import cache as race50_cache
 
 # Create your tests here.
+EXAMPLES_DIR = Path(__file__).resolve().parent.parent / "csv examples"
+HEADER = "SessionID,Track,Date,Lap,LapTime_ms,S1_ms,S2_ms,S3_ms,Notes\n"
+# Named at import for the override_settings decorators below, created and
+# removed around the module's tests
+STAGING_DIR = os.path.join(tempfile.gettempdir(), f"race50-staging-{os.getpid()}")
+# Wall-clock assertions depend on the machine; RACE50_TIMING_TESTS=1 turns them on
+TIMING_TESTS = os.environ.get("RACE50_TIMING_TESTS") == "1"
+
+
+def setUpModule():
+    os.makedirs(STAGING_DIR, exist_ok=True)
+
+
+def tearDownModule():
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+
+
+@override_settings(RACE50_INSTRUMENTATION_SAMPLE_RATE=0.0, RACE50_UPLOAD_ASYNC=False,
+                   RACE50_UPLOAD_STAGING_DIR=STAGING_DIR)
+class Race50TestCase(TestCase):
+    """
+    Request sampling is off in tests so their query counts and headers are
+    deterministic, and uploads are processed inline. Each test starts with
+    an empty cache and `username` logged in, unless it is None.
+    """
+    username = "driver"
+
+    def setUp(self):
+        cache.clear()
+        if self.username:
+            self.user = User.objects.create_user(self.username, f"{self.username}@example.com", "secret")
+            self.client.force_login(self.user)
+
+    def post_csv(self, content, name="session.csv"):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        upload = SimpleUploadedFile(name, content, content_type="text/csv")
+        return self.client.post(reverse("upload"), {"csv_file": upload}, follow=True)
+
+    def upload(self, path):
+        """Uploads a sample file (a path or a name in EXAMPLES_DIR) and returns its session."""
+        path = EXAMPLES_DIR / path
+        self.client.post(reverse("upload"), {"csv_file": SimpleUploadedFile(path.name, path.read_bytes())})
+        return Session.objects.get(user=self.user, external_id=path.stem)
+
+    def ingest_laps(self, date, *lap_times, user=None, track="Test Track"):
+        """Stores a session of the given lap times through ingest_csv, with made-up sectors."""
+        sid = f"S{Session.objects.count()}"
+        rows = "".join(
+            f"{sid},{track},{date},{i},{t},10000,10000,{t - 20000},\n" for (i, t) in enumerate(lap_times, start=1)
+        )
+        return ingest.ingest_csv(io.BytesIO((HEADER + rows).encode()), user or self.user)[0]
+
+
+def reference_format_ms(ms):
+    # The original per-cell format_ms filter
+    try:
+        ms = int(ms)
+    except (TypeError, ValueError):
+        return ""
+    return f"{ms // 60000}:{(ms % 60000) // 1000:02d}.{ms % 1000:03d}"
+
+
+def reference_format_delta(ms):
+    try:
+        ms = int(round(float(ms)))
+    except (TypeError, ValueError):
+        return ""
+    sign = "-" if ms < 0 else "+"
+    ms = abs(ms)
+    return f"{sign}{ms // 1000}.{ms % 1000:03d}"
+
+
+def reference_summary(path):
+    # Summary as computed by the original list-based upload view
+    rows = []
+    for line in path.read_text(encoding="utf-8-sig").splitlines()[1:]:
+        cols = line.split(",")
+        rows.append((int(cols[3]), int(cols[4]), int(cols[5]), int(cols[6]), int(cols[7])))
+    lap_times = [r[1] for r in rows]
+    mean = sum(lap_times) / len(lap_times)
+    stddev = math.sqrt(sum((t - mean) ** 2 for t in lap_times) / len(lap_times))
+    return {
+        "laps_count": len(rows),
+        "best_lap_ms": min(lap_times),
+        "best_lap_number": min(rows, key=lambda r: r[1])[0],
+        "worst_lap_ms": max(lap_times),
+        "avg_lap_ms": int(round(mean)),
+        "tbl_ms": min(r[2] for r in rows) + min(r[3] for r in rows) + min(r[4] for r in rows),
+        "consistency_percent": (1 - (stddev / mean)) * 100,
+    }
+
+
+class UploadTests(Race50TestCase):
+    def test_sample_files_match_reference_summary(self):
+        for path in sorted(EXAMPLES_DIR.glob("*.csv")):
+            response = self.post_csv(path.read_bytes(), path.name)
+            session = Session.objects.get(user=self.user, external_id=path.stem)
+            self.assertRedirects(response, reverse("session", args=[session.id]))
+            expected = reference_summary(path)
+            for field, value in expected.items():
+                if field == "consistency_percent":
+                    self.assertAlmostEqual(session.consistency_percent, value, places=9)
+                else:
+                    self.assertEqual(getattr(session, field), value, f"{path.name}: {field}")
+            self.assertEqual(session.laps.count(), expected["laps_count"])
+
+    def test_laps_written_in_chunks(self):
+        rows = "".join(
+            f"S1,Test Track,2025-09-01,{i},30000,10000,10000,10000,\n" for i in range(1, 12)
+        )
+        chunk_size = storage.LAP_CHUNK_SIZE
+        storage.LAP_CHUNK_SIZE = 4
+        try:
+            with mock.patch.object(Lap.objects, "bulk_create", wraps=Lap.objects.bulk_create) as bulk_create:
+                response = self.post_csv(HEADER + rows)
+        finally:
+            storage.LAP_CHUNK_SIZE = chunk_size
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertEqual(Lap.objects.count(), 11)
+        self.assertEqual(Session.objects.get().laps_count, 11)
+
+    def test_invalid_rows_are_reported(self):
+        rows = (
+            "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,\n"
+            "S1,Test Track,2025-09-01,2,5000,2000,2000,1000,\n"
+            "S2,Test Track,2025-09-01,3,30000,10000,10000,10000,\n"
+        )
+        response = self.post_csv(HEADER + rows)
+        self.assertEqual(Session.objects.get().laps_count, 1)
+        self.assertEqual(len(response.context["job"].errors), 2)
+        self.assertEqual(response.context["session_url"], reverse("session", args=[Session.objects.get().id]))
+
+        response = self.post_csv(HEADER + "S1,Test Track,2025-09-01,1,-1,1,1,1,\n")
+        job = response.context["job"]
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertEqual(job.message, "No valid rows found in the CSV.")
+        self.assertEqual(job.errors, ["Row 2: values must be positive"])
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_error_messages_are_bounded(self):
+        bad = "S1,Test Track,2025-09-01,1,-1,1,1,1,\n" * (ingest.MAX_ERROR_MESSAGES + 5)
+        response = self.post_csv(HEADER + bad)
+        errors = response.context["job"].errors
+        self.assertEqual(len(errors), ingest.MAX_ERROR_MESSAGES + 1)
+        self.assertEqual(errors[-1], "... and 5 more errors")
+
+    def test_fast_path_matches_sniffing_path(self):
+        content = (HEADER
+                   + "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,clean air\n"
+                   + "\n"
+                   + "S1,Test Track,2025-09-01,2,30000,10000,10000,\n"
+                   + "S1,Test Track,2025-09-01,3,abc,10000,10000,10000\n"
+                   + "S1,,2025-09-01,4,30000,10000,10000,10000,\n"
+                   + 'S1,"Track, with comma",2025-09-01,5,30000,10000,10000,10000,"a ""quoted"" note"\n').encode()
+        results = []
+        for fast in (True, False):
+            errors = ingest.ErrorLog()
+            rows = list(ingest.validate_rows(ingest.open_csv(io.BytesIO(content), fast=fast), errors))
+            results.append((rows, errors.as_list()))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0][0]), 2)
+
+        semicolons = HEADER.replace(",", ";") + "S1;Test Track;2025-09-01;1;30000;10000;10000;10000;\n"
+        rows = list(ingest.validate_rows(ingest.open_csv(io.BytesIO(semicolons.encode())), ingest.ErrorLog()))
+        self.assertEqual(rows[0][:8], ("S1", "Test Track", "2025-09-01", 1, 10000, 10000, 10000, 30000))
+
+    def test_binary_file_rejected(self):
+        response = self.post_csv(b"\x00\x01\x02")
+        self.assertEqual(response.context["job"].message, "File appears to be binary or corrupted.")
+
+    def test_reupload_returns_existing_session(self):
+        path = EXAMPLES_DIR / "PLA-2025-09-05-S02.csv"
+        self.post_csv(path.read_bytes(), path.name)
+        session = Session.objects.get()
+        self.assertEqual(len(session.content_hash), 64)
+
+        with mock.patch.object(ingest, "open_csv") as open_csv:
+            response = self.post_csv(path.read_bytes(), path.name)
+        open_csv.assert_not_called()
+        self.assertRedirects(response, reverse("session", args=[session.id]))
+        self.assertEqual(UploadJob.objects.latest("id").session, session)
+
+        # Same SessionID in a different file stops at the first row
+        response = self.post_csv(path.read_bytes().replace(b"\n", b"\r\n"), path.name)
+        self.assertRedirects(response, reverse("session", args=[session.id]))
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(Lap.objects.count(), session.laps_count)
+        self.assertEqual(TrackAggregate.objects.get().session_count, 1)
+
+    def test_session_id_stored_concurrently_is_a_duplicate(self):
+        # Another upload of the SessionID commits while this one is summarizing
+        path = EXAMPLES_DIR / "PLA-2025-09-05-S02.csv"
+        summarize = storage.LapSpool.summarize
+        uploads = [path.read_bytes()]
+
+        def concurrent_upload(spool):
+            if uploads:
+                ingest.ingest_csv(io.BytesIO(uploads.pop()), self.user)
+            return summarize(spool)
+
+        with mock.patch.object(storage.LapSpool, "summarize", concurrent_upload):
+            with self.assertRaises(ingest.DuplicateUpload) as raised:
+                ingest.ingest_csv(io.BytesIO(path.read_bytes().replace(b"\n", b"\r\n")), self.user)
+        self.assertEqual(raised.exception.session, Session.objects.get())
+
+    def test_retry_of_queued_upload_reuses_job(self):
+        content = HEADER + "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,\n"
+        with self.settings(RACE50_UPLOAD_ASYNC=True), self.captureOnCommitCallbacks():
+            self.post_csv(content)
+            self.post_csv(content)
+        self.assertEqual(UploadJob.objects.count(), 1)
+        self.assertEqual(len(list(Path(STAGING_DIR).glob("*.csv"))), 1)
+
+        # A job whose worker died is not handed back to the retry
+        stale = UploadJob.objects.get()
+        UploadJob.objects.update(status=UploadJob.RUNNING, started_at=timezone.now() - datetime.timedelta(hours=2))
+        with self.settings(RACE50_UPLOAD_ASYNC=True), self.captureOnCommitCallbacks():
+            self.post_csv(content)
+        self.assertEqual(UploadJob.objects.count(), 2)
+        self.assertNotEqual(UploadJob.objects.latest("id"), stale)
+        UploadJob.objects.all().delete()
+        for path in Path(STAGING_DIR).glob("*.csv"):
+            path.unlink()
+
+    def test_polls_keep_at_most_one_drain_waiting(self):
+        executor = mock.Mock()
+        with self.settings(RACE50_UPLOAD_ASYNC=True), mock.patch.object(jobs, "_get_executor", return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(5):
+                    jobs.enqueue()
+            self.assertEqual(executor.submit.call_count, 1)
+
+            # Once the drain starts, the next wake-up submits another one
+            with mock.patch.object(jobs, "process_pending"):
+                executor.submit.call_args.args[0]()
+            with self.captureOnCommitCallbacks(execute=True):
+                jobs.enqueue()
+                jobs.enqueue()
+            self.assertEqual(executor.submit.call_count, 2)
+        jobs._drain_pending = False
+
+    def test_late_worker_does_not_finish_a_reclaimed_job(self):
+        content = HEADER + "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,\n"
+        with self.settings(RACE50_UPLOAD_ASYNC=True), self.captureOnCommitCallbacks():
+            self.post_csv(content)
+        job = jobs.claim_next_job()
+
+        def reclaimed(*args, **kwargs):
+            UploadJob.objects.filter(pk=job.pk).update(status=UploadJob.QUEUED, started_at=None)
+            raise ingest.IngestError("Stale outcome.")
+
+        with mock.patch.object(jobs, "ingest_csv", side_effect=reclaimed), self.assertLogs("race50.jobs", "WARNING"):
+            jobs.process_job(job)
+        self.assertEqual((job.status, job.message), (UploadJob.QUEUED, ""))
+        self.assertTrue(Path(job.staged_path).exists())
+
+        self.assertEqual(jobs.process_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertEqual(job.session.laps_count, 1)
+
+    def test_orphaned_jobs_are_recovered(self):
+        content = HEADER + "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,\n"
+        with self.settings(RACE50_UPLOAD_ASYNC=True), self.captureOnCommitCallbacks():
+            self.post_csv(content)
+        job = UploadJob.objects.get()
+        self.assertEqual(job.status, UploadJob.QUEUED)
+
+        # A worker died mid-job: the stale job is requeued and retried
+        started = timezone.now() - datetime.timedelta(hours=2)
+        UploadJob.objects.filter(pk=job.pk).update(status=UploadJob.RUNNING, started_at=started, attempts=1)
+        orphan = UploadJob.objects.create(user=self.user, original_name="gone.csv", size=1,
+                                          staged_path=str(Path(STAGING_DIR) / "gone.csv"),
+                                          status=UploadJob.RUNNING, started_at=started, attempts=1)
+        self.assertEqual(jobs.process_pending(), 1)
+        job.refresh_from_db()
+        orphan.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (UploadJob.DONE, 2))
+        self.assertEqual(orphan.status, UploadJob.FAILED)
+
+        # A job queued when the web process stopped is drained by its poll
+        with self.settings(RACE50_UPLOAD_ASYNC=True), self.captureOnCommitCallbacks():
+            self.post_csv(content.replace("S1,", "S2,"))
+        job = UploadJob.objects.latest("id")
+        response = self.client.get(reverse("upload_job", args=[job.id]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertRedirects(response, reverse("session", args=[job.session_id]))
+
+    def test_job_status_endpoint(self):
+        response = self.post_csv(HEADER + "S1,Test Track,2025-09-01,1,30000,10000,10000,10000,\n")
+        job = UploadJob.objects.get()
+        self.assertEqual([url for (url, status) in response.redirect_chain],
+                         [reverse("upload_job", args=[job.id]), reverse("session", args=[job.session_id])])
+        self.assertFalse(Path(job.staged_path).exists())
+
+        data = self.client.get(reverse("upload_job", args=[job.id]), {"format": "json"}).json()
+        self.assertEqual(data["status"], UploadJob.DONE)
+        self.assertEqual(data["laps_processed"], 1)
+        self.assertEqual(data["session_url"], reverse("session", args=[job.session_id]))
+
+        other = User.objects.create_user("other", "other@example.com", "secret")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse("upload_job", args=[job.id])).status_code, 404)
+
+
+class BulkUploadTests(Race50TestCase):
+    def post_files(self, *files):
+        return self.client.post(reverse("upload_bulk"), {"files": list(files)}, follow=True)
+
+    def test_zip_of_sample_files(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for path in EXAMPLES_DIR.glob("*.csv"):
+                archive.write(path, path.name)
+        response = self.post_files(SimpleUploadedFile("weekend.zip", buffer.getvalue()))
+
+        job = UploadJob.objects.get()
+        self.assertEqual(response.redirect_chain, [(reverse("upload_job", args=[job.id]), 302)])
+        self.assertEqual((job.kind, job.status), (UploadJob.BULK, UploadJob.DONE))
+        self.assertFalse(Path(job.staged_path).exists())
+        self.assertEqual(len(response.context["results"]), 4)
+        for path in EXAMPLES_DIR.glob("*.csv"):
+            session = Session.objects.get(external_id=path.stem)
+            expected = reference_summary(path)
+            self.assertEqual(session.best_lap_ms, expected["best_lap_ms"])
+            self.assertEqual(session.tbl_ms, expected["tbl_ms"])
+            self.assertEqual(session.laps.count(), expected["laps_count"])
+
+    def test_multi_session_csv_in_process_pool(self):
+        rows = "".join(
+            f"S{i % 3},Test Track,2025-09-01,{i // 3 + 1},30000,10000,10000,10000,\n" for i in range(30)
+        ) + "S0,Test Track,2025-09-01,1,30000,10000,10000,10000,\n"
+        threshold = bulk.MIN_PARALLEL_LAPS
+        bulk.MIN_PARALLEL_LAPS = 0
+        try:
+            response = self.post_files(SimpleUploadedFile("many.csv", (HEADER + rows).encode()))
+        finally:
+            bulk.MIN_PARALLEL_LAPS = threshold
+
+        self.assertEqual(sorted(Session.objects.values_list("external_id", "laps_count")),
+                         [("S0", 10), ("S1", 10), ("S2", 10)])
+        self.assertEqual(response.context["file_errors"], {"many.csv": ["S0: duplicate Lap 1"]})
+
+    def test_chunked_ingest_matches_whole_session(self):
+        # Interleaved sessions, spooled in chunks much smaller than either
+        data = b"".join(benchmark.synthetic_csv(300, session_id=f"S{i}", seed=i).split(b"\n", 1)[1] for i in (1, 2))
+        lines = data.decode().splitlines()
+        interleaved = [line for pair in zip(lines[:300], lines[300:]) for line in pair]
+        with mock.patch.object(storage, "LAP_CHUNK_SIZE", 16), mock.patch.object(bulk, "LAP_CHUNK_SIZE", 16):
+            self.post_files(SimpleUploadedFile("two.csv", (HEADER + "\n".join(interleaved) + "\n").encode()))
+            with override_settings(RACE50_LAP_STORAGE=storage.PACKED):
+                ingest.ingest_csv(io.BytesIO(benchmark.synthetic_csv(300, session_id="S3", seed=1)), self.user)
+
+        for session in Session.objects.all():
+            columns = storage.load_columns(session)
+            stored = columns.metrics
+            columns.metrics = None
+            expected = columns.compute_metrics()
+            for name in storage.METRICS:
+                np.testing.assert_array_equal(stored[name], expected[name])
+            summary = ingest.summary_fields(analytics.summarize(*storage.column_arrays(columns),
+                                                                outliers=expected["outlier"]))
+            self.assertEqual({k: getattr(session, k) for k in summary}, summary)
+        self.assertEqual(Session.objects.get(external_id="S1").laps_count, 300)
+        self.assertEqual(PackedLaps.objects.get(session__external_id="S3").count, 300)
+
+    def test_seen_laps(self):
+        seen = bulk.SeenLaps()
+        self.assertEqual([seen.add(lap) for lap in (1, 9, 1, 5000, 1 << 30, 1 << 30, 9)],
+                         [True, True, False, True, True, False, False])
+
+    def test_existing_session_ids_are_skipped(self):
+        path = EXAMPLES_DIR / "PLA-2025-09-05-S02.csv"
+        self.post_files(SimpleUploadedFile(path.name, path.read_bytes()))
+        response = self.post_files(SimpleUploadedFile(path.name, path.read_bytes()))
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertTrue(response.context["results"][0]["duplicate"])
+        self.assertEqual(response.context["results"][0]["session"], Session.objects.get())
+
+    def test_single_session_files_keep_their_content_hash(self):
+        path = EXAMPLES_DIR / "PLA-2025-09-05-S02.csv"
+        rows = "".join(f"S{i % 2},Test Track,2025-09-01,{i // 2 + 1},30000,10000,10000,10000,\n" for i in range(4))
+        self.post_files(SimpleUploadedFile(path.name, path.read_bytes()),
+                        SimpleUploadedFile("two.csv", (HEADER + rows).encode()))
+
+        session = Session.objects.get(external_id=path.stem)
+        self.assertEqual(session.content_hash, hashlib.sha256(path.read_bytes()).hexdigest())
+        self.assertEqual(set(Session.objects.filter(external_id__in=["S0", "S1"]).values_list("content_hash", flat=True)),
+                         {""})
+
+        self.upload(path)
+        self.assertEqual(UploadJob.objects.filter(kind=UploadJob.CSV).get().session, session)
+        self.assertEqual(Session.objects.count(), 3)
+
+    def test_sessions_stored_concurrently_are_skipped(self):
+        # The upload is checked for existing sessions before the other one commits
+        path = EXAMPLES_DIR / "PLA-2025-09-05-S02.csv"
+        session = ingest.ingest_csv(io.BytesIO(path.read_bytes()), self.user,
+                                    content_hash=hashlib.sha256(path.read_bytes()).hexdigest())[0]
+        skip_existing = bulk._skip_existing
+        checks = iter([lambda groups, user: [], skip_existing])
+        with mock.patch.object(bulk, "_skip_existing", side_effect=lambda *args: next(checks)(*args)):
+            results, file_errors = bulk.ingest_bulk([SimpleUploadedFile(path.name, path.read_bytes())], self.user)
+
+        self.assertEqual(Session.objects.get(), session)
+        self.assertEqual([(result["session"], result["duplicate"]) for result in results], [(session, True)])
+
+    def test_rejects_other_extensions(self):
+        response = self.post_files(SimpleUploadedFile("notes.txt", b"hello"))
+        self.assertEqual(response.context["message"], "notes.txt: file must be '.csv' or '.zip'.")
+        self.assertFalse(Session.objects.exists())
+
+
+class LapStorageTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = EXAMPLES_DIR / "KJZ-2025-09-09-S04.csv"
+
+    def test_pack_roundtrip(self):
+        columns = storage.LapColumns()
+        columns.append(1, 10000, 9000, 11000, 30000, "clean air")
+        columns.append(2, 10001, 9001, 11001, 30003)
+        unpacked = storage.LapColumns.unpack(columns.pack(), 2, {"0": "clean air"})
+        self.assertEqual(list(unpacked.rows()), list(columns.rows()))
+
+    def test_metric_rows_converted_in_slices(self):
+        columns = storage.LapColumns()
+        for lap in range(1, 12):
+            columns.append(lap, 10000 + lap, 9000, 11000, 30000 + lap)
+        rows = list(columns.metric_rows())
+        self.assertEqual(list(columns.metric_rows(size=4)), rows)
+        self.assertEqual(rows[0][storage.METRICS.index("rolling_std")], None)
+        self.assertEqual(len(rows), 11)
+
+    def test_write_laps_reports_the_last_chunk(self):
+        columns = storage.LapColumns()
+        for lap in range(1, 11):
+            columns.append(lap, 10000, 9000, 11000, 30000)
+        for backend in (storage.ROWS, storage.PACKED):
+            session = Session.objects.create(
+                user=self.user, external_id=backend, track="Test Track", date=datetime.date(2025, 9, 1),
+                notes="", **ingest.summary_fields(analytics.summarize(*storage.column_arrays(columns))),
+            )
+            progress = []
+            with mock.patch.object(storage, "LAP_CHUNK_SIZE", 4):
+                storage.write_laps([(session, columns)], backend=backend, progress=progress.append)
+            self.assertEqual(progress[-1], 10, backend)
+
+    @override_settings(RACE50_LAP_STORAGE="packed")
+    def test_packed_upload_renders_session(self):
+        session = self.upload(self.path)
+        self.assertFalse(Lap.objects.exists())
+        self.assertEqual(PackedLaps.objects.get(session=session).count, session.laps_count)
+
+        response = self.client.get(reverse("session", args=[session.id]))
+        self.assertEqual(len(response.context["laps"]), session.laps_count)
+        self.assertEqual(response.context["laps"][2]["total"], "0:30.688")
+        self.assertEqual(storage.load_columns(session).notes[2], "traffic/mistake")
+
+    def test_pack_laps_command(self):
+        session = self.upload(self.path)
+        before = list(storage.load_columns(session).rows())
+
+        call_command("pack_laps", stdout=io.StringIO())
+        self.assertFalse(Lap.objects.exists())
+        self.assertEqual(list(storage.load_columns(session).rows()), before)
+
+        call_command("pack_laps", "--unpack", stdout=io.StringIO())
+        self.assertFalse(PackedLaps.objects.exists())
+        self.assertEqual(list(storage.load_columns(session).rows()), before)
+
+
+    def test_metrics_stored_with_laps_in_both_backends(self):
+        session = self.upload(self.path)
+        columns = storage.LapColumns()
+        for row in storage.load_columns(session).rows():
+            columns.append(*row)
+        expected = list(columns.metric_rows())
+
+        first = Lap.objects.order_by("id").first()
+        self.assertEqual(first.delta_best_ms, expected[0][0])
+        self.assertIsNone(first.rolling_std_ms)
+        self.assertEqual(list(storage.load_columns(session).metric_rows()), expected)
+
+        call_command("pack_laps", stdout=io.StringIO())
+        self.assertIsNotNone(PackedLaps.objects.get().metrics)
+        self.assertEqual(list(storage.load_columns(session).metric_rows()), expected)
+
+        response = self.client.get(reverse("session", args=[session.id]))
+        best = next(row for row in response.context["laps"] if row["is_best"])
+        self.assertEqual(best["delta_best"], "+0.000")
+        self.assertEqual(best["s1_rank"], expected[session.best_lap_number - 1][2])
+
+    def test_compute_lap_metrics_backfills_old_sessions(self):
+        session = self.upload(self.path)
+        expected = list(storage.load_columns(session).metric_rows())
+        Lap.objects.update(delta_best_ms=None, delta_tbl_ms=None, s1_rank=None, s2_rank=None, s3_rank=None,
+                           rolling_std_ms=None)
+        self.assertIsNone(storage.load_columns(session).metrics)
+
+        out = io.StringIO()
+        call_command("compute_lap_metrics", stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0], "Stored metrics of 1 session(s).")
+        self.assertEqual(list(storage.load_columns(session).metric_rows()), expected)
+
+
+class AnalyticsTests(Race50TestCase):
+    def test_summary_matches_reference_on_samples(self):
+        for path in sorted(EXAMPLES_DIR.glob("*.csv")):
+            with open(path, "rb") as f:
+                rows = list(ingest.validate_rows(ingest.open_csv(f), ingest.ErrorLog()))
+            columns = storage.LapColumns()
+            for (sid, track, date, lap, s1, s2, s3, total, notes) in rows:
+                columns.append(lap, s1, s2, s3, total, notes)
+            summary = ingest.summary_fields(analytics.summarize(*storage.column_arrays(columns)))
+            expected = reference_summary(path)
+            self.assertAlmostEqual(summary.pop("consistency_percent"), expected.pop("consistency_percent"), places=9)
+            self.assertEqual({k: summary[k] for k in expected}, expected)
+
+    def test_extra_metrics(self):
+        total = analytics.as_array([30000, 29000, 29500, 28000, 60000])
+        self.assertEqual(list(analytics.rolling_best(total)), [30000, 29000, 29000, 28000, 28000])
+        self.assertEqual(analytics.percentiles(total, (50,)), {50: 29500.0})
+        self.assertGreater(analytics.filtered_consistency_percent(total), analytics.consistency_percent(total))
+        d1, d2, d3 = analytics.sector_deltas(*(analytics.as_array(c) for c in ([3, 1], [5, 7], [2, 2])))
+        self.assertEqual((list(d1), list(d2), list(d3)), ([2, 0], [0, 2], [0, 0]))
+
+
+    def test_lap_metrics_match_direct_computation(self):
+        lap, s1, s2, s3 = [1, 2, 3, 4, 5, 6], [100, 90, 95, 90, 110, 92], [50, 55, 49, 60, 52, 49], [70, 71, 72, 69, 75, 70]
+        total = [a + b + c for (a, b, c) in zip(s1, s2, s3)]
+        metrics = analytics.lap_metrics(lap, s1, s2, s3, total, window=3)
+
+        self.assertEqual(metrics["delta_best"].tolist(), [t - min(total) for t in total])
+        self.assertEqual(metrics["delta_tbl"].tolist(), [t - (min(s1) + min(s2) + min(s3)) for t in total])
+        self.assertEqual(metrics["s1_rank"].tolist(), [5, 1, 4, 1, 6, 3])
+        self.assertEqual(metrics["s3_rank"].tolist(), [2, 4, 5, 1, 6, 2])
+        self.assertTrue(all(math.isnan(v) for v in metrics["rolling_std"][:2]))
+        for i in range(2, 6):
+            window = total[i - 2:i + 1]
+            mean = sum(window) / 3
+            expected = (sum((t - mean) ** 2 for t in window) / 3) ** 0.5
+            self.assertAlmostEqual(metrics["rolling_std"][i], expected, places=9)
+
+    def test_session_fold_matches_whole_session(self):
+        data = benchmark.synthetic_csv(700, seed=3)
+        columns = storage.LapColumns()
+        for (sid, track, date, lap, s1, s2, s3, total, notes) in ingest.validate_rows(
+                ingest.open_csv(io.BytesIO(data)), ingest.ErrorLog()):
+            columns.append(lap, s1, s2, s3, total, notes)
+        arrays = [analytics.as_array(c) for c in storage.column_arrays(columns)]
+        incidents = analytics.incident_mask(columns.notes, len(columns))
+        expected = analytics.lap_metrics(*arrays, incidents=incidents)
+
+        fold = analytics.SessionFold()
+        for start in range(0, 700, 64):
+            fold.add(*(a[start:start + 64] for a in arrays))
+        chunks = [fold.metrics(*(a[start:start + 64] for a in arrays[1:]), incidents=incidents[start:start + 64])
+                  for start in range(0, 700, 64)]
+        for name in expected:
+            np.testing.assert_array_equal(np.concatenate([c[name] for c in chunks]), expected[name])
+        self.assertEqual(fold.summary(), analytics.summarize(*arrays, outliers=expected["outlier"]))
+
+
+class OutlierTests(Race50TestCase):
+    def test_flags_combine_robust_fences_and_notes(self):
+        s1 = [10000, 10050, 9980, 10020, 10010, 9990, 10030, 10000, 10040, 10010]
+        s2 = [9000, 9020, 8990, 9010, 9000, 14000, 9030, 9010, 9000, 9020]
+        s3 = [11000, 11010, 10990, 11020, 11000, 11010, 10980, 11000, 11010, 11000]
+        total = [a + b + c for (a, b, c) in zip(s1, s2, s3)]
+        s1[2], total[2] = 7000, total[2] - 2980  # fast laps are never outliers
+        s3[8], total[8] = 30000, total[8] + 18990  # a spin
+        incidents = analytics.incident_mask({0: "Minor ERROR", 3: "clean air", 4: "push lap"}, len(total))
+
+        flags = analytics.outlier_flags(*(analytics.as_array(c) for c in (s1, s2, s3, total)), incidents)
+        lap, sector, note = analytics.OUTLIER_LAP, analytics.OUTLIER_SECTOR, analytics.OUTLIER_NOTE
+        self.assertEqual(flags.tolist(), [note, 0, 0, 0, 0, lap | sector, 0, 0, lap | sector, 0])
+
+        # Only notes count on short sessions; identical laps (MAD 0) still flag the odd one out
+        short = analytics.as_array([30000, 90000, 30000])
+        self.assertEqual(analytics.slow_outliers(short).tolist(), [False] * 3)
+        flat = analytics.as_array([30000] * 8 + [31000])
+        self.assertEqual(analytics.slow_outliers(flat).tolist(), [False] * 8 + [True])
+
+        summary = analytics.summarize(list(range(1, 11)), s1, s2, s3, total, outliers=flags)
+        clean = [t for (t, f) in zip(total, flags) if not f]
+        self.assertEqual(summary["clean_laps_count"], 7)
+        self.assertEqual(summary["clean_avg_lap_ms"], sum(clean) / 7)
+        self.assertEqual(summary["clean_consistency_percent"], analytics.consistency_percent(analytics.as_array(clean)))
+        self.assertGreater(summary["clean_consistency_percent"], summary["consistency_percent"])
+
+    def test_ingest_stores_flags_and_clean_summary(self):
+        session = self.upload("KJZ-2025-09-09-S04.csv")
+        laps = list(Lap.objects.filter(session=session).order_by("id").values_list("total_ms", "notes", "outlier_flags"))
+        for (total, notes, flags) in laps:
+            noted = "traffic" in notes or "error" in notes
+            self.assertEqual(bool(flags & analytics.OUTLIER_NOTE), noted)
+        clean = [total for (total, _, flags) in laps if not flags]
+        self.assertEqual(session.clean_laps_count, len(clean))
+        self.assertEqual(session.clean_avg_lap_ms, round(sum(clean) / len(clean)))
+        self.assertLess(session.clean_laps_count, session.laps_count)
+
+        aggregate = TrackAggregate.objects.get(user=self.user, track=session.track)
+        self.assertEqual((aggregate.clean_laps_count, aggregate.clean_avg_lap_ms),
+                         (session.clean_laps_count, session.clean_avg_lap_ms))
+
+        # Packed storage keeps the flags; blobs from before them are recomputed
+        columns = storage.load_columns(session)
+        call_command("pack_laps", stdout=io.StringIO())
+        packed = storage.load_columns(session)
+        self.assertEqual(packed.metrics["outlier"].tolist(), [flags for (_, _, flags) in laps])
+        old_blob = PackedLaps.objects.get(session=session).metrics[:-session.laps_count]
+        self.assertIsNone(storage.LapColumns.unpack_metrics(old_blob, session.laps_count))
+        self.assertEqual(columns.compute_metrics()["outlier"].tolist(), packed.metrics["outlier"].tolist())
+
+    def test_clean_compare_and_backfill(self):
+        first = self.upload("KJZ-2025-09-09-S04.csv")
+        second = self.upload("KJZ-2025-09-15-S07.csv")
+        ids = f"{first.id},{second.id}"
+        raw = self.client.get(reverse("compare_json"), {"sessions": ids, "align": "rank"}).json()
+        clean = self.client.get(reverse("compare_json"), {"sessions": ids, "align": "rank", "clean": "1"}).json()
+        self.assertTrue(clean["clean"])
+        self.assertEqual(clean["comparisons"][0]["aligned_laps"], min(first.clean_laps_count, second.clean_laps_count))
+        self.assertGreater(raw["comparisons"][0]["aligned_laps"], clean["comparisons"][0]["aligned_laps"])
+
+        Session.objects.filter(id=first.id).update(clean_laps_count=None, clean_avg_lap_ms=None)
+        Lap.objects.filter(session=first).update(outlier_flags=None)
+        TrackAggregate.objects.all().delete()
+        TrendBucket.objects.all().delete()
+        self.assertIsNone(storage.load_columns(first).metrics)
+        call_command("compute_lap_metrics", stdout=io.StringIO())
+        first.refresh_from_db()
+        self.assertEqual(storage.load_columns(first).metrics["outlier"].tolist(),
+                         list(Lap.objects.filter(session=first).order_by("id").values_list("outlier_flags", flat=True)))
+        self.assertEqual(first.clean_laps_count, clean["reference"]["clean_laps_count"])
+
+        # The track aggregates and trend buckets are rebuilt with the clean totals
+        clean_laps = first.clean_laps_count + second.clean_laps_count
+        self.assertEqual(TrackAggregate.objects.get().clean_laps_count, clean_laps)
+        self.assertEqual(TrendBucket.objects.get(period=TrendBucket.MONTH).clean_laps_count, clean_laps)
+
+
+class CacheTests(Race50TestCase):
+    def test_sidebar_invalidated_by_upload(self):
+        paths = sorted(EXAMPLES_DIR.glob("KJZ-*.csv"))
+        first = self.upload(paths[0])
+        self.assertEqual([s.id for s in self.client.get(reverse("guide")).context["last_five"]], [first.id])
+
+        second = self.upload(paths[1])
+        response = self.client.get(reverse("index"))
+        self.assertEqual([s.id for s in response.context["last_five"]], [second.id, first.id])
+        self.assertEqual(response.context["session"].id, second.id)
+
+    def test_session_page_cached_per_user(self):
+        paths = sorted(EXAMPLES_DIR.glob("KJZ-*.csv"))
+        session = self.upload(paths[0])
+        url = reverse("session", args=[session.id])
+        rendered = self.client.get(url).content
+
+        # Only the auth session and user lookups remain on a cache hit
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).content, rendered)
+
+        # Junk compare values share the page cached without a comparison
+        for junk in ("abc", "", "-1", "x" * 500):
+            with self.assertNumQueries(2):
+                self.client.get(url, {"compare": junk})
+
+        other = self.upload(paths[1])
+        response = self.client.get(url)
+        self.assertContains(response, f'<option value="{other.id}">')
+
+
+class SessionViewTests(Race50TestCase):
+    LAPS = 2000
+
+    def setUp(self):
+        super().setUp()
+        self.session = self.make_session(best_lap=7)
+        self.compare = self.make_session(best_lap=11, backend=storage.PACKED)
+
+    def make_session(self, best_lap, backend=storage.ROWS):
+        columns = storage.LapColumns()
+        for lap in range(1, self.LAPS + 1):
+            total = 29000 if lap == best_lap else 30000 + lap % 50
+            columns.append(lap, 10000, 10000, total - 20000, total, "clean air" if lap % 10 == 0 else "")
+        session = Session.objects.create(
+            user=self.user, external_id=f"S{best_lap}", track="Test Track", date=datetime.date(2025, 9, 1),
+            notes="", **ingest.summary_fields(analytics.summarize(*storage.column_arrays(columns))),
+        )
+        storage.write_laps([(session, columns)], backend=backend)
+        return session
+
+    def test_session_with_compare_query_count(self):
+        url = reverse("session", args=[self.session.id]) + f"?compare={self.compare.id}"
+        # auth session, user, sidebar, both sessions, laps, comparison choices, track aggregate
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+
+        laps, compare_laps = response.context["laps"], response.context["compare_laps"]
+        self.assertEqual((len(laps), len(compare_laps)), (self.LAPS, self.LAPS))
+        self.assertEqual([row["lap"] for row in laps if row["is_best"]], [7])
+        self.assertEqual([row["lap"] for row in compare_laps if row["is_best"]], [11])
+        self.assertEqual(laps[6]["total"], "0:29.000")
+        self.assertContains(response, f'<option value="{self.compare.id}" selected>')
+
+    @unittest.skipUnless(TIMING_TESTS, "set RACE50_TIMING_TESTS=1 to run timing assertions")
+    def test_session_with_compare_render_time(self):
+        url = reverse("session", args=[self.session.id]) + f"?compare={self.compare.id}"
+        start = time.perf_counter()
+        self.client.get(url)
+        self.assertLess(time.perf_counter() - start, 2.0)
+
+    def test_out_of_range_ids_are_ignored(self):
+        huge = "9" * 23
+        response = self.client.get(reverse("session", args=[self.session.id]), {"compare": huge})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["compare"])
+
+        response = self.client.get(reverse("compare_json"), {"sessions": f"{self.session.id},{huge},{self.compare.id}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["comparisons"][0]["session"]["id"], self.compare.id)
+
+        response = self.client.get(reverse("export_sessions"), {"sessions": f"{huge},{self.session.id},²"})
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), self.LAPS + 1)
+
+    def test_other_users_session_is_404(self):
+        other = User.objects.create_user("other", "other@example.com", "secret")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse("session", args=[self.session.id])).status_code, 404)
+
+    def test_client_render_mode_serves_shell_and_payload(self):
+        url = reverse("session", args=[self.session.id])
+        response = self.client.get(url, {"compare": self.compare.id, "render": "client"})
+        self.assertIsNone(response.context["laps"])
+        self.assertNotContains(response, "<td>0:29.000</td>")
+        self.assertContains(response, reverse("api_session_columns", args=[self.compare.id]))
+        self.assertContains(response, "race50/js/session.js")
+
+        # "auto" switches to client rendering for long sessions
+        with mock.patch.object(views, "CLIENT_RENDER_MIN_LAPS", self.LAPS):
+            self.assertTrue(self.client.get(url).context["client_render"])
+
+        payload_url = reverse("api_session_columns", args=[self.compare.id])
+        response = self.client.get(payload_url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("max-age=3600", response["Cache-Control"])
+        data = json.loads(gzip.decompress(response.content))
+        columns = storage.load_columns(self.compare)
+        self.assertEqual(data["total"], list(columns.total))
+        self.assertEqual(data["delta_best"][10], 0)
+        self.assertEqual(data["notes"]["9"], "clean air")
+        self.assertIsNone(data["rolling_std"][0])
+
+        response = self.client.get(payload_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+class SessionsListTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        sessions = Session.objects.bulk_create([
+            Session(user=self.user, external_id=f"S{i}", track="Karting Jerez" if i % 2 else "Lucas Guerrero",
+                    date=datetime.date(2025, 1, 1) + datetime.timedelta(days=i), laps_count=10,
+                    best_lap_ms=30000, best_lap_number=1, worst_lap_ms=31000, avg_lap_ms=30500,
+                    tbl_ms=29900, consistency_percent=98.0, notes="")
+            for i in range(120)
+        ])
+        # Ties on created_at must still page deterministically by id
+        Session.objects.filter(id__in=[s.id for s in sessions[40:80]]).update(created_at=sessions[40].created_at)
+
+    def walk(self, **params):
+        seen = []
+        response = self.client.get(reverse("sessions"), params)
+        while True:
+            seen += [row["id"] for row in response.context["sessions"]]
+            if not response.context["next_query"]:
+                return seen
+            response = self.client.get(reverse("sessions") + "?" + response.context["next_query"])
+
+    def test_keyset_pages_cover_every_session_once(self):
+        seen = self.walk()
+        expected = list(Session.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_filters(self):
+        seen = self.walk(track="Karting Jerez", date_from="2025-02-01", date_to="2025-02-28")
+        expected = Session.objects.filter(track="Karting Jerez", date__range=("2025-02-01", "2025-02-28"))
+        self.assertEqual(sorted(seen), sorted(expected.values_list("id", flat=True)))
+
+    def test_page_query_count_is_constant(self):
+        # auth session, user, sidebar, page, track list
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("sessions"), {"date_from": "2025-13-40"})
+        self.assertEqual(len(response.context["sessions"]), 50)
+
+
+class TrackAggregateTests(Race50TestCase):
+    def test_incremental_matches_rebuild(self):
+        for path in sorted(EXAMPLES_DIR.glob("*.csv")):
+            self.upload(path)
+
+        jerez = Session.objects.filter(track="Karting Jerez (Indoor)")
+        aggregate = TrackAggregate.objects.get(user=self.user, track="Karting Jerez (Indoor)")
+        self.assertEqual(aggregate.session_count, jerez.count())
+        self.assertEqual(aggregate.best_lap_ms, min(s.best_lap_ms for s in jerez))
+        self.assertEqual(aggregate.best_lap_session.best_lap_ms, aggregate.best_lap_ms)
+        self.assertEqual(aggregate.tbl_ms, min(s.best_s1_ms for s in jerez)
+                         + min(s.best_s2_ms for s in jerez) + min(s.best_s3_ms for s in jerez))
+        self.assertLessEqual(aggregate.tbl_ms, min(s.tbl_ms for s in jerez))
+
+        fields = ["track", "session_count", "laps_count", "total_lap_ms", "best_lap_ms", "best_lap_session_id",
+                  "tbl_ms", "recent_best_laps", "recent_avg_laps"]
+        incremental = list(TrackAggregate.objects.order_by("track").values(*fields))
+        Session.objects.update(best_s1_ms=None, best_s2_ms=None, best_s3_ms=None)
+        call_command("rebuild_track_aggregates", stdout=io.StringIO())
+        self.assertEqual(list(TrackAggregate.objects.order_by("track").values(*fields)), incremental)
+
+        response = self.client.get(reverse("session", args=[jerez.first().id]))
+        self.assertEqual(response.context["track_stats"].best_lap_ms, aggregate.best_lap_ms)
+
+
+class TrendTests(Race50TestCase):
+    def buckets(self, period, track="Test Track"):
+        return [(b.start.isoformat(), b.session_count, b.best_lap_ms, b.avg_lap_ms)
+                for b in trends.series(self.user, track, period)]
+
+    def test_buckets_updated_on_upload_and_backfill(self):
+        self.assertEqual(trends.bucket_start(datetime.date(2025, 9, 14), TrendBucket.WEEK), datetime.date(2025, 9, 8))
+        self.assertEqual(trends.bucket_start(datetime.date(2025, 9, 14), TrendBucket.MONTH), datetime.date(2025, 9, 1))
+
+        first = self.ingest_laps("2025-09-08", 31000, 30500)
+        self.ingest_laps("2025-09-14", 30000, 30200)
+        self.ingest_laps("2025-09-14", 32000)
+        self.ingest_laps("2025-10-01", 29800)
+        self.ingest_laps("2025-10-01", 25000, track="Other Track")
+
+        self.assertEqual(self.buckets(TrendBucket.DAY), [
+            ("2025-09-08", 1, 30500, 30750), ("2025-09-14", 2, 30000, 30733), ("2025-10-01", 1, 29800, 29800)])
+        self.assertEqual(self.buckets(TrendBucket.WEEK), [
+            ("2025-09-08", 3, 30000, 30740), ("2025-09-29", 1, 29800, 29800)])
+        self.assertEqual(self.buckets(TrendBucket.MONTH), [
+            ("2025-09-01", 3, 30000, 30740), ("2025-10-01", 1, 29800, 29800)])
+        self.assertEqual(self.buckets(TrendBucket.MONTH, "Other Track"), [("2025-10-01", 1, 25000, 25000)])
+        september = trends.series(self.user, "Test Track", TrendBucket.MONTH)[0]
+        self.assertEqual(september.tbl_ms, 30000)
+        self.assertAlmostEqual(september.consistency_percent, sum(
+            s.consistency_percent for s in Session.objects.filter(track="Test Track", date__month=9)) / 3)
+        self.assertEqual(trends.series(self.user, "Test Track", TrendBucket.DAY)[0].best_lap_session, first)
+
+        fields = [f.name for f in TrendBucket._meta.fields if f.name != "id"]
+        incremental = list(TrendBucket.objects.order_by("track", "period", "start").values(*fields))
+        call_command("backfill_trends", "--chunk-size", "2", stdout=io.StringIO())
+        self.assertEqual(list(TrendBucket.objects.order_by("track", "period", "start").values(*fields)), incremental)
+
+    def test_reads_do_not_depend_on_history(self):
+        for day in range(1, 29):
+            self.ingest_laps(f"2025-02-{day:02d}", 30000 + day)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(trends.series(self.user, "Test Track", TrendBucket.WEEK)), 5)
+        with mock.patch.dict(trends.MAX_BUCKETS, {TrendBucket.DAY: 7}):
+            days = self.buckets(TrendBucket.DAY)
+        self.assertEqual([d[0] for d in days], [f"2025-02-{day}" for day in range(22, 29)])
+
+    def test_page_and_json(self):
+        self.ingest_laps("2025-09-08", 31000, 30500)
+        self.ingest_laps("2025-09-20", 30000, track="Other Track")
+        response = self.client.get(reverse("trends"))
+        self.assertEqual(response.context["track"], "Other Track")
+        self.assertEqual(list(response.context["tracks"]), ["Other Track", "Test Track"])
+        self.assertContains(response, "trend-chart")
+
+        data = self.client.get(reverse("trends_json"), {"track": "Test Track", "period": "day"}).json()
+        self.assertEqual(data["period"], "day")
+        self.assertEqual([(b["start"], b["best_lap_ms"], b["avg_lap_ms"]) for b in data["buckets"]],
+                         [("2025-09-08", 30500, 30750)])
+        self.assertEqual(self.client.get(reverse("trends_json")).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("trends_json"), {"track": "Test Track"}).status_code, 302)
+
+
+class CompareTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        for path in sorted(EXAMPLES_DIR.glob("*.csv")):
+            self.upload(path)
+        self.a, self.b = Session.objects.filter(external_id__startswith="KJZ").order_by("external_id")
+
+    def get_json(self, **params):
+        return self.client.get(reverse("compare_json"), params)
+
+    def test_lap_alignment(self):
+        data = self.get_json(sessions=f"{self.a.id},{self.b.id}").json()
+        comparison = data["comparisons"][0]
+        laps_a = {row.lap: row for row in storage.load_columns(self.a).rows()}
+        laps_b = {row.lap: row for row in storage.load_columns(self.b).rows()}
+        common = sorted(set(laps_a) & set(laps_b))
+
+        self.assertEqual([row["lap"] for row in comparison["laps"]], common)
+        gap = 0
+        for row in comparison["laps"]:
+            delta = laps_b[row["lap"]].total_ms - laps_a[row["lap"]].total_ms
+            gap += delta
+            self.assertEqual(row["delta_ms"], delta)
+            self.assertEqual(row["delta_s2_ms"], laps_b[row["lap"]].s2_ms - laps_a[row["lap"]].s2_ms)
+            self.assertEqual(row["gap_ms"], gap)
+        self.assertEqual(comparison["best_vs_best_ms"], self.b.best_lap_ms - self.a.best_lap_ms)
+        self.assertEqual(comparison["tbl_vs_tbl_ms"], self.b.tbl_ms - self.a.tbl_ms)
+
+    def test_best_n_alignment_and_cache(self):
+        params = {"sessions": f"{self.a.id},{self.b.id}", "align": "best", "n": 3}
+        comparison = self.get_json(**params).json()["comparisons"][0]
+        self.assertEqual(len(comparison["laps"]), 3)
+        self.assertEqual(comparison["laps"][0]["delta_ms"], self.b.best_lap_ms - self.a.best_lap_ms)
+
+        # auth session and user only
+        with self.assertNumQueries(2):
+            self.get_json(**params)
+
+        response = self.client.get(reverse("compare"), params)
+        self.assertContains(response, "Δ S1")
+
+    def test_rejects_other_tracks(self):
+        other = Session.objects.exclude(track=self.a.track).first()
+        response = self.get_json(sessions=f"{self.a.id},{other.id}")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Sessions must be at the same track.")
+
+
+class ApiTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = EXAMPLES_DIR / "KJZ-2025-09-09-S04.csv"
+        self.session = self.upload(self.path)
+
+    def test_session_summary_and_conditional_get(self):
+        url = reverse("api_session", args=[self.session.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()["best_lap_ms"], self.session.best_lap_ms)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_rewritten_sessions_get_new_validators(self):
+        url = reverse("api_session", args=[self.session.id])
+        etag = self.client.get(url)["ETag"]
+        for command, options in (("pack_laps", {}), ("pack_laps", {"unpack": True}),
+                                 ("compute_lap_metrics", {"force": True})):
+            updated_at = Session.objects.get().updated_at
+            call_command(command, stdout=io.StringIO(), **options)
+            self.assertGreater(Session.objects.get().updated_at, updated_at, command)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, command)
+            etag = response["ETag"]
+
+    def test_column_urls_change_with_the_session(self):
+        page_url = reverse("session", args=[self.session.id])
+        url = reverse("api_session_columns", args=[self.session.id])
+        version = f"{url}?v={self.session.updated_at.timestamp():.6f}"
+        self.assertContains(self.client.get(page_url, {"render": "client"}), version)
+        payload = self.client.get(version).content
+
+        call_command("pack_laps", stdout=io.StringIO())
+        page = self.client.get(page_url, {"render": "client"})
+        self.assertNotContains(page, version)
+        self.assertContains(page, f"{url}?v={Session.objects.get().updated_at.timestamp():.6f}")
+        self.assertEqual(self.client.get(url).content, payload)
+
+    def test_laps_stream_as_ndjson(self):
+        for backend in (storage.ROWS, storage.PACKED):
+            if backend == storage.PACKED:
+                call_command("pack_laps", stdout=io.StringIO())
+            response = self.client.get(reverse("api_session_laps", args=[self.session.id]))
+            self.assertTrue(response.streaming)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            laps = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            self.assertEqual(len(laps), self.session.laps_count)
+            self.assertEqual(laps[2]["notes"], "traffic/mistake")
+
+    def test_session_list_and_auth(self):
+        response = self.client.get(reverse("api_sessions"))
+        self.assertEqual([row["id"] for row in response.json()["results"]], [self.session.id])
+        self.assertEqual(self.client.get(reverse("api_sessions"), HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("api_sessions")).status_code, 401)
+
+
+class AsyncViewTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = self.upload("KJZ-2025-09-09-S04.csv")
+        self.other = self.upload("KJZ-2025-09-15-S07.csv")
+
+    def test_read_views_are_async(self):
+        for view in (views.index, views.sessions, views.session, views.compare_json, views.leaderboard_json,
+                     api.sessions, api.session, api.session_columns):
+            self.assertTrue(asyncio.iscoroutinefunction(view), view.__name__)
+
+    async def test_read_paths_over_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("index"))
+        self.assertEqual(response.context["session"].id, self.other.id)
+        self.assertEqual(len(response.context["last_five"]), 2)
+
+        response = await self.async_client.get(reverse("session", args=[self.session.id]),
+                                                {"compare": self.other.id, "render": "server"})
+        self.assertEqual(len(response.context["compare_laps"]), self.other.laps_count)
+        self.assertEqual([s.id for s in response.context["posibilities"]], [self.other.id])
+        page_name = f"session:{self.session.id}:{self.other.id}:server"
+        self.assertEqual(await race50_cache.aget_page(self.user.id, page_name), response.content)
+
+        response = await self.async_client.get(reverse("sessions"))
+        self.assertEqual(len(response.context["sessions"]), 2)
+        self.assertEqual(response.context["tracks"], [self.session.track])
+
+        response = await self.async_client.get(reverse("compare_json"),
+                                                {"sessions": f"{self.session.id},{self.other.id}"})
+        self.assertEqual(response.json()["comparisons"][0]["session"]["id"], self.other.id)
+
+        url = reverse("api_session", args=[self.session.id])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()["id"], self.session.id)
+        self.assertEqual((await self.async_client.get(url, headers={"if-none-match": response["ETag"]})).status_code, 304)
+
+        response = await self.async_client.get(reverse("leaderboard_json"), {"track": self.session.track})
+        self.assertEqual(response.json()["results"][0]["username"], "driver")
+
+        await self.async_client.alogout()
+        self.assertEqual((await self.async_client.get(reverse("api_sessions"))).status_code, 401)
+        self.assertEqual((await self.async_client.get(reverse("sessions"))).status_code, 302)
+
+    async def test_session_page_formats_laps_off_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        lap_table = views.lap_table
+        loops = []
+
+        def record_loop(*args):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return lap_table(*args)
+
+        with mock.patch.object(views, "lap_table", record_loop):
+            await self.async_client.get(reverse("session", args=[self.session.id]), {"render": "server"})
+        self.assertEqual(loops, [None])
+
+    async def test_streams_chunk_by_chunk_over_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        for url in (reverse("export_sessions"), reverse("export_session", args=[self.session.id]),
+                    reverse("api_session_laps", args=[self.session.id])):
+            expected = await sync_to_async(lambda: b"".join(self.client.get(url).streaming_content))()
+            response = await self.async_client.get(url)
+            self.assertTrue(response.is_async, url)
+            self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), expected)
+
+    @override_settings(RACE50_INSTRUMENTATION_SAMPLE_RATE=1.0)
+    async def test_sampled_async_request_counts_queries(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs("race50.instrumentation", "INFO") as logs:
+            await self.async_client.get(reverse("sessions"))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["view"], "sessions")
+        self.assertGreater(record["queries"], 0)
+
+
+class LoadTestTests(Race50TestCase):
+    def test_summary_and_sustained_concurrency(self):
+        level = loadtest.summarize([(200, 0.1), (200, 0.3), (500, 0.2), (None, None)], elapsed=2.0, concurrency=4)
+        self.assertEqual((level["requests"], level["errors"], level["rps"]), (4, 2, 1.0))
+        self.assertEqual((level["p50_ms"], level["p95_ms"]), (100.0, 300.0))
+
+        levels = [
+            {"concurrency": 1, "errors": 0, "p95_ms": 50.0},
+            {"concurrency": 10, "errors": 0, "p95_ms": 800.0},
+            {"concurrency": 50, "errors": 0, "p95_ms": 4000.0},
+            {"concurrency": 100, "errors": 3, "p95_ms": 900.0},
+        ]
+        self.assertEqual(loadtest.sustained_concurrency(levels, slo_ms=1000), 10)
+        self.assertEqual(loadtest.sustained_concurrency(levels[2:], slo_ms=1000), 0)
+
+    def test_slow_clients_against_a_server(self):
+        body = b"x" * 20000
+        requests = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            requests.append(head)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+            await writer.drain()
+            writer.close()
+
+        async def scenario():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                status, size, _ = await loadtest.fetch(f"http://127.0.0.1:{port}/sessions?track=A",
+                                                       cookie="sessionid=abc", send_delay=0.01, read_rate=10 ** 6)
+                level = await loadtest.run_level([f"http://127.0.0.1:{port}/"], 3, 0.2)
+            return status, size, level
+
+        status, size, level = asyncio.run(scenario())
+        self.assertEqual(status, 200)
+        self.assertGreater(size, len(body))
+        self.assertTrue(requests[0].startswith(b"GET /sessions?track=A HTTP/1.1\r\n"))
+        self.assertIn(b"Cookie: sessionid=abc\r\n", requests[0])
+        self.assertEqual(level["concurrency"], 3)
+        self.assertGreater(level["requests"], 3)
+        self.assertEqual(level["errors"], 0)
+
+
+class TimeFormatTests(Race50TestCase):
+    def test_bulk_formatting_matches_the_filters(self):
+        rng = np.random.default_rng(50)
+        ints = np.concatenate([rng.integers(-200000, 4000000, 5000), [0, 999, 1000, 59999, 60000, -1, -60000]])
+        columns = [
+            ints, ints.astype(np.int32), np.abs(ints).astype(np.uint32), array("I", np.abs(ints).tolist()),
+            ints.tolist(), ints[:10], [None, "", "abc", "1500", 1500.7, -0.4, True],
+        ]
+        for column in columns:
+            self.assertEqual(timefmt.format_ms_many(column), [reference_format_ms(v) for v in column])
+            self.assertEqual(timefmt.format_delta_many(column), [reference_format_delta(v) for v in column])
+
+        floats = np.concatenate([rng.normal(0, 5000, 5000), np.arange(-10.5, 10.5, 0.5)])
+        self.assertEqual(timefmt.format_delta_many(floats), [reference_format_delta(v) for v in floats])
+        with_nan = np.append(floats, np.nan)
+        self.assertEqual(timefmt.format_delta_many(with_nan), [reference_format_delta(v) for v in with_nan])
+
+        template = Template("{% load race50_extras %}{{ v|format_ms }}|{{ v|format_delta }}")
+        for value in (61234, "61234", None, "x", -1, 59999.9):
+            self.assertEqual(template.render(Context({"v": value})),
+                             f"{reference_format_ms(value)}|{reference_format_delta(value)}")
+
+    def test_lap_table_tag_matches_per_cell_rendering(self):
+        columns = storage.LapColumns()
+        for lap in range(1, 401):
+            columns.append(lap, 10000 + lap % 7, 9000 + lap % 11, 11000 + lap % 5,
+                           30000 + lap % 7 + lap % 11 + lap % 5, "traffic" if lap % 50 == 0 else "clean air")
+        rows = []
+        for (row, metrics) in zip(columns.rows(), columns.metric_rows()):
+            (delta_best, delta_tbl, s1_rank, s2_rank, s3_rank, rolling_std, outlier) = metrics
+            rows.append({
+                "lap": row.lap, "total": reference_format_ms(row.total_ms), "s1": reference_format_ms(row.s1_ms),
+                "s2": reference_format_ms(row.s2_ms), "s3": reference_format_ms(row.s3_ms),
+                "s1_rank": s1_rank, "s2_rank": s2_rank, "s3_rank": s3_rank,
+                "delta_best": reference_format_delta(delta_best), "delta_tbl": reference_format_delta(delta_tbl),
+                "rolling_std": f"{rolling_std / 1000:.3f}" if rolling_std is not None else "",
+                "outlier": "incident" if outlier else "",
+                "is_best": row.lap == 7,
+            })
+
+        self.assertEqual(tables.lap_table(columns, 7), rows)
+        html = Template("{% load race50_extras %}{% lap_table columns 7 %}").render(Context({"columns": columns}))
+        self.assertEqual(html, render_to_string("race50/lap_table.html", {"rows": rows}))
+        self.assertEqual(html.count('class="outlier-lap" title="Not a clean lap: incident"'), 8)
+
+
+class ExportTests(Race50TestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for path in EXAMPLES_DIR.glob("*.csv"):
+                archive.write(path, path.name)
+        self.client.post(reverse("upload_bulk"), {"files": [SimpleUploadedFile("weekend.zip", buffer.getvalue())]})
+
+    def test_csv_export_round_trips_through_bulk_upload(self):
+        response = self.client.get(reverse("export_sessions"), {"format": "csv"})
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        self.assertEqual(content.splitlines()[0].decode(), HEADER.strip())
+
+        other = User.objects.create_user("other", "other@example.com", "secret")
+        self.client.force_login(other)
+        self.client.post(reverse("upload_bulk"), {"files": [SimpleUploadedFile("export.csv", content)]})
+        for session in Session.objects.filter(user=self.user):
+            copy = Session.objects.get(user=other, external_id=session.external_id)
+            self.assertEqual((copy.best_lap_ms, copy.tbl_ms, copy.laps_count),
+                             (session.best_lap_ms, session.tbl_ms, session.laps_count))
+            self.assertEqual(storage.load_columns(copy).notes, storage.load_columns(session).notes)
+
+    def test_zip_has_one_csv_per_session(self):
+        response = self.client.get(reverse("export_sessions"), {"format": "zip", "track": "Karting Jerez (Indoor)"})
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            names = archive.namelist()
+            sessions = Session.objects.filter(user=self.user, track="Karting Jerez (Indoor)")
+            self.assertEqual(len(names), 2)
+            self.assertEqual(len(names), sessions.count())
+            for session in sessions:
+                rows = archive.read(f"{session.id}-{session.external_id}.csv").decode().splitlines()
+                self.assertEqual(len(rows), session.laps_count + 1)
+
+    def test_npz_loads_with_numpy(self):
+        import numpy as np
+
+        call_command("pack_laps", stdout=io.StringIO())
+        response = self.client.get(reverse("export_sessions"), {"format": "npz"})
+        data = np.load(io.BytesIO(b"".join(response.streaming_content)))
+        for session in Session.objects.filter(user=self.user):
+            columns = storage.load_columns(session)
+            name = f"{session.id}-{session.external_id}"
+            self.assertEqual(data[f"{name}/total"].dtype, np.uint32)
+            self.assertEqual(data[f"{name}/total"].tolist(), list(columns.total))
+            self.assertEqual(data[f"{name}/lap"].tolist(), list(columns.lap))
+
+    def test_single_session_is_scoped_to_owner(self):
+        session = Session.objects.filter(user=self.user).first()
+        response = self.client.get(reverse("export_session", args=[session.id]))
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), session.laps_count + 1)
+
+        self.client.force_login(User.objects.create_user("other", "other@example.com", "secret"))
+        self.assertEqual(self.client.get(reverse("export_session", args=[session.id])).status_code, 404)
+
+
+class BenchmarkTests(Race50TestCase):
+    username = None
+
+    def test_synthetic_csv_is_valid(self):
+        for track in benchmark.TRACK_PROFILES:
+            data = benchmark.synthetic_csv(300, track=track, noise_ms=400, seed=7)
+            errors = ingest.ErrorLog()
+            rows = list(ingest.validate_rows(ingest.open_csv(io.BytesIO(data)), errors))
+            self.assertEqual(len(rows), 300)
+            self.assertEqual(errors.count, 0)
+            self.assertIn("traffic/mistake", {row[8] for row in rows})
+        self.assertEqual(benchmark.synthetic_csv(50), benchmark.synthetic_csv(50))
+
+    def test_command_writes_json_and_leaves_no_rows(self):
+        output = Path(self.enterContext(tempfile.TemporaryDirectory())) / "bench.json"
+        call_command("benchmark", sizes="10,200", repeat=1, output=str(output), stderr=io.StringIO())
+        data = json.loads(output.read_text())
+        self.assertEqual(data["environment"]["database"], "sqlite")
+        self.assertEqual([(r["laps"], r["stage"]) for r in data["results"]],
+                         [(laps, stage) for laps in (10, 200) for stage in benchmark.STAGES])
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+        stderr = io.StringIO()
+        call_command("benchmark", sizes="10", repeat=1, output=str(output), baseline=str(output), stderr=stderr)
+        self.assertEqual(stderr.getvalue().count("x)"), len(benchmark.STAGES))
+
+    def test_render_stage_renders_on_the_server(self):
+        with mock.patch.object(views, "CLIENT_RENDER_MIN_LAPS", 1), \
+                mock.patch.object(views, "lap_table", wraps=views.lap_table) as lap_table:
+            benchmark.bench_size(10, repeat=1)
+        self.assertEqual(lap_table.call_count, 1)
+
+
+@override_settings(RACE50_INSTRUMENTATION_SAMPLE_RATE=1.0)
+class InstrumentationTests(Race50TestCase):
+    def test_sampled_request_reports_server_timing_and_log(self):
+        with self.assertLogs("race50.instrumentation", "INFO") as logs:
+            response = self.client.get(reverse("sessions"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", .*render;dur=')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record["type"], record["view"], record["status"]), ("request", "sessions", 200))
+        self.assertGreater(record["queries"], 0)
+        self.assertIn("context", record["stages"])
+
+    def test_upload_job_records_pipeline_stages(self):
+        with self.assertLogs("race50.instrumentation", "INFO") as logs:
+            self.upload("PLA-2025-09-05-S02.csv")
+        job_record = next(json.loads(r.getMessage()) for r in logs.records if '"upload_job"' in r.getMessage())
+        self.assertEqual(job_record["status"], UploadJob.DONE)
+        self.assertEqual(set(job_record["stages"]), {"sniff", "validate", "stats", "commit"})
+
+    @override_settings(RACE50_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse("sessions"))
+        self.assertNotIn("Server-Timing", response)
+
+
+class CopyIngestTests(Race50TestCase):
+    def test_copy_chunks_match_lap_rows(self):
+        columns = storage.LapColumns()
+        for lap in range(1, 6):
+            columns.append(lap, 10000, 10000, 10000 + lap, 30000 + lap, "clean air" if lap == 2 else "")
+        session = Session(id=7)
+
+        chunks = list(storage.copy_chunks([(session, columns)], size=2))
+        self.assertEqual([rows for (_, rows) in chunks], [2, 2, 1])
+        lines = "".join(buffer.read() for (buffer, _) in chunks).splitlines()
+        self.assertEqual(lines[0], '7,1,10000,10000,10001,30001,"",0,0,1,1,1,"",0')
+        self.assertEqual(lines[1], '7,2,10000,10000,10002,30002,"clean air",1,1,1,1,2,"",0')
+        self.assertTrue(lines[4].startswith('7,5,10000,10000,10005,30005,"",4,4,1,1,5,1.41'))
+
+    def test_copy_only_on_postgresql(self):
+        self.assertFalse(storage.use_copy())
+        self.assertIn('FROM STDIN WITH (FORMAT csv, FORCE_NULL ("rolling_std_ms"))', storage.copy_sql())
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "COPY is only used on PostgreSQL")
+    def test_copy_round_trip(self):
+        notes = {2: 'pit "in", slow', 4: "traffic, then a spin"}
+        columns = storage.LapColumns()
+        for lap in range(1, 8):
+            columns.append(lap, 10000, 10000, 10000 + lap, 30000 + lap, notes.get(lap, ""))
+        session = Session.objects.create(
+            user=self.user, external_id="S1", track="Test Track", date=datetime.date(2025, 9, 1),
+            notes="", **ingest.summary_fields(analytics.summarize(*storage.column_arrays(columns))),
+        )
+        self.assertTrue(storage.use_copy())
+        storage.write_laps([(session, columns)], backend=storage.ROWS)
+
+        laps = list(Lap.objects.filter(session=session).order_by("lap"))
+        self.assertEqual({lap.lap: lap.notes for lap in laps if lap.notes}, notes)
+        self.assertIsNone(laps[0].rolling_std_ms)
+        self.assertIsNotNone(laps[-1].rolling_std_ms)
+        loaded = storage.load_columns(session)
+        self.assertEqual(list(loaded.total), list(columns.total))
+        np.testing.assert_allclose(loaded.metrics["rolling_std"], columns.compute_metrics()["rolling_std"])
+
+
+class SQLiteProfileTests(Race50TestCase):
+    def test_connection_pragmas(self):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 10000)
+            self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(cursor.execute("PRAGMA cache_size").fetchone()[0], -65536)
+        self.assertIsNone(connection.transaction_mode)
+
+    def test_write_transactions_are_serialized(self):
+        import threading
+
+        from . import db
+
+        acquired = []
+        with db.write_transaction():
+            thread = threading.Thread(target=lambda: acquired.append(db._write_lock.acquire(blocking=False)))
+            thread.start()
+            thread.join()
+        self.assertEqual(acquired, [False])
+
+
+@override_settings(RACE50_INSTRUMENTATION_SAMPLE_RATE=0.0)
+class SQLiteTransactionModeTests(TransactionTestCase):
+    @unittest.skipUnless(connection.vendor == "sqlite", "SQLite only")
+    def test_only_write_transactions_begin_immediate(self):
+        from . import db
+
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                User.objects.count()
+            with db.write_transaction():
+                User.objects.create_user("driver")
+        self.assertEqual([query["sql"] for query in queries if query["sql"].startswith("BEGIN")],
+                         ["BEGIN", "BEGIN IMMEDIATE"])
+        self.assertIsNone(connection.transaction_mode)
+
+
+class LeaderboardTests(Race50TestCase):
+    username = None
+
+    def upload(self, username, *lap_times, track="Test Track"):
+        user = User.objects.get_or_create(username=username)[0]
+        return self.ingest_laps("2025-09-01", *lap_times, user=user, track=track)
+
+    def board(self, metric="best_lap", track="Test Track"):
+        return [(row["username"], row["value_ms"]) for row in leaderboards.top(track, metric)]
+
+    def test_top_k_updated_on_upload(self):
+        with mock.patch.object(leaderboards, "LEADERBOARD_SIZE", 2):
+            self.upload("ana", 31000, 30500)
+            self.upload("ben", 30000)
+            self.upload("cai", 32000)
+            self.assertEqual(self.board(), [("ben", 30000), ("ana", 30500)])
+            self.assertFalse(LeaderboardEntry.objects.filter(user__username="cai").exists())
+
+            # An improvement replaces the user's entry and reorders the board
+            session = self.upload("ana", 29900)
+            self.assertEqual(self.board(), [("ana", 29900), ("ben", 30000)])
+            entry = LeaderboardEntry.objects.get(user__username="ana", metric=LeaderboardEntry.BEST_LAP)
+            self.assertEqual(entry.session, session)
+
+            self.upload("cai", 29000)
+            self.assertEqual(self.board(), [("cai", 29000), ("ana", 29900)])
+            self.assertEqual(LeaderboardEntry.objects.filter(metric=LeaderboardEntry.BEST_LAP).count(), 3)
+
+            call_command("compact_leaderboards", stdout=io.StringIO())
+            self.assertEqual(LeaderboardEntry.objects.filter(metric=LeaderboardEntry.BEST_LAP).count(), 2)
+            self.assertEqual(self.board(), [("cai", 29000), ("ana", 29900)])
+            self.assertEqual(self.board("s3"), [("cai", 9000), ("ana", 9900)])
+
+    def test_reads_are_one_query_then_cached(self):
+        for name in ("ana", "ben", "cai"):
+            self.upload(name, 30000 + len(name) * 100, 31000)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(leaderboards.top("Test Track", LeaderboardEntry.TBL)), 3)
+        with self.assertNumQueries(0):
+            leaderboards.top("Test Track", LeaderboardEntry.TBL)
+
+    def test_public_page_and_json(self):
+        self.upload("ana", 30500)
+        self.upload("ben", 30000, track="Other Track")
+        response = self.client.get(reverse("leaderboards"), {"track": "Test Track"})
+        self.assertEqual(response.context["rows"][0]["username"], "ana")
+        self.assertEqual(response.context["tracks"], ["Other Track", "Test Track"])
+
+        data = self.client.get(reverse("leaderboard_json"), {"track": "Other Track", "metric": "tbl"}).json()
+        self.assertEqual([(r["rank"], r["username"], r["value_ms"]) for r in data["results"]], [(1, "ben", 30000)])
+        self.assertEqual(self.client.get(reverse("leaderboard_json")).status_code, 400)
@@ -0,0 +1,78 @@
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+# Lap, sector and gap times repeat constantly, within a session and across
+# the sessions of a track. Single values go through a bounded LRU; whole
+# columns are formatted once per distinct value and expanded with numpy.
+
+FORMAT_CACHE_SIZE = 65536
+# Shorter columns are cheaper as a plain loop over the LRU
+VECTORIZE_MIN = 256
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format_ms(ms):
+    minutes = ms // 60000
+    seconds = (ms % 60000) // 1000
+    millis = ms % 1000
+    return f"{minutes}:{seconds:02d}.{millis:03d}"
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format_delta(ms):
+    sign = "-" if ms < 0 else "+"
+    ms = abs(ms)
+    return f"{sign}{ms // 1000}.{ms % 1000:03d}"
+
+
+def format_ms(ms):
+    """Milliseconds as M:SS.mmm, or "" if `ms` is not a number."""
+    try:
+        ms = int(ms)
+    except (TypeError, ValueError):
+        return ""
+    return _format_ms(ms)
+
+
+def format_delta(ms):
+    """A gap in milliseconds as +S.mmm or -S.mmm, or "" if `ms` is not a number."""
+    try:
+        ms = int(round(float(ms)))
+    except (TypeError, ValueError):
+        return ""
+    return _format_delta(ms)
+
+
+def _integers(values, rounded):
+    # The column as int64 if it converts exactly like the scalar functions
+    # do, else None; object and non-finite columns take the scalar path
+    if not isinstance(values, (np.ndarray, array)):
+        return None
+    values = np.asarray(values)
+    if values.dtype.kind == "i" or (values.dtype.kind == "u" and values.dtype.itemsize < 8):
+        return values.astype(np.int64, copy=False)
+    if rounded and values.dtype.kind == "f" and np.isfinite(values).all():
+        # np.rint rounds half to even, like round()
+        return np.rint(values).astype(np.int64)
+    return None
+
+
+def _format_many(values, scalar, cached, rounded):
+    integers = _integers(values, rounded) if len(values) >= VECTORIZE_MIN else None
+    if integers is None:
+        return [scalar(value) for value in values]
+    distinct, inverse = np.unique(integers, return_inverse=True)
+    formatted = np.array([cached(value) for value in distinct.tolist()], dtype=object)
+    return formatted[inverse].tolist()
+
+
+def format_ms_many(values):
+    """format_ms over a whole column (sequence, array or ndarray), as a list."""
+    return _format_many(values, format_ms, _format_ms, rounded=False)
+
+
+def format_delta_many(values):
+    """format_delta over a whole column (sequence, array or ndarray), as a list."""
+    return _format_many(values, format_delta, _format_delta, rounded=True)
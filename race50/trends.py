@@ -0,0 +1,122 @@
+import datetime
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Session, TrendBucket
+
+PERIODS = (TrendBucket.DAY, TrendBucket.WEEK, TrendBucket.MONTH)
+DEFAULT_PERIOD = TrendBucket.WEEK
+
+# Most recent buckets returned per trend, so reads stay one bounded index
+# range scan however many sessions a user has
+MAX_BUCKETS = getattr(settings, "RACE50_TREND_MAX_BUCKETS", {
+    TrendBucket.DAY: 366,
+    TrendBucket.WEEK: 156,
+    TrendBucket.MONTH: 120,
+})
+
+# Fields a session contributes to its buckets
+SESSION_FIELDS = ("id", "user_id", "track", "date", "laps_count", "avg_lap_ms", "best_lap_ms", "best_s1_ms",
+                  "best_s2_ms", "best_s3_ms", "consistency_percent", "clean_laps_count", "clean_avg_lap_ms",
+                  "clean_consistency_percent")
+
+
+def bucket_start(date, period):
+    """First day of the bucket holding `date`: the day itself, its Monday or the 1st of its month."""
+    if period == TrendBucket.WEEK:
+        return date - datetime.timedelta(days=date.weekday())
+    if period == TrendBucket.MONTH:
+        return date.replace(day=1)
+    return date
+
+
+def apply_session(bucket, session):
+    """Folds one session into a bucket (in memory)."""
+    bucket.add_session(session)
+    bucket.consistency_sum += session.consistency_percent
+    if session.clean_consistency_percent is not None:
+        bucket.clean_consistency_count += 1
+        bucket.clean_consistency_sum += session.clean_consistency_percent
+
+
+def _bucket_keys(session):
+    return [(session.user_id, session.track, period, bucket_start(session.date, period)) for period in PERIODS]
+
+
+def record_sessions(sessions):
+    """
+    Updates the trend buckets of newly created sessions. Must run inside the
+    transaction that creates them; buckets are locked in key order.
+    """
+    groups = {}
+    for session in sessions:
+        for key in _bucket_keys(session):
+            groups.setdefault(key, []).append(session)
+    for (key, group) in sorted(groups.items(), key=lambda item: item[0]):
+        (user_id, track, period, start) = key
+        bucket, _ = TrendBucket.objects.select_for_update().get_or_create(
+            user_id=user_id, track=track, period=period, start=start)
+        for session in group:
+            apply_session(bucket, session)
+        bucket.save()
+
+
+def rebuild(users=None, chunk_size=500):
+    """
+    Recomputes trend buckets from scratch. Sessions are read in chunks of
+    `chunk_size`, ordered by (user, track), and each (user, track)'s
+    buckets are written once all its sessions were folded in. Returns the
+    number of buckets written.
+    """
+    sessions = Session.objects.only(*SESSION_FIELDS).order_by("user_id", "track", "date", "id")
+    buckets = TrendBucket.objects.all()
+    if users is not None:
+        sessions = sessions.filter(user__in=users)
+        buckets = buckets.filter(user__in=users)
+
+    written = 0
+    with transaction.atomic():
+        buckets.delete()
+        iterator = sessions.iterator(chunk_size=chunk_size)
+        for (_, group) in groupby(iterator, key=lambda s: (s.user_id, s.track)):
+            built = {}
+            for session in group:
+                for key in _bucket_keys(session):
+                    if key not in built:
+                        (user_id, track, period, start) = key
+                        built[key] = TrendBucket(user_id=user_id, track=track, period=period, start=start)
+                    apply_session(built[key], session)
+            TrendBucket.objects.bulk_create(built.values(), batch_size=chunk_size)
+            written += len(built)
+    return written
+
+
+def _buckets(user, track, period):
+    limit = MAX_BUCKETS.get(period, MAX_BUCKETS[DEFAULT_PERIOD])
+    return TrendBucket.objects.filter(user=user, track=track, period=period).order_by("-start")[:limit]
+
+
+def as_dict(bucket):
+    return {
+        "start": bucket.start.isoformat(),
+        "sessions": bucket.session_count,
+        "laps": bucket.laps_count,
+        "best_lap_ms": bucket.best_lap_ms,
+        "best_lap_session_id": bucket.best_lap_session_id,
+        "avg_lap_ms": bucket.avg_lap_ms,
+        "clean_avg_lap_ms": bucket.clean_avg_lap_ms,
+        "tbl_ms": bucket.tbl_ms,
+        "consistency_percent": bucket.consistency_percent,
+        "clean_consistency_percent": bucket.clean_consistency_percent,
+    }
+
+
+def series(user, track, period=DEFAULT_PERIOD):
+    """The latest MAX_BUCKETS buckets of a user's track, oldest first."""
+    return list(reversed(_buckets(user, track, period)))
+
+
+async def aseries(user, track, period=DEFAULT_PERIOD):
+    return list(reversed([bucket async for bucket in _buckets(user, track, period)]))
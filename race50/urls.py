@@ -1,12 +1,26 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("upload/", views.upload, name="upload"),
+    path("upload/bulk/", views.upload_bulk, name="upload_bulk"),
+    path("upload/job/<int:job_id>", views.upload_job, name="upload_job"),
     path("sessions", views.sessions, name="sessions"),
     path("session/<int:session_id>", views.session, name="session"),
+    path("session/<int:session_id>.csv", views.export_session, name="export_session"),
+    path("export", views.export_sessions, name="export_sessions"),
+    path("leaderboards", views.leaderboards, name="leaderboards"),
+    path("leaderboards.json", views.leaderboard_json, name="leaderboard_json"),
+    path("trends", views.trends, name="trends"),
+    path("trends.json", views.trends_json, name="trends_json"),
+    path("compare", views.compare, name="compare"),
+    path("compare.json", views.compare_json, name="compare_json"),
     path("guide", views.guide, name="guide"),
+    path("api/sessions", api.sessions, name="api_sessions"),
+    path("api/sessions/<int:session_id>", api.session, name="api_session"),
+    path("api/sessions/<int:session_id>/laps", api.session_laps, name="api_session_laps"),
+    path("api/sessions/<int:session_id>/columns", api.session_columns, name="api_session_columns"),
     path("login/", views.login_view, name="login"),
     path("register/", views.register_view, name="register"),
     path("logout/", views.logout_view, name="logout")
@@ -1,57 +1,113 @@
-import csv
-import datetime
+from asgiref.sync import sync_to_async
 from django import template
+from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError, transaction
-from django.shortcuts import render, HttpResponseRedirect, redirect
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import HttpResponseRedirect, redirect, get_object_or_404
 from django.urls import reverse
-import io
-import math
+from django.utils.dateparse import parse_date
 
 register = template.Library()
 User = get_user_model()
 
-from .models import Session, Lap
-
-# Helper functions
-def try_parse_int_positive(value):
+from .models import Session, UploadJob, LeaderboardEntry, TrackAggregate, TrendBucket
+from . import export
+from .jobs import create_bulk_job, create_job, job_progress, wake
+from .storage import load_columns_many
+from .tables import lap_table
+from .pagination import akeyset_page
+from .aggregates import atrack_aggregate
+from .compare import ALIGN_LAP, ALIGN_MODES, DEFAULT_BEST_N, CompareError, compare_sessions
+from .cache import aget_page, arecent_sessions, aset_page, recent_sessions
+from .instrumentation import render, stage
+from .leaderboards import LEADERBOARD_SIZE, METRICS, top, tracks as leaderboard_tracks
+from .trends import DEFAULT_PERIOD, PERIODS, aseries, as_dict as trend_dict
+
+MAX_UPLOAD_MB = getattr(settings, "RACE50_MAX_UPLOAD_MB", 10)
+MAX_BULK_MB = getattr(settings, "RACE50_BULK_MAX_MB", 200)
+# Sessions offered in the comparison dropdown
+COMPARE_CHOICES_LIMIT = 100
+
+# How the session page builds its lap tables: on the server, in the browser
+# from the compact column payload, or "auto" (client from this many laps).
+# ?render=server|client overrides it per request.
+RENDER_SERVER = "server"
+RENDER_CLIENT = "client"
+RENDER_AUTO = "auto"
+SESSION_RENDER = getattr(settings, "RACE50_SESSION_RENDER", RENDER_AUTO)
+CLIENT_RENDER_MIN_LAPS = getattr(settings, "RACE50_CLIENT_RENDER_MIN_LAPS", 5000)
+SESSIONS_PAGE_SIZE = 50
+# Largest value a BigAutoField primary key can hold
+MAX_ID = 2 ** 63 - 1
+
+
+def _parse_filter_date(value):
     try:
-        num = int(value)
-        if num > 0:
-            return True, num
-        return False, None
+        return parse_date(value or "")
     except ValueError:
-        return False, None
+        return None
 
-def parse_date_safe(s: str):
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
-        try:
-            return datetime.strptime(s.strip(), fmt).date()
-        except Exception:
-            pass
-    return datetime.today().date()
+
+def _parse_id(value):
+    """A session id from a query parameter, or None if it is not a valid one."""
+    value = (value or "").strip()
+    if not (value.isascii() and value.isdigit()):
+        return None
+    pk = int(value)
+    return pk if 0 < pk <= MAX_ID else None
+
+
+def _parse_ids(value):
+    """The valid ids of a comma-separated query parameter, in order."""
+    return [pk for pk in map(_parse_id, (value or "").split(",")) if pk is not None]
+
+
+async def _auser(request):
+    # Resolved up front so templates and context processors never query
+    # lazily from the event loop
+    request.user = await request.auser()
+    return request.user
+
+
+async def _load_sidebar(request):
+    if request.user.is_authenticated:
+        with stage("context"):
+            request._race50_last_five = await arecent_sessions(request.user)
+
+
+async def _alist(queryset):
+    return [row async for row in queryset]
 
 
 # Create your views here.
 def global_context(request):
     if request.user.is_authenticated:
-        last_five = Session.objects.filter(user=request.user).order_by('-created_at')[:5]
+        # Async views load the sidebar before rendering
+        last_five = getattr(request, "_race50_last_five", None)
+        if last_five is None:
+            with stage("context"):
+                last_five = recent_sessions(request.user)
         return {
             "last_five": last_five
         }
     else:
-        last_five = Session.objects.none()
+        last_five = []
         return {
             "last_five": last_five
         }
 
 
-def index(request):
-    if request.user.is_authenticated:
-        session = (Session.objects.filter(user=request.user).order_by('-created_at', '-pk').first())
+async def index(request):
+    user = await _auser(request)
+    if user.is_authenticated:
+        recent = await arecent_sessions(user)
+        request._race50_last_five = recent
+        session = recent[0] if recent else None
         return render(request, "race50/index.html", {
-            "session": session
+            "session": session,
+            "track_stats": await atrack_aggregate(user, session.track) if session else None
         })
     else:
         return render(request, "race50/index.html")
@@ -60,221 +116,332 @@ def index(request):
 @login_required
 def upload(request):
     if request.method != "POST":
-        return render(request, "race50/upload.html")
+        return render(request, "race50/upload.html", {"max_upload_mb": MAX_UPLOAD_MB})
     csv_file = request.FILES.get('csv_file')
     if not csv_file:
-        return render(request, "race50/upload.html", {"message": "No file uploaded."})
+        return render(request, "race50/upload.html", {"message": "No file uploaded.", "max_upload_mb": MAX_UPLOAD_MB})
     if not csv_file.name.lower().endswith(".csv"):
-        return render(request, "race50/upload.html", {"message": "Invalid file extension. File must be '.csv'."})
-    if csv_file.size > 10 * 1024 * 1024:  # 10 MB
-        return render(request, "race50/upload.html", {"message": "File too large (limit: 10MB)."})
-    
-    head = csv_file.file.read(4096)
-    if b"\x00" in head:
-        return render(request, "race50/upload.html", {"message": "File appears to be binary or corrupted."})
-    csv_file.file.seek(0)
-
-    text_stream = io.TextIOWrapper(csv_file.file, encoding="utf-8-sig", errors="replace", newline="")
-    sample = text_stream.read(4096)
-    text_stream.seek(0)
-
-    sniffer = csv.Sniffer()
-    try:
-        dialect = sniffer.sniff(sample, delimiters=[",", ";", "\t"])
-    except csv.Error:
-        dialect = csv.excel
-        dialect.delimiter = ","
-
-    reader = csv.DictReader(text_stream, dialect=dialect)
-    if not reader.fieldnames:
-        return render(request, "race50/upload.html", {"message": "Missing or invalid header."})
-
-    errors = []
-    valid_rows = []
-    row_count = 0
-
-    session_id = "SessionID"
-    track = "Track"
-    date = "Date"
-    lapnum = "Lap"
-    laptime = "LapTime_ms"
-    s1time = "S1_ms"
-    s2time = "S2_ms"
-    s3time = "S3_ms"
-    notes = "Notes"
-
-    file_session_id = None
-
-    for (idx, row) in enumerate(reader, start=2):
-        row_count += 1
-
-        require = [session_id, track, date, lapnum, laptime, s1time, s2time, s3time]
-        if any(row.get(col, "").strip() == "" for col in require):
-            errors.append(f"Row {idx}: missing required fields")
-            continue
-
-        ok_lap, lap = try_parse_int_positive(row[lapnum])
-        ok_total, total = try_parse_int_positive(row[laptime])
-        ok_s1, s1 = try_parse_int_positive(row[s1time])
-        ok_s2, s2 = try_parse_int_positive(row[s2time])
-        ok_s3, s3 = try_parse_int_positive(row[s3time])
-
-        if not (ok_lap and ok_s1 and ok_s2 and ok_s3 and ok_total):
-            errors.append(f"Row {idx}: values must be positive")
-            continue
-
-        # Range check (10s–5min)
-        if not (10000 <= total <= 300000):
-            errors.append(f"Row {idx}: LapTime_ms out of expected range ({total} ms)")
-            continue
-
-        # Consistency check (±2 ms)
-        tolerance_ms = 2
-        delta = abs((s1 + s2 + s3) - total)
-        if delta > tolerance_ms:
-            errors.append(f"Row {idx}: S1_ms+S2_ms+S3_ms != LapTime_ms (Δ={delta} ms)")
-            continue
-
-        # Session ID consistency
-        sid = row[session_id].strip()
-        if file_session_id is None:
-            file_session_id = sid
-        elif sid != file_session_id:
-            errors.append(f"Row {idx}: inconsistent SessionID '{sid}' (expected '{file_session_id}')")
-            continue
-
-        valid_rows.append({
-            "session_id": sid,
-            "track": row[track].strip(),
-            "date": row[date].strip(),
-            "lap": lap,
-            "s1_ms": s1,
-            "s2_ms": s2,
-            "s3_ms": s3,
-            "total_ms": total,
-            "notes": row.get(notes, "").strip(),
+        return render(request, "race50/upload.html", {"message": "Invalid file extension. File must be '.csv'.", "max_upload_mb": MAX_UPLOAD_MB})
+    if csv_file.size > MAX_UPLOAD_MB * 1024 * 1024:
+        return render(request, "race50/upload.html", {"message": f"File too large (limit: {MAX_UPLOAD_MB}MB).", "max_upload_mb": MAX_UPLOAD_MB})
+
+    job = create_job(request.user, csv_file)
+    return redirect("upload_job", job_id=job.id)
+
+
+@login_required
+def upload_bulk(request):
+    if request.method != "POST":
+        return render(request, "race50/upload_bulk.html", {"max_bulk_mb": MAX_BULK_MB})
+    files = request.FILES.getlist('files')
+    if not files:
+        return render(request, "race50/upload_bulk.html", {"message": "No files uploaded.", "max_bulk_mb": MAX_BULK_MB})
+
+    job = create_bulk_job(request.user, files)
+    return redirect("upload_job", job_id=job.id)
+
+
+def _bulk_results(job):
+    sessions = Session.objects.filter(user=job.user).in_bulk([result["session_id"] for result in job.results])
+    return [{**result, "session": sessions[result["session_id"]]}
+            for result in job.results if result["session_id"] in sessions]
+
+
+@login_required
+def upload_job(request, job_id):
+    job = get_object_or_404(UploadJob, user=request.user, id=job_id)
+    if wake(job):
+        job.refresh_from_db()
+    session_url = reverse("session", args=[job.session_id]) if job.session_id else None
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "id": job.id,
+            "status": job.status,
+            "laps_processed": job_progress(job),
+            "message": job.message,
+            "errors": job.errors,
+            "session_url": session_url,
         })
 
-    if not valid_rows:
-        return render(request, "race50/upload.html", {
-            "message": "No valid rows found in the CSV.",
-            "errors": errors
+    if job.kind == UploadJob.BULK and job.is_finished:
+        return render(request, "race50/upload_bulk.html", {
+            "message": job.message,
+            "errors": job.errors,
+            "results": _bulk_results(job),
+            "file_errors": job.file_errors,
+            "max_bulk_mb": MAX_BULK_MB
         })
+    if job.status == UploadJob.DONE and not job.errors:
+        return redirect(session_url)
+    return render(request, "race50/upload_job.html", {
+        "job": job,
+        "laps_processed": job_progress(job),
+        "session_url": session_url
+    })
+
 
-    lap_times = [r["total_ms"] for r in valid_rows]
-    s1_times  = [r["s1_ms"]    for r in valid_rows]
-    s2_times  = [r["s2_ms"]    for r in valid_rows]
-    s3_times  = [r["s3_ms"]    for r in valid_rows]
-
-    bestlap_ms = min(lap_times)
-    worstlap_ms = max(lap_times)
-    avg_lap_ms = sum(lap_times) / len(lap_times)
-    bests1_ms, bests2_ms, bests3_ms = min(s1_times), min(s2_times), min(s3_times)
-    tbl_ms = bests1_ms + bests2_ms + bests3_ms
-
-    mean = avg_lap_ms
-    variance = sum((t - mean) ** 2 for t in lap_times) / len(lap_times)
-    stddev = math.sqrt(variance)
-    consistency_percent = (1 - (stddev / mean)) * 100
-
-    best_row = min(valid_rows, key=lambda r: r["total_ms"])
-    best_lap_number = best_row["lap"]
-
-    summary = {
-        "laps_count": len(valid_rows),
-        "best_lap_ms": bestlap_ms,
-        "best_lap_number": best_lap_number,
-        "worst_lap_ms": worstlap_ms,
-        "avg_lap_ms": avg_lap_ms,
-        "tbl_ms": tbl_ms,
-        "consistency_percent": consistency_percent,
-        "best_s1_ms": bests1_ms,
-        "best_s2_ms": bests2_ms,
-        "best_s3_ms": bests3_ms
-    }
-
-    # local parse (uses your 'import datetime' module)
-    def _parse_date_local(s):
-        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
-            try:
-                return datetime.datetime.strptime(s.strip(), fmt).date()
-            except Exception:
-                pass
-        return datetime.date.today()
-
-    first = valid_rows[0]
-    parsed_date = _parse_date_local(first["date"])
-
-    with transaction.atomic():
-        session_obj = Session.objects.create(
-            user=request.user,
-            external_id=file_session_id,
-            track=first["track"],
-            date=parsed_date,
-            laps_count=summary["laps_count"],
-            best_lap_ms=summary["best_lap_ms"],
-            best_lap_number=summary["best_lap_number"],
-            worst_lap_ms=summary["worst_lap_ms"],
-            avg_lap_ms=int(round(summary["avg_lap_ms"])),
-            tbl_ms=summary["tbl_ms"],
-            consistency_percent=summary["consistency_percent"],
-            notes="",
-        )
-        Lap.objects.bulk_create([
-            Lap(
-                session=session_obj,
-                lap=r["lap"],
-                s1_ms=r["s1_ms"],
-                s2_ms=r["s2_ms"],
-                s3_ms=r["s3_ms"],
-                total_ms=r["total_ms"],
-                notes=r.get("notes", ""),
-            )
-            for r in valid_rows
-        ])
-    return redirect("session", session_id=session_obj.id)
+def _session_render_mode(request):
+    mode = request.GET.get("render") or SESSION_RENDER
+    return mode if mode in (RENDER_SERVER, RENDER_CLIENT) else RENDER_AUTO
+
+
+def _render_session(request, context):
+    """
+    Loads and formats the lap tables, unless the page renders them client
+    side, and renders the session page. Async views call it through
+    sync_to_async: both steps are CPU bound and would block the event loop.
+    """
+    session, compare = context["session"], context["compare"]
+    if not context["client_render"]:
+        with stage("laps"):
+            columns = load_columns_many([s for s in (session, compare) if s is not None])
+            context["laps"] = lap_table(columns[session.id], session.best_lap_number)
+            if compare is not None:
+                context["compare_laps"] = lap_table(columns[compare.id], compare.best_lap_number)
+    return render(request, "race50/session.html", context)
 
 
 @login_required
-def session(request, session_id):
-    session = (Session.objects.get(user=request.user, id=session_id))
-    laps = (Lap.objects.filter(session=session))
-    posibilities = (Session.objects.filter(user=request.user, track=session.track).exclude(id=session_id))
+async def session(request, session_id):
+    user = await _auser(request)
+    compare_pk = _parse_id(request.GET.get("compare"))
+    mode = _session_render_mode(request)
+    page_name = f"session:{session_id}:{compare_pk or ''}:{mode}"
+    if request.method == "GET":
+        content = await aget_page(user.id, page_name)
+        if content is not None:
+            return HttpResponse(content)
 
     if request.method == "POST":
         selected_option_id = request.POST.get("selectedOption")
         if selected_option_id:
-            url = f"{reverse('session', args=[session.id])}?compare={selected_option_id}"
+            url = f"{reverse('session', args=[session_id])}?compare={selected_option_id}"
             return redirect(url)
-        
-    compare_id = request.GET.get("compare")
-    if compare_id:
-        compare = (Session.objects.get(user=request.user, id=compare_id))
-        if compare:
-            compare_laps = (Lap.objects.filter(session=compare))
-    else:
-        compare = None
-        compare_laps = None
-    return render(request, "race50/session.html", {
+
+    # Both sessions, and their packed laps if any, in one query. The reads
+    # below run one after another: sync_to_async runs every ORM call on
+    # the same thread, so gathering them would not overlap anything
+    found = Session.objects.filter(user=user, id__in=[session_id] + ([compare_pk] if compare_pk else []))
+    if mode != RENDER_CLIENT:
+        found = found.select_related("packed_laps")
+    found = {s.id: s for s in await _alist(found)}
+    await _load_sidebar(request)
+    session = found.get(session_id)
+    if session is None:
+        raise Http404("Session not found.")
+    compare = found.get(compare_pk)
+
+    if mode == RENDER_AUTO:
+        longest = max(s.laps_count for s in found.values())
+        mode = RENDER_CLIENT if longest >= CLIENT_RENDER_MIN_LAPS else RENDER_SERVER
+
+    # In client mode the page is a shell and static/race50/js/session.js
+    # renders the tables from the api_session_columns payload
+    posibilities = (Session.objects.filter(user=user, track=session.track)
+                    .exclude(id=session_id).only("id", "track", "date")
+                    .order_by("-date", "-id")[:COMPARE_CHOICES_LIMIT])
+    response = await sync_to_async(_render_session)(request, {
         "session": session,
-        "laps": laps,
-        "posibilities": posibilities,
+        "track_stats": await atrack_aggregate(user, session.track),
+        "laps": None,
+        "posibilities": await _alist(posibilities),
         "compare": compare,
-        "compare_laps": compare_laps
+        "compare_laps": None,
+        "client_render": mode == RENDER_CLIENT
     })
+    await aset_page(user.id, page_name, response.content)
+    return response
+
+
+def _compare_params(request):
+    ids = _parse_ids(request.GET.get("sessions"))
+    mode = request.GET.get("align", ALIGN_LAP)
+    try:
+        n = max(1, int(request.GET.get("n", DEFAULT_BEST_N)))
+    except ValueError:
+        n = DEFAULT_BEST_N
+    return ids, mode, n, request.GET.get("clean") == "1"
 
 
 @login_required
-def sessions(request):
-    sessions = (Session.objects.filter(user=request.user))
+def compare(request):
+    ids, mode, n, clean = _compare_params(request)
+    try:
+        result = compare_sessions(request.user, ids, mode, n, clean)
+    except CompareError as e:
+        return render(request, "race50/compare.html", {
+            "message": str(e),
+            "align_modes": ALIGN_MODES
+        }, status=400)
+    return render(request, "race50/compare.html", {
+        "result": result,
+        "session_ids": ",".join(map(str, ids)),
+        "align_modes": ALIGN_MODES
+    })
+
+
+@login_required
+async def compare_json(request):
+    user = await _auser(request)
+    ids, mode, n, clean = _compare_params(request)
+    try:
+        result = await sync_to_async(compare_sessions)(user, ids, mode, n, clean)
+    except CompareError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(result)
+
+
+def _filtered_sessions(request):
+    track = request.GET.get("track", "").strip()
+    date_from = _parse_filter_date(request.GET.get("date_from"))
+    date_to = _parse_filter_date(request.GET.get("date_to"))
+
+    sessions = Session.objects.filter(user=request.user)
+    if track:
+        sessions = sessions.filter(track=track)
+    if date_from:
+        sessions = sessions.filter(date__gte=date_from)
+    if date_to:
+        sessions = sessions.filter(date__lte=date_to)
+    return sessions, track, date_from, date_to
+
+
+@login_required
+async def sessions(request):
+    user = await _auser(request)
+    sessions, track, date_from, date_to = _filtered_sessions(request)
+    sessions = sessions.values("id", "track", "date", "laps_count", "best_lap_ms", "created_at")
+    tracks = Session.objects.filter(user=user).order_by("track").values_list("track", flat=True).distinct()
+    sessions, next_cursor = await akeyset_page(sessions, request.GET.get("cursor"), SESSIONS_PAGE_SIZE)
+    tracks = await _alist(tracks)
+    await _load_sidebar(request)
+
+    filters = request.GET.copy()
+    filters.pop("cursor", None)
+    if next_cursor:
+        filters["cursor"] = next_cursor
 
     return render(request, "race50/sessions.html", {
-        "sessions": sessions
+        "sessions": sessions,
+        "tracks": tracks,
+        "track": track,
+        "date_from": date_from,
+        "date_to": date_to,
+        "is_first_page": not request.GET.get("cursor"),
+        "next_query": filters.urlencode() if next_cursor else None
+    })
+
+
+@login_required
+def export_sessions(request):
+    fmt = request.GET.get("format", export.CSV)
+    if fmt not in export.FORMATS:
+        raise Http404("Unknown export format.")
+    sessions, track, date_from, date_to = _filtered_sessions(request)
+    ids = _parse_ids(request.GET.get("sessions"))
+    if ids:
+        sessions = sessions.filter(id__in=ids)
+
+    response = export.streaming_response(request, export.export(sessions, fmt), export.CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="race50-sessions.{fmt}"'
+    return response
+
+
+@login_required
+def export_session(request, session_id):
+    session = get_object_or_404(Session, user=request.user, id=session_id)
+    sessions = Session.objects.filter(id=session.id)
+    response = export.streaming_response(request, export.export(sessions, export.CSV), "text/csv")
+    response["Content-Disposition"] = f'attachment; filename="race50-session-{session.id}.csv"'
+    return response
+
+
+def _leaderboard_params(request):
+    metric = request.GET.get("metric", LeaderboardEntry.BEST_LAP)
+    if metric not in METRICS:
+        metric = LeaderboardEntry.BEST_LAP
+    return request.GET.get("track", "").strip(), metric
+
+
+def leaderboards(request):
+    track, metric = _leaderboard_params(request)
+    tracks = leaderboard_tracks()
+    if not track and tracks:
+        track = tracks[0]
+    return render(request, "race50/leaderboards.html", {
+        "tracks": tracks,
+        "track": track,
+        "metric": metric,
+        "metrics": LeaderboardEntry.METRIC_CHOICES,
+        "rows": top(track, metric) if track else [],
+        "size": LEADERBOARD_SIZE
+    })
+
+
+async def leaderboard_json(request):
+    track, metric = _leaderboard_params(request)
+    if not track:
+        return JsonResponse({"error": "Missing 'track'."}, status=400)
+    rows = await sync_to_async(top)(track, metric)
+    return JsonResponse({
+        "track": track,
+        "metric": metric,
+        "size": LEADERBOARD_SIZE,
+        "results": [
+            {
+                "rank": row["rank"],
+                "username": row["username"],
+                "value_ms": row["value_ms"],
+                "achieved_at": row["achieved_at"].isoformat(),
+            }
+            for row in rows
+        ],
+    })
+
+
+def _trend_params(request):
+    period = request.GET.get("period", DEFAULT_PERIOD)
+    if period not in PERIODS:
+        period = DEFAULT_PERIOD
+    return request.GET.get("track", "").strip(), period
+
+
+@login_required
+async def trends(request):
+    user = await _auser(request)
+    track, period = _trend_params(request)
+    tracks = TrackAggregate.objects.filter(user=user).order_by("track").values_list("track", flat=True)
+    tracks = await _alist(tracks)
+    await _load_sidebar(request)
+    if track not in tracks:
+        # Default to the track of the latest upload
+        recent = request._race50_last_five
+        track = recent[0].track if recent else ""
+    return render(request, "race50/trends.html", {
+        "tracks": tracks,
+        "track": track,
+        "period": period,
+        "periods": TrendBucket.PERIOD_CHOICES,
+        "buckets": await aseries(user, track, period) if track else []
+    })
+
+
+@login_required
+async def trends_json(request):
+    user = await _auser(request)
+    track, period = _trend_params(request)
+    if not track:
+        return JsonResponse({"error": "Missing 'track'."}, status=400)
+    return JsonResponse({
+        "track": track,
+        "period": period,
+        "buckets": [trend_dict(bucket) for bucket in await aseries(user, track, period)],
     })
 
 
 def guide(request):
-    return render(request, "race50/guide.html")
+    return render(request, "race50/guide.html", {"max_upload_mb": MAX_UPLOAD_MB})
 
 
 def login_view(request):
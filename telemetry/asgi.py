@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telemetry.settings')
+# Async views run their ORM calls in short-lived threads, so persistent
+# connections would pile up instead of being reused; pool with PgBouncer.
+os.environ.setdefault('RACE50_DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()